@@ -0,0 +1,7 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Offline benchmarks of the CLIP OS Project buildbot configuration (see the
+README file in this directory)."""
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -0,0 +1,173 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Benchmark of the reaction of the buildmaster to the changes of the CLIP OS
+sources.
+
+Bursts of changes (as the merge of a topic spanning several projects would
+produce) are fed to the change-based scheduler of `clipos.schedulers` through
+the buildmaster web hook, in place of the Gerrit stream-events, while the
+first build they trigger is still running. This reports the number of builds
+and build requests these changes resulted in (each burst must make up a
+single build request and the requests pending while the build runs must be
+collapsed into one) and the delay between the last change of the first burst
+and the start of its build (which should not exceed the tree stable timer by
+much).
+
+Usage (from the root of this repository)::
+
+    python3 -m benchmarks.changes --bursts 3 --changes-per-burst 10
+
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+from typing import List, Optional
+
+from . import fixtures
+from .factories import REPOSITORY_DIR, BenchmarkMaster
+
+
+def post_change(www_port: int, project: str, revision: str,
+                branch: str = "master") -> None:
+    """Notify a change of the given project through the web hook of the
+    buildmaster (as a Gerrit replication hook would do)."""
+
+    request = urllib.request.Request(
+        "http://127.0.0.1:{}/change_hook/base".format(www_port),
+        data=urllib.parse.urlencode({
+            "repository": "file:///clipos/{}".format(project),
+            "project": project,
+            "branch": branch,
+            "revision": revision,
+            "author": "Benchmark <benchmark@localhost>",
+            "comments": "Synthetic change of {}".format(project),
+        }).encode())
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def wait_until_idle(master: BenchmarkMaster, builderid: int,
+                    timeout: float) -> None:
+    """Wait for all the build requests of the given builder to complete."""
+
+    deadline = time.monotonic() + timeout
+    while master.api("buildrequests?builderid={}&complete=false".format(
+            builderid))["buildrequests"]:
+        if time.monotonic() > deadline:
+            raise TimeoutError("build requests still pending after {} "
+                               "seconds".format(timeout))
+        time.sleep(1)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python3 -m benchmarks.changes",
+        description=__doc__.split("\n\n")[0])
+    parser.add_argument("--bursts", type=int, default=3,
+                        help="number of bursts of changes")
+    parser.add_argument("--changes-per-burst", type=int, default=10,
+                        help="number of changes (to distinct projects) in "
+                             "each burst")
+    parser.add_argument("--tree-stable-timer", type=int, default=5,
+                        help="tree stable timer (in seconds) of the "
+                             "scheduler")
+    parser.add_argument("--output", help="JSON file where to store results")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the benchmark working directory")
+    args = parser.parse_args(argv)
+
+    # The bursts are spaced beyond the tree stable timer (each of them thus
+    # makes up its own build request) and the first build lasts until all of
+    # them have been received:
+    burst_interval = args.tree_stable_timer + 2
+    build_seconds = (args.tree_stable_timer + burst_interval * args.bursts +
+                     5)
+
+    workdir = tempfile.mkdtemp(prefix="clipos-benchmark-")
+    www_port = fixtures.free_tcp_port()
+    master = BenchmarkMaster(
+        os.path.join(workdir, "master"), www_port,
+        config={
+            "setup_settings_file": "",  # the default settings
+            "www_port": www_port,
+            "manifest_url": "file:///clipos/manifest",
+            "properties": {},
+            "tree_stable_timer": args.tree_stable_timer,
+            "build_seconds": build_seconds,
+        },
+        env={
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(
+                filter(None, [REPOSITORY_DIR,
+                              os.environ.get("PYTHONPATH")])),
+        })
+    try:
+        master.start()
+        builderid = master.api(
+            "builders?name=changes")["builders"][0]["builderid"]
+
+        first_burst_end = 0.0
+        for burst in range(args.bursts):
+            print("Notifying the burst of changes {}/{}...".format(
+                burst + 1, args.bursts))
+            for index in range(args.changes_per_burst):
+                post_change(www_port, "src/project-{:04d}".format(index),
+                            "{:040x}".format(burst * 1000 + index + 1))
+            if burst == 0:
+                first_burst_end = time.time()
+            time.sleep(burst_interval)
+
+        wait_until_idle(master, builderid, timeout=build_seconds * 3)
+        builds = master.api("builders/{}/builds?order=buildid".format(
+            builderid))["builds"]
+        requests = master.api("buildrequests?builderid={}".format(
+            builderid))["buildrequests"]
+    finally:
+        master.stop()
+        if args.keep:
+            print("The benchmark working directory is kept in {}."
+                  .format(workdir))
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "parameters": {
+            "bursts": args.bursts,
+            "changes_per_burst": args.changes_per_burst,
+            "tree_stable_timer": args.tree_stable_timer,
+        },
+        "changes": args.bursts * args.changes_per_burst,
+        "build_requests": len(requests),
+        "builds": len(builds),
+        "reaction_delay": (round(builds[0]["started_at"] - first_burst_end, 1)
+                           if builds else None),
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(output + "\n")
+
+    # One build for the first burst and a single one for all the others:
+    expected_builds = min(args.bursts, 2)
+    if (results["build_requests"] != args.bursts or
+            results["builds"] != expected_builds):
+        print("Expected {} build request(s) and {} build(s)".format(
+            args.bursts, expected_builds), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
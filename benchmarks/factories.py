@@ -0,0 +1,336 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Benchmark of the orchestration of the CLIP OS Project build factories.
+
+The real factories of `clipos.build_factories` are run by a local buildmaster
+and a local worker on a synthetic source tree of the requested size, against
+the artifacts HTTP service of the buildmaster (or a local FTP server, see
+``--transport``) and stand-in tools (see `benchmarks.fixtures`). For each
+benchmarked builder, this reports the number of steps, the duration of each
+step, the end-to-end duration of the build and the orchestration overhead
+(i.e. the time of the build spent outside of any step).
+
+Usage (from the root of this repository)::
+
+    python3 -m benchmarks.factories --projects 50 --files-per-project 200 \\
+        --output benchmarks/results/factories.json
+
+Note that the durations reported by the Buildbot data API are only precise to
+the second: repeat the builds (see ``--repeat``) to get meaningful figures.
+
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from typing import Any, Dict, List, Optional
+
+from buildbot.process.results import SKIPPED
+
+from . import fixtures
+
+
+# The directory of this benchmark and the root of the repository:
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+# The builders to benchmark (in this order: the product build reuses the
+# quick-sync artifacts produced by the first one):
+BENCHMARKED_BUILDERS = ["repo-sync", "clipos"]
+
+# The properties of the benchmarked builds:
+BUILD_PROPERTIES = {
+    "cleanup_workspace": False,
+    "force_repo_quicksync_artifacts_download": True,
+    "buildername_providing_repo_quicksync_artifacts": "repo-sync",
+    "produce_sdks_artifacts": True,
+    "reuse_sdks_artifacts": False,
+    "produce_cache_artifacts": True,
+    "reuse_cache_artifacts": False,
+    "produce_build_artifacts": True,
+    "use_recipe_results_cache": False,
+}
+
+
+class BenchmarkMaster(object):
+    """The local buildmaster running the benchmark configuration (see the
+    "master.cfg" file of this directory)."""
+
+    def __init__(self, basedir: str, www_port: int,
+                 config: Dict[str, Any], env: Dict[str, str]) -> None:
+        self.basedir = basedir
+        self.www_port = www_port
+        self.config = config
+        self.env = env
+        self._process = None  # type: Optional[subprocess.Popen]
+
+    def start(self) -> None:
+        config_file = os.path.join(self.basedir, "benchmark.json")
+        subprocess.run(
+            ["buildbot", "create-master", "--quiet", "--relocatable",
+             "--config", os.path.join(BENCHMARKS_DIR, "master.cfg"),
+             self.basedir],
+            check=True, env=self.env)
+        with open(config_file, "w") as fp:
+            json.dump(self.config, fp)
+        self._process = subprocess.Popen(
+            ["buildbot", "start", "--nodaemon", self.basedir],
+            stdout=open(os.path.join(self.basedir, "master.log"), "w"),
+            stderr=subprocess.STDOUT,
+            env={**self.env, "CLIPOS_BENCHMARK_CONFIG": config_file})
+        fixtures.wait_for_tcp_port(self.www_port, timeout=120)
+
+    def stop(self) -> None:
+        if self._process:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+    def api(self, path: str, payload: Optional[Dict[str, Any]] = None) -> Any:
+        """Query (or post the given JSON-RPC payload to) the REST API."""
+
+        request = urllib.request.Request(
+            "http://127.0.0.1:{}/api/v2/{}".format(self.www_port, path),
+            data=json.dumps(payload).encode() if payload else None,
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    def build(self, builder_name: str, timeout: float) -> Dict[str, Any]:
+        """Force a build of the given builder, wait for it and returns its
+        measurements."""
+
+        builder = self.api("builders?name={}".format(builder_name))
+        builderid = builder["builders"][0]["builderid"]
+        previous_builds = self.api(
+            "builders/{}/builds?field=buildid".format(builderid))["builds"]
+        self.api("forceschedulers/benchmark", {
+            "jsonrpc": "2.0", "id": 1, "method": "force",
+            "params": {"builderid": builderid},
+        })
+
+        deadline = time.monotonic() + timeout
+        while True:
+            builds = self.api(
+                "builders/{}/builds?order=-buildid&limit=1".format(builderid))
+            build = builds["builds"][0] if builds["builds"] else None
+            if (build and len(previous_builds) < build["number"] and
+                    build["complete"]):
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError("build of {} not complete after {} "
+                                   "seconds".format(builder_name, timeout))
+            time.sleep(1)
+
+        steps = self.api("builds/{}/steps".format(build["buildid"]))["steps"]
+        duration = build["complete_at"] - build["started_at"]
+        executed = [step for step in steps
+                    if step["results"] != SKIPPED and step["started_at"]]
+        in_steps = sum(step["complete_at"] - step["started_at"]
+                       for step in executed)
+        return {
+            "results": build["results"],
+            "step_count": len(steps),
+            "executed_step_count": len(executed),
+            "duration": duration,
+            "dispatch_overhead": max(duration - in_steps, 0),
+            "steps": {
+                step["name"]: step["complete_at"] - step["started_at"]
+                for step in executed
+            },
+        }
+
+
+def summarize(measurements: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Returns the medians of the measurements of the builds of a builder."""
+
+    executed = measurements[0]["executed_step_count"]
+    overhead = statistics.median(m["dispatch_overhead"] for m in measurements)
+    return {
+        "builds": len(measurements),
+        "failed_builds": sum(1 for m in measurements if m["results"] != 0),
+        "step_count": measurements[0]["step_count"],
+        "executed_step_count": executed,
+        "duration": statistics.median(m["duration"] for m in measurements),
+        "dispatch_overhead": overhead,
+        "dispatch_overhead_per_step": round(overhead / max(executed, 1), 3),
+        "steps": {
+            name: statistics.median(m["steps"].get(name, 0)
+                                    for m in measurements)
+            for name in measurements[0]["steps"]
+        },
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float) -> List[str]:
+    """Returns the regressions of the results against the baseline: any change
+    of the step counts and any duration grown by more than the given
+    tolerance (as a ratio) and by more than one second."""
+
+    regressions = []
+    for builder, current in results["builders"].items():
+        previous = baseline.get("builders", {}).get(builder)
+        if not previous:
+            continue
+        for key in ("step_count", "executed_step_count"):
+            if current[key] != previous[key]:
+                regressions.append("{}: {} changed from {} to {}".format(
+                    builder, key, previous[key], current[key]))
+        for key in ("duration", "dispatch_overhead"):
+            if (current[key] > previous[key] * (1 + tolerance) and
+                    current[key] - previous[key] > 1):
+                regressions.append("{}: {} grew from {}s to {}s".format(
+                    builder, key, previous[key], current[key]))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python3 -m benchmarks.factories",
+        description=__doc__.split("\n\n")[0])
+    parser.add_argument("--projects", type=int, default=20,
+                        help="number of projects of the source tree")
+    parser.add_argument("--files-per-project", type=int, default=100,
+                        help="number of files in each project")
+    parser.add_argument("--file-size", type=int, default=4096,
+                        help="size (in bytes) of each file")
+    parser.add_argument("--recipe-output-size", type=int, default=1 << 20,
+                        help="size (in bytes) of each output of cosmk")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of builds of each builder")
+    parser.add_argument("--timeout", type=float, default=3600,
+                        help="maximum duration (in seconds) of each build")
+    parser.add_argument("--output", help="JSON file where to store results")
+    parser.add_argument("--baseline",
+                        help="JSON results to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="tolerated duration growth (default: 0.2)")
+    parser.add_argument("--transport", choices=["http", "ftp"],
+                        default="http",
+                        help="how the artifacts are transferred: through "
+                             "the artifacts HTTP service of the buildmaster "
+                             "(default) or through an anonymous FTP server")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the benchmark working directory")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="clipos-benchmark-")
+    artifacts_dir = os.path.join(workdir, "artifacts")
+    ftp = fixtures.FtpServer(artifacts_dir, fixtures.free_tcp_port())
+    master = None  # type: Optional[BenchmarkMaster]
+    try:
+        print("Creating the synthetic source tree in {}...".format(workdir))
+        tree = fixtures.SyntheticSourceTree(
+            os.path.join(workdir, "git"), projects=args.projects,
+            files_per_project=args.files_per_project,
+            file_size=args.file_size)
+        tree.create()
+        standin_bindir = fixtures.create_standin_tools(workdir)
+        if args.transport == "http":
+            artifacts_http_port = fixtures.free_tcp_port()
+            transport_settings = {
+                "BUILDBOT_ARTIFACTS_HTTP_PORT": artifacts_http_port,
+                "BUILDBOT_ARTIFACTS_HTTP_URL": "http://127.0.0.1:{}".format(
+                    artifacts_http_port),
+            }
+        else:
+            ftp.start()
+            transport_settings = {"BUILDBOT_ARTIFACTS_FTP_URL": ftp.url}
+
+        setup_settings_file = os.path.join(workdir, "setup_settings.json")
+        with open(setup_settings_file, "w") as fp:
+            json.dump({
+                "BUILDBOT_ARTIFACTS_DIR": artifacts_dir,
+                **transport_settings,
+                # Features relying on the Dockerized workers volumes:
+                "BUILDBOT_WORKER_ARTIFACTS_CACHE_MAX_SIZE_GIB": 0,
+                "BUILDBOT_WORKSPACE_SNAPSHOTS_MAX_SIZE_GIB": 0,
+            }, fp)
+
+        www_port = fixtures.free_tcp_port()
+        master = BenchmarkMaster(
+            os.path.join(workdir, "master"), www_port,
+            config={
+                "setup_settings_file": setup_settings_file,
+                "www_port": www_port,
+                "manifest_url": tree.manifest_url,
+                "properties": BUILD_PROPERTIES,
+            },
+            env={
+                **os.environ,
+                "PATH": os.pathsep.join([standin_bindir,
+                                         os.environ.get("PATH", "")]),
+                "PYTHONPATH": os.pathsep.join(
+                    filter(None, [REPOSITORY_DIR,
+                                  os.environ.get("PYTHONPATH")])),
+                "COSMK_STANDIN_OUTPUT_BYTES": str(args.recipe_output_size),
+                # The builds (un)install the Git LFS filters globally: keep
+                # the Git configuration of the user out of reach:
+                "GIT_CONFIG_GLOBAL": os.path.join(workdir, "gitconfig"),
+            })
+        master.start()
+
+        results = {
+            "parameters": {
+                "projects": args.projects,
+                "files_per_project": args.files_per_project,
+                "file_size": args.file_size,
+                "recipe_output_size": args.recipe_output_size,
+                "repeat": args.repeat,
+                "transport": args.transport,
+            },
+            "builders": {},
+        }
+        for builder in BENCHMARKED_BUILDERS:
+            measurements = []
+            for iteration in range(args.repeat):
+                print("Building {} ({}/{})...".format(builder, iteration + 1,
+                                                      args.repeat))
+                measurements.append(master.build(builder, args.timeout))
+            results["builders"][builder] = summarize(measurements)
+    finally:
+        if master:
+            master.stop()
+        ftp.stop()
+        if args.keep:
+            print("The benchmark working directory is kept in {}."
+                  .format(workdir))
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(output + "\n")
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: {}".format(regression), file=sys.stderr)
+        status = 1 if regressions else 0
+    for builder, summary in results["builders"].items():
+        if summary["failed_builds"]:
+            print("{}: {} build(s) failed".format(builder,
+                                                  summary["failed_builds"]),
+                  file=sys.stderr)
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -0,0 +1,303 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Stand-ins for the services and tools the build factories rely on (the Git
+server hosting the manifest and the projects, the artifacts FTP server, sudo,
+the CLIP OS toolkit, etc.) in order to run the builds on a single machine
+without any network access."""
+
+import os
+import random
+import socket
+import stat
+import subprocess
+import sys
+import textwrap
+import time
+
+from typing import Dict, List, Optional
+
+
+def free_tcp_port() -> int:
+    """Returns a TCP port currently available on the loopback interface."""
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_tcp_port(port: int, timeout: float = 30) -> None:
+    """Wait for something to listen on the given TCP port of the loopback
+    interface."""
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(
+                    "nothing listens on port {} after {} seconds".format(
+                        port, timeout))
+            time.sleep(0.2)
+
+
+def _write_executable(path: str, contents: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        fp.write(textwrap.dedent(contents).lstrip())
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP |
+             stat.S_IXOTH)
+
+
+def _git(*args: str, cwd: Optional[str] = None) -> None:
+    subprocess.run(
+        ["git", "-c", "init.defaultBranch=master",
+         "-c", "user.name=Benchmark", "-c", "user.email=benchmark@localhost",
+         *args],
+        cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+
+
+class SyntheticSourceTree(object):
+    """A CLIP OS like source tree made of a repo manifest, a stand-in toolkit
+    and synthetic projects, all hosted as bare Git repositories in a local
+    directory.
+
+    :param directory: the directory where to create the Git repositories
+    :param projects: the number of synthetic projects
+    :param files_per_project: the number of files in each synthetic project
+    :param file_size: the size (in bytes) of each of these files
+    :param seed: the seed of the contents of the files (for the trees to be
+        identical from one benchmark run to another)
+
+    """
+
+    # The stand-in toolkit: its activation script makes the stand-in "cosmk"
+    # available, which simulates the outputs of the recipe actions (with the
+    # size and the duration given by the environment):
+    TOOLKIT_FILES = {
+        "activate": r"""
+            # Stand-in for the CLIP OS toolkit activation script
+            export PATH="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)/bin:${PATH}"
+            """,
+        "setup.sh": r"""
+            #!/usr/bin/env bash
+            # Stand-in for the CLIP OS toolkit setup script
+            echo "Nothing to set up for the stand-in toolkit."
+            """,
+        "bin/cosmk": r"""
+            #!/usr/bin/env bash
+            # Stand-in for cosmk: produces the outputs of the recipe actions
+            set -e -u -o pipefail
+
+            action="${1:?}" recipe="${2:?}"
+            case "${action}" in
+                bootstrap|build) dir="cache/${recipe%/*}/0.0.0/${recipe#*/}" ;;
+                image|configure|bundle) dir="out/${recipe%/*}/0.0.0/${recipe#*/}/${action}" ;;
+                *) echo >&2 "Unsupported cosmk action: ${action}"; exit 1 ;;
+            esac
+            mkdir -p "${dir}"
+            head -c "${COSMK_STANDIN_OUTPUT_BYTES:-1048576}" /dev/urandom \
+                > "${dir}/${action}.bin"
+            sleep "${COSMK_STANDIN_SECONDS:-0}"
+            """,
+    }
+
+    # One synthetic project out of this number is in the "lfs" repo group
+    # (its files being then tracked by Git LFS):
+    LFS_PROJECTS_EVERY = 10
+
+    def __init__(self, directory: str, projects: int,
+                 files_per_project: int, file_size: int,
+                 seed: int = 0) -> None:
+        self.directory = directory
+        self.projects = projects
+        self.files_per_project = files_per_project
+        self.file_size = file_size
+        self.seed = seed
+
+    @property
+    def manifest_url(self) -> str:
+        return "file://{}".format(os.path.join(self.directory, "manifest.git"))
+
+    def create(self) -> None:
+        """Create the Git repositories of the source tree."""
+
+        rng = random.Random(self.seed)
+        self._createProject("toolkit", {
+            path: textwrap.dedent(contents).lstrip().encode()
+            for path, contents in self.TOOLKIT_FILES.items()
+        }, executables=["setup.sh", "bin/cosmk"])
+        project_names = []  # type: List[str]
+        for index in range(self.projects):
+            name = "src/project-{:04d}".format(index)
+            files = {
+                "file-{:04d}".format(number): rng.getrandbits(
+                    8 * self.file_size).to_bytes(self.file_size, "little")
+                for number in range(self.files_per_project)
+            }
+            if index % self.LFS_PROJECTS_EVERY == 0:
+                files[".gitattributes"] = b"file-* filter=lfs -text\n"
+            self._createProject(name, files)
+            project_names.append(name)
+
+        manifest = "\n".join([
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            "<manifest>",
+            '  <remote name="local" fetch="file://{}"/>'.format(
+                self.directory),
+            '  <default remote="local" revision="master"/>',
+            '  <project name="toolkit" path="toolkit"/>',
+            # As in CLIP OS, some projects are backed by Git LFS:
+            *('  <project name="{0}" path="{0}"{1}/>'.format(
+                name, ' groups="lfs"' if index % self.LFS_PROJECTS_EVERY == 0
+                else "") for index, name in enumerate(project_names)),
+            "</manifest>",
+            "",
+        ])
+        self._createProject("manifest", {"default.xml": manifest.encode()})
+
+    def _createProject(self, name: str, files: Dict[str, bytes],
+                       executables: Optional[List[str]] = None) -> None:
+        worktree = os.path.join(self.directory, ".worktrees", name)
+        for path, contents in files.items():
+            os.makedirs(os.path.dirname(os.path.join(worktree, path)),
+                        exist_ok=True)
+            with open(os.path.join(worktree, path), "wb") as fp:
+                fp.write(contents)
+        for path in executables or []:
+            os.chmod(os.path.join(worktree, path), 0o755)
+        _git("init", "--quiet", worktree)
+        _git("add", "--all", cwd=worktree)
+        _git("commit", "--quiet", "--message", "Synthetic contents",
+             cwd=worktree)
+        _git("clone", "--quiet", "--bare", worktree,
+             os.path.join(self.directory, name + ".git"))
+
+
+def create_standin_tools(directory: str) -> str:
+    """Create in the given directory the stand-ins for the tools expected on
+    the Dockerized workers that cannot be used as is by a local worker and
+    returns the path to prepend to the PATH of the worker."""
+
+    bindir = os.path.join(directory, "bin")
+    # The local worker runs unprivileged:
+    _write_executable(os.path.join(bindir, "sudo"), r"""
+        #!/bin/sh
+        # Stand-in for sudo: run the command as is
+        while [ "$#" -gt 0 ]; do
+            case "$1" in
+                -E|-H|-n) shift ;;
+                *) break ;;
+            esac
+        done
+        exec "$@"
+        """)
+    # The synthetic source tree has no Git LFS objects:
+    if not any(os.access(os.path.join(path, "git-lfs"), os.X_OK)
+               for path in os.environ.get("PATH", "").split(os.pathsep)):
+        _write_executable(os.path.join(bindir, "git-lfs"), r"""
+            #!/usr/bin/env python3
+            # Stand-in for git-lfs: there are no Git LFS objects to handle but
+            # the filters pass the files through and the Git LFS directory of
+            # the repositories is set up as git-lfs does
+
+            import os
+            import subprocess
+            import sys
+
+            def git(*args):
+                return subprocess.run(["git", *args], stdout=subprocess.PIPE,
+                                      universal_newlines=True).stdout.strip()
+
+            def read_packet():
+                length = int(sys.stdin.buffer.read(4), 16)
+                return sys.stdin.buffer.read(length - 4) if length else None
+
+            def read_packets():
+                packet = read_packet()
+                while packet is not None:
+                    yield packet
+                    packet = read_packet()
+
+            def write_packets(*packets):
+                for packet in packets:
+                    for offset in range(0, max(len(packet), 1), 65516):
+                        chunk = packet[offset:offset + 65516]
+                        sys.stdout.buffer.write(
+                            b"%04x" % (len(chunk) + 4) + chunk)
+                sys.stdout.buffer.write(b"0000")
+                sys.stdout.buffer.flush()
+
+            def filter_process():
+                # See the long running filter process protocol in
+                # gitattributes(5):
+                list(read_packets())
+                write_packets(b"git-filter-server\n", b"version=2\n")
+                list(read_packets())
+                write_packets(b"capability=clean\n", b"capability=smudge\n")
+                while sys.stdin.buffer.peek(1):
+                    list(read_packets())
+                    content = b"".join(read_packets())
+                    write_packets(b"status=success\n")
+                    write_packets(*([content] if content else []))
+                    write_packets()
+
+            command = sys.argv[1] if len(sys.argv) > 1 else None
+            if command == "install":
+                git("config", "--global", "filter.lfs.clean",
+                    "git-lfs clean -- %f")
+                git("config", "--global", "filter.lfs.smudge",
+                    "git-lfs smudge -- %f")
+                git("config", "--global", "filter.lfs.process",
+                    "git-lfs filter-process")
+            elif command == "uninstall":
+                if "--system" not in sys.argv:
+                    git("config", "--global", "--remove-section", "filter.lfs")
+            elif command in ("clean", "smudge", "filter-process",
+                             "checkout", "fetch", "pull"):
+                os.makedirs(os.path.join(git("rev-parse", "--absolute-git-dir"),
+                                         "lfs", "objects"), exist_ok=True)
+                if command == "filter-process":
+                    filter_process()
+                elif command in ("clean", "smudge"):
+                    sys.stdout.buffer.write(sys.stdin.buffer.read())
+            """)
+    return bindir
+
+
+class FtpServer(object):
+    """A local anonymous FTP server with write access (from pyftpdlib) in
+    place of the buildmaster artifacts FTP server.
+
+    :param directory: the directory to serve
+    :param port: the TCP port to listen to on the loopback interface
+
+    """
+
+    def __init__(self, directory: str, port: int) -> None:
+        self.directory = directory
+        self.port = port
+        self._process = None  # type: Optional[subprocess.Popen]
+
+    @property
+    def url(self) -> str:
+        return "ftp://127.0.0.1:{}".format(self.port)
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "pyftpdlib", "--interface", "127.0.0.1",
+             "--port", str(self.port), "--directory", self.directory,
+             "--write"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for_tcp_port(self.port)
+
+    def stop(self) -> None:
+        if self._process:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Benchmark of the loading of the buildmaster configuration (i.e. of what
+``buildbot reconfig`` evaluates).
+
+The "master.py" configuration of this repository is loaded repeatedly with the
+Buildbot configuration loader, in the same process (as on a reconfig, the
+modules of the `clipos` package are therefore only imported once). This
+reports the duration of the loads and the number of DNS resolutions of the
+buildmaster host name done while loading (which must remain zero: these may
+block on an unresponsive DNS server). The number of worker flavors can be
+inflated with synthetic copies of the existing ones to check how the loading
+scales with the number of flavors.
+
+Usage (from the root of this repository)::
+
+    python3 -m benchmarks.reconfig --repeat 10 --flavors 20 \\
+        --output benchmarks/results/reconfig.json
+
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+from typing import Any, Callable, Dict, List, Optional
+
+# The directory of this benchmark and the root of the repository:
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+
+def config_loader(basedir: str, filename: str) -> Callable[[], Any]:
+    """Returns a callable loading the given buildmaster configuration file the
+    way the buildmaster does upon start and reconfig."""
+
+    try:
+        from buildbot.config.master import FileLoader  # Buildbot >= 3.0
+    except ImportError:
+        from buildbot.config import FileLoader
+    return FileLoader(basedir, filename).loadConfig
+
+
+def inflate_flavors(count: int) -> None:
+    """Add synthetic copies of the Docker latent worker flavors until there
+    are the given number of flavors."""
+
+    import clipos.workers
+    flavors = clipos.workers.DockerLatentWorker.FLAVORS
+    originals = list(flavors.items())
+    index = 0
+    while len(flavors) < count:
+        name, props = originals[index % len(originals)]
+        flavors["{}-synthetic{}".format(name, index)] = dict(props)
+        index += 1
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python3 -m benchmarks.reconfig",
+        description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="number of loads of the configuration")
+    parser.add_argument("--flavors", type=int, default=0,
+                        help="number of worker flavors (default: only the "
+                             "actual ones)")
+    parser.add_argument("--setup-settings",
+                        help="setup settings JSON file to load the "
+                             "configuration with (default: none, i.e. the "
+                             "default settings)")
+    parser.add_argument("--output", help="JSON file where to store results")
+    parser.add_argument("--baseline",
+                        help="JSON results to compare the results against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="tolerated duration growth (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    # The configuration is loaded from a scratch buildmaster base directory
+    # (for the relative paths used in the configuration to resolve there):
+    basedir = tempfile.mkdtemp(prefix="clipos-reconfig-benchmark-")
+    getfqdn = socket.getfqdn
+    try:
+        shutil.copy(os.path.join(REPOSITORY_DIR, "master.py"), basedir)
+        if args.setup_settings:
+            shutil.copy(args.setup_settings,
+                        os.path.join(basedir, "setup_settings.json"))
+        sys.path.insert(0, REPOSITORY_DIR)
+        os.chdir(basedir)
+        inflate_flavors(args.flavors)
+        load = config_loader(basedir, "master.py")
+
+        # Twisted resolves the host name once upon the import of its SMTP
+        # module (used by the mail notifiers of the configuration): this is
+        # not up to the configuration loading.
+        import twisted.mail.smtp
+
+        dns_resolutions = 0
+
+        def counting_getfqdn(*fargs: Any, **fkwargs: Any) -> str:
+            nonlocal dns_resolutions
+            dns_resolutions += 1
+            return getfqdn(*fargs, **fkwargs)
+        socket.getfqdn = counting_getfqdn
+
+        durations = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            master_config = load()
+            durations.append(time.perf_counter() - start)
+    finally:
+        socket.getfqdn = getfqdn
+        os.chdir(REPOSITORY_DIR)
+        shutil.rmtree(basedir, ignore_errors=True)
+
+    import clipos.workers
+    results = {
+        "parameters": {
+            "repeat": args.repeat,
+            "flavors": len(clipos.workers.DockerLatentWorker.FLAVORS),
+        },
+        "builders": len(master_config.builders),
+        "workers": len(master_config.workers),
+        "first_load": round(durations[0], 4),
+        "load": round(statistics.median(durations), 4),
+        "dns_resolutions": dns_resolutions,
+    }  # type: Dict[str, Any]
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(output + "\n")
+
+    status = 0
+    if dns_resolutions:
+        print("The configuration loading resolved the buildmaster host name "
+              "{} time(s)".format(dns_resolutions), file=sys.stderr)
+        status = 1
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+        if (baseline.get("parameters") == results["parameters"] and
+                results["load"] > baseline["load"] * (1 + args.tolerance)):
+            print("REGRESSION: load grew from {}s to {}s".format(
+                baseline["load"], results["load"]), file=sys.stderr)
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
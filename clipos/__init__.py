@@ -7,9 +7,14 @@
 # convenience and avoid the need to import all the interesting sub-modules of
 # this package constantly.
 from . import (
+    artifacts,
     build_factories,
     buildmaster,
+    capacity,
     commons,
+    janitor,
+    metrics,
+    schedulers,
     workers,
 )
 
@@ -0,0 +1,495 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Buildmaster service exposing the artifacts directory to the workers over
+HTTP in place of an anonymous FTP server (see the "scripts/artifacts.sh" file
+for the client side).
+
+The service supports the following requests on the paths of the artifacts
+directory:
+
+``GET`` and ``HEAD``
+    Retrieve a file. Range requests are honored: the workers resume the
+    interrupted downloads from where they stopped and fetch the large blobs
+    as several segments in parallel. The files are streamed from the disk by
+    chunks (with flow control), they are never loaded in memory.
+
+``PUT``
+    Store a file. Without a ``Content-Range`` header, the body is stored as
+    the whole file. With a ``Content-Range: bytes <first>-<last>/<length>``
+    header, the body is written at the given offset of the ``<path>.part``
+    partial file (which must be of ``<first>`` bytes unless ``<first>`` is 0)
+    and the partial file is renamed into the file once its last byte has been
+    received: the workers upload the large files by chunks and resume the
+    interrupted uploads from the size of the partial file. A blob is only
+    stored if its contents match its digest.
+
+``MOVE``
+    Rename a file streamed into the ``objects/.staging`` directory into the
+    blob given by the ``Destination`` header (if its contents match the
+    digest of the blob).
+
+``DELETE``
+    Remove a file streamed into the ``objects/.staging`` directory.
+
+The workers can only store the blobs (``objects/<xx>/<digest>``), the files
+streamed into the ``objects/.staging`` directory, the manifests of the staged
+builds (``<type>/<buildername>/.staging/<buildnumber>/<file>``) and the recipe
+results (``recipe-results/<fingerprint>/<file>``): the published build
+directories and their "latest" symlinks are only ever modified by the
+buildmaster (see the factories). The service does not authenticate the
+workers and must therefore only listen on the network of the workers.
+
+The request bodies are written by the reactor as they are received into
+temporary files of the ``objects/.staging`` directory (see `ArtifactsSpool`),
+their SHA-256 digest being computed meanwhile. Once a body is complete, it is
+either renamed into place or copied at its offset into the partial file (which
+is then renamed into place once complete) in a thread, as are all the other
+disk operations on the artifacts: a partially written file is never exposed
+under its final name. A stored blob is never replaced (an upload of the same
+blob is dropped instead).
+
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+import urllib.parse
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from buildbot.util import service
+from twisted.internet import defer, reactor, threads
+from twisted.python import log
+from twisted.web import http, resource, server, static
+
+from .janitor import (OBJECTS_SUBDIRECTORY, RECIPE_RESULTS_SUBDIRECTORY,
+                      STAGING_SUBDIRECTORY)
+
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+def file_digest(path: str) -> str:
+    """Returns the SHA-256 digest of the file of the given path."""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactsSpool(object):
+    """The body of a request on the artifacts site, written as it is received
+    into a temporary file of the given directory (created upon the first
+    bytes received) while its digest is computed.
+
+    The temporary file is removed once the request is done unless the request
+    has claimed it (see `claim`): it is then up to the request to either move
+    it into the artifacts directory, copy it or discard it.
+
+    :param directory: the directory where to create the temporary file
+
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.file = None  # type: Any
+        self.size = 0
+        self.claimed = False
+        self._digest = hashlib.sha256()
+
+    @property
+    def path(self) -> Optional[str]:
+        return self.file.name if self.file is not None else None
+
+    def write(self, data: bytes) -> None:
+        if self.file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.file = tempfile.NamedTemporaryFile(
+                dir=self.directory, prefix=".request.", suffix=".part",
+                delete=False)
+        self.file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+
+    def tell(self) -> int:
+        return self.size
+
+    def seek(self, offset: int, whence: int = 0) -> None:
+        pass  # the body is only read back through its path
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    def claim(self) -> None:
+        """Take over the temporary file once the body is completely received
+        (see the class documentation)."""
+
+        self.claimed = True
+        if self.file is not None:
+            self.file.close()
+
+    def moveTo(self, path: str) -> None:
+        """Rename the temporary file into the given path."""
+
+        if self.file is None:
+            open(path, "wb").close()  # empty body
+            return
+        os.replace(self.file.name, path)
+        self.file = None
+
+    def copyTo(self, fp: Any) -> None:
+        """Copy the body into the given file (at its current offset)."""
+
+        if self.file is not None:
+            with open(self.file.name, "rb") as body:
+                shutil.copyfileobj(body, fp, 1 << 20)
+
+    def discard(self) -> None:
+        """Remove the temporary file (if any)."""
+
+        if self.file is None:
+            return
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except FileNotFoundError:
+            pass
+        self.file = None
+
+    def close(self) -> None:
+        if not self.claimed:
+            self.discard()
+
+
+class ArtifactsRequest(server.Request):
+    """HTTP request writing its body into the artifacts directory as it is
+    received (see `ArtifactsSite.getContentFile`) rather than into memory or
+    into the temporary directory of the buildmaster."""
+
+    def gotLength(self, length: Optional[int]) -> None:
+        # The Twisted releases not consulting the site are covered as well:
+        self.content = self.channel.site.getContentFile(length)
+
+
+class ArtifactsResource(resource.Resource):
+    """The resource of the artifacts site handling the requests on all the
+    paths of the artifacts directory (see the module documentation).
+
+    :param artifacts_dir: the artifacts directory
+
+    """
+
+    isLeaf = True
+
+    def __init__(self, artifacts_dir: str) -> None:
+        super().__init__()
+        self.artifacts_dir = os.path.realpath(artifacts_dir)
+        # The directory of the request bodies being received (on the same
+        # filesystem as the artifacts for them to be renamed into place):
+        self.spool_dir = os.path.join(self.artifacts_dir, OBJECTS_SUBDIRECTORY,
+                                      STAGING_SUBDIRECTORY)
+        # The locks serializing the operations on each file:
+        self._locks = {}  # type: Dict[str, defer.DeferredLock]
+
+    def _localPath(self, path: str) -> Optional[str]:
+        """Returns the local path of the given (URL-encoded) request path or
+        None if this path lies outside of the artifacts directory."""
+
+        segments = [segment for segment in
+                    urllib.parse.unquote(path).split("/") if segment]
+        if any(segment in (".", "..") or "\0" in segment
+               for segment in segments):
+            return None
+        local_path = os.path.join(self.artifacts_dir, *segments)
+        # The symlinks (e.g. "latest") must not lead outside either:
+        real_path = os.path.realpath(local_path)
+        if (real_path != self.artifacts_dir and
+                not real_path.startswith(self.artifacts_dir + os.sep)):
+            return None
+        return local_path
+
+    def _kind(self, path: Optional[str]) -> Optional[str]:
+        """Returns the kind of the file of the given local path that the
+        workers can modify ("blob", "streamed", "manifest" or "recipe") or
+        None if they cannot modify it (see the module documentation)."""
+
+        # The files reached through a symlink (e.g. "latest") are never
+        # modified:
+        if path is None or os.path.realpath(path) != path:
+            return None
+        segments = os.path.relpath(path, self.artifacts_dir).split(os.sep)
+        if segments[0] == OBJECTS_SUBDIRECTORY and len(segments) == 3:
+            return ("streamed" if segments[1] == STAGING_SUBDIRECTORY
+                    else "blob")
+        elif segments[0] == RECIPE_RESULTS_SUBDIRECTORY and len(segments) == 3:
+            return "recipe"
+        elif len(segments) == 5 and segments[2] == STAGING_SUBDIRECTORY:
+            return "manifest"
+        return None
+
+    @staticmethod
+    def _error(request: server.Request, code: int, message: str) -> bytes:
+        request.setResponseCode(code)
+        request.setHeader(b"content-type", b"text/plain; charset=utf-8")
+        return "{}\n".format(message).encode()
+
+    def _serialized(self, path: str, function: Callable[..., Any],
+                    *args: Any) -> defer.Deferred:
+        """Run the given function in a thread once the previous operations on
+        the given path are done."""
+
+        lock = self._locks.setdefault(path, defer.DeferredLock())
+
+        def release(result: Any) -> Any:
+            if not lock.locked and not lock.waiting:
+                self._locks.pop(path, None)
+            return result
+
+        return lock.run(threads.deferToThread, function, *args).addBoth(
+            release)
+
+    def _respond(self, request: server.Request, d: defer.Deferred) -> int:
+        """Respond to the request with the code and the message given by the
+        result of the given deferred."""
+
+        disconnected = []  # type: List[bool]
+        request.notifyFinish().addErrback(
+            lambda _: disconnected.append(True))
+
+        def respond(result: Tuple[int, str]) -> None:
+            if not disconnected:
+                request.write(self._error(request, *result))
+                request.finish()
+
+        def fail(failure: Any) -> None:
+            log.err(failure, "while handling {} {!r} on the artifacts site"
+                    .format(request.method.decode(), request.path))
+            respond((http.INTERNAL_SERVER_ERROR, "Internal server error"))
+
+        d.addCallbacks(respond, fail)
+        return server.NOT_DONE_YET
+
+    def render_GET(self, request: server.Request) -> Any:
+        path = self._localPath(request.path.decode())
+        if path is None or not os.path.isfile(path):
+            return self._error(request, http.NOT_FOUND, "No such file")
+        return static.File(path, defaultType="application/octet-stream"
+                           ).render_GET(request)
+
+    render_HEAD = render_GET
+
+    def render_PUT(self, request: server.Request) -> Any:
+        spool = request.content
+        spool.claim()
+        path = self._localPath(request.path.decode())
+        kind = self._kind(path)
+        if kind is None:
+            spool.discard()
+            return self._error(request, http.FORBIDDEN, "Forbidden path")
+
+        content_range = None
+        header = request.getHeader(b"content-range")
+        if header is not None:
+            match = CONTENT_RANGE_RE.match(header.decode().strip())
+            if match:
+                first, last = int(match.group(1)), int(match.group(2))
+                length = (None if match.group(3) == "*"
+                          else int(match.group(3)))
+                if first <= last and (length is None or last < length):
+                    content_range = (first, last, length)
+            if content_range is None:
+                spool.discard()
+                return self._error(request, http.BAD_REQUEST,
+                                   "Invalid Content-Range header")
+
+        return self._respond(request, self._serialized(
+            path, self._store, path, kind, content_range, spool))
+
+    def render_MOVE(self, request: server.Request) -> Any:
+        source = self._localPath(request.path.decode())
+        header = request.getHeader(b"destination")
+        destination = self._localPath(
+            urllib.parse.urlsplit(header.decode()).path) if header else None
+        if (self._kind(source) != "streamed" or
+                self._kind(destination) != "blob"):
+            return self._error(request, http.FORBIDDEN, "Forbidden path")
+        return self._respond(request, self._serialized(
+            destination, self._move, source, destination))
+
+    def render_DELETE(self, request: server.Request) -> Any:
+        path = self._localPath(request.path.decode())
+        if self._kind(path) != "streamed":
+            return self._error(request, http.FORBIDDEN, "Forbidden path")
+        return self._respond(request, self._serialized(
+            path, self._remove, path))
+
+    @staticmethod
+    def _store(path: str, kind: str,
+               content_range: Optional[Tuple[int, int, Optional[int]]],
+               spool: ArtifactsSpool) -> Tuple[int, str]:
+        try:
+            # A stored blob may be linked from elsewhere, it is never
+            # replaced:
+            if kind == "blob" and os.path.isfile(path):
+                return http.OK, "Already stored"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            if content_range is None:
+                if (kind == "blob" and
+                        spool.hexdigest() != os.path.basename(path)):
+                    return (http.BAD_REQUEST,
+                            "Body not matching the digest of the blob")
+                spool.moveTo(path)
+                return http.CREATED, "Stored"
+
+            first, last, length = content_range
+            if spool.size != last - first + 1:
+                return (http.BAD_REQUEST, "Body not matching the "
+                        "Content-Range header ({} byte(s))".format(spool.size))
+            partial = path + ".part"
+            size = os.path.getsize(partial) if os.path.isfile(partial) else 0
+            if first != 0 and first != size:
+                return (http.CONFLICT, "Upload offset mismatch: {} byte(s) "
+                        "received so far".format(size))
+            with open(partial, "r+b" if first else "wb") as fp:
+                fp.seek(first)
+                spool.copyTo(fp)
+            if length is None or last + 1 != length:
+                return http.ACCEPTED, "Received bytes {}-{}".format(first,
+                                                                    last)
+
+            if (kind == "blob" and
+                    file_digest(partial) != os.path.basename(path)):
+                os.unlink(partial)
+                return (http.BAD_REQUEST,
+                        "Upload not matching the digest of the blob")
+            os.replace(partial, path)
+            return http.CREATED, "Stored"
+        finally:
+            spool.discard()
+
+    @staticmethod
+    def _move(source: str, destination: str) -> Tuple[int, str]:
+        if not os.path.isfile(source):
+            return http.NOT_FOUND, "No such file"
+        if file_digest(source) != os.path.basename(destination):
+            return (http.BAD_REQUEST,
+                    "File not matching the digest of the blob")
+        if os.path.isfile(destination):
+            os.unlink(source)
+            return http.OK, "Already stored"
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(source, destination)
+        return http.CREATED, "Moved"
+
+    @staticmethod
+    def _remove(path: str) -> Tuple[int, str]:
+        if os.path.isdir(path) and not os.path.islink(path):
+            return http.CONFLICT, "Not a file"
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return http.OK, "Already absent"
+        return http.OK, "Removed"
+
+
+class ArtifactsSite(server.Site):
+    """The HTTP site exposing the given artifacts directory (see the module
+    documentation)."""
+
+    def __init__(self, artifacts_dir: str) -> None:
+        super().__init__(ArtifactsResource(artifacts_dir),
+                         requestFactory=ArtifactsRequest)
+
+    def getContentFile(self, length: Optional[int]) -> ArtifactsSpool:
+        return ArtifactsSpool(self.resource.spool_dir)
+
+
+class ArtifactsService(service.BuildbotService):
+    """Buildmaster service exposing the artifacts directory to the workers on
+    ``http://<interface>:<port>/`` (see the module documentation).
+
+    :param artifacts_dir: the artifacts directory
+    :param port: the TCP port to listen to
+    :param interface: the interface to listen on (the one of the network of
+        the workers, see the module documentation)
+
+    """
+
+    name = "clipos-artifacts"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self.artifacts_dir = None  # type: Optional[str]
+        self.port = None  # type: Optional[int]
+        self.interface = None  # type: Optional[str]
+        self._listening_port = None  # type: Any
+        super().__init__(*args, **kwargs)
+
+    @defer.inlineCallbacks
+    def reconfigService(self, artifacts_dir: str, port: int,
+                        interface: str = "127.0.0.1") -> Any:
+        if self.running and ((artifacts_dir, port, interface) !=
+                             (self.artifacts_dir, self.port, self.interface)):
+            yield self._stopListening()
+        self.artifacts_dir = artifacts_dir
+        self.port = port
+        self.interface = interface
+        if self.running and self._listening_port is None:
+            self._startListening()
+
+    @defer.inlineCallbacks
+    def startService(self) -> Any:
+        yield super().startService()
+        self._startListening()
+
+    @defer.inlineCallbacks
+    def stopService(self) -> Any:
+        yield self._stopListening()
+        yield super().stopService()
+
+    def _startListening(self) -> None:
+        self._listening_port = reactor.listenTCP(
+            self.port, ArtifactsSite(self.artifacts_dir),
+            interface=self.interface)
+        log.msg("Exposing the artifacts directory on http://{}:{}/"
+                .format(self.interface, self.port))
+
+    @defer.inlineCallbacks
+    def _stopListening(self) -> Any:
+        if self._listening_port is not None:
+            yield self._listening_port.stopListening()
+            self._listening_port = None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Serve an artifacts directory out of any buildmaster (e.g. for local
+    tests of the artifacts helper functions)."""
+
+    parser = argparse.ArgumentParser(
+        prog="python3 -m clipos.artifacts",
+        description=__doc__.split("\n\n")[0])
+    parser.add_argument("artifacts_dir", help="the artifacts directory")
+    parser.add_argument("--port", type=int, default=8021,
+                        help="TCP port to listen to")
+    parser.add_argument("--interface", default="127.0.0.1",
+                        help="interface to listen on")
+    args = parser.parse_args(argv)
+
+    log.startLogging(sys.stdout)
+    reactor.listenTCP(args.port, ArtifactsSite(args.artifacts_dir),
+                      interface=args.interface)
+    reactor.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -3,6 +3,7 @@
 
 """Build factory classes for the CLIP OS Project buildbot instance"""
 
+import hashlib
 import os
 import re
 import shlex
@@ -17,6 +18,7 @@ import buildbot.process.factory
 # Convenience shorter names:
 from buildbot.plugins import steps, util
 from buildbot.process.buildstep import BuildStep
+from buildbot.process.results import FAILURE, SKIPPED, SUCCESS
 from buildbot.process.properties import Property
 
 import clipos
@@ -24,17 +26,28 @@ import clipos.buildmaster
 import clipos.steps
 import clipos.workers
 
-from .commons import line  # utility functions and stuff
+from .commons import line, read_text_file  # utility functions and stuff
+
+
+# The subdirectory of each builder artifacts directory where the build
+# directories are staged until their publication:
+STAGING_SUBDIRECTORY = ".staging"
 
 
 def compute_artifact_path(base_path: str,
                           artifact_type: str,
                           buildername_property_name: str,
                           *path_items: str,
-                          buildnumber_shard: Union[bool, str] = False):
+                          buildnumber_shard: Union[bool, str] = False,
+                          staged: bool = False):
     """Returns a Renderable function that returns the path to the artifact name
     from the builder name (contained into the `buildername_property_name`
-    property) and a list of path items to be appended to that path."""
+    property) and a list of path items to be appended to that path.
+
+    If `staged` is set, the returned path is the one of the build directory in
+    the staging area of the builder, i.e. where the artifacts of the build are
+    uploaded before their publication (see
+    `ClipOsSourceTreeBuildFactoryBase._registerArtifactsOnBuildmaster`)."""
 
     @util.renderer
     def renderable(props):
@@ -53,8 +66,9 @@ def compute_artifact_path(base_path: str,
             else:
                 raise ValueError("buildnumber_shard is of unexpected type")
             return os.path.join(base_path, artifact_type,
-                                sanitized_buildername, buildnumber,
-                                *path_items)
+                                sanitized_buildername,
+                                *([STAGING_SUBDIRECTORY] if staged else []),
+                                buildnumber, *path_items)
         else:
             return os.path.join(base_path, artifact_type,
                                 sanitized_buildername, *path_items)
@@ -64,6 +78,13 @@ def compute_artifact_path(base_path: str,
 class BuildDockerImage(buildbot.process.factory.BuildFactory):
     """Build a CLIP OS build environment Docker image.
 
+    The image is only rebuilt if its inputs (i.e. its build context, the
+    buildbot-worker version and the digest of its base image) changed since
+    its previous build and the cached layers are then reused. It is rebuilt
+    from scratch periodically (see
+    `clipos.buildmaster.SetupSettings.docker_worker_images_refresh_days`) or
+    if requested by the ``refresh_docker_image`` build property.
+
     :param buildbot_worker_version: the Buildbot worker version to pass to the
         Docker build command (which will be used in the Dockerfile) to install
         the expected buildbot-worker version (this Dockerfile is expected to
@@ -72,6 +93,12 @@ class BuildDockerImage(buildbot.process.factory.BuildFactory):
 
     """
 
+    # The labels set on the built images to record the fingerprint of their
+    # inputs and the date (as a UNIX timestamp) of their last build from
+    # scratch:
+    DOCKER_IMAGE_FINGERPRINT_LABEL = "org.clip-os.buildbot.fingerprint"
+    DOCKER_IMAGE_REFRESHED_LABEL = "org.clip-os.buildbot.refreshed"
+
     def __init__(self, flavor: str,
                  buildmaster_setup: clipos.buildmaster.SetupSettings,
                  buildbot_worker_version: Optional[str] = None):
@@ -99,24 +126,135 @@ class BuildDockerImage(buildbot.process.factory.BuildFactory):
         if not buildbot_worker_version:
             buildbot_worker_version = str(buildbot.version)
 
+        # Fingerprint the image to build from its build context, the
+        # buildbot-worker version and the base image digest (which is pulled
+        # beforehand) and determine whether the image needs to be built again:
+        self.addStep(steps.SetPropertyFromCommand(
+            name="fingerprint docker image",
+            description=line("""fingerprint the Dockerized CLIP OS build
+                             environment image to determine whether it needs
+                             to be rebuilt"""),
+            haltOnFailure=True,
+            extract_fn=self._extractDockerImageProperties,
+            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+                r"""
+                set -e -u -o pipefail
+
+                base_image="$(awk '$1 == "FROM" { print $2; exit }' Dockerfile)"
+                docker pull --quiet "${base_image}" >&2
+                base_image_digest="$(docker image inspect \
+                    --format '{{index .RepoDigests 0}}' "${base_image}")"
+
+                fingerprint="$(
+                    {
+                        tar --sort=name --mtime=@0 --owner=0 --group=0 \
+                            --numeric-owner -cf - . | sha256sum
+                        echo "${BUILDBOT_WORKER_VERSION}"
+                        echo "${base_image_digest}"
+                    } | sha256sum | cut -d' ' -f1)"
+                echo "docker_image_fingerprint=${fingerprint}"
+
+                label() {
+                    docker image inspect \
+                        --format "{{ index .Config.Labels \"$1\" }}" \
+                        "${DOCKER_IMAGE_TAG}" 2>/dev/null || true
+                }
+                refreshed="$(label "${REFRESHED_LABEL}")"
+                if [[ ! "${refreshed}" =~ ^[0-9]+$ ]] ||
+                        (( $(date +%s) - refreshed >= REFRESH_DAYS * 86400 )) ||
+                        [[ "${refresh_docker_image:-}" -ne 0 ]]; then
+                    echo >&2 "Refresh the image from scratch (base image ${base_image_digest})."
+                    echo "docker_image_build_mode=refresh"
+                    echo "docker_image_refreshed=$(date +%s)"
+                elif [[ "$(label "${FINGERPRINT_LABEL}")" != "${fingerprint}" ]]; then
+                    echo >&2 "The image inputs changed: rebuild it reusing the cached layers."
+                    echo "docker_image_build_mode=cached"
+                    echo "docker_image_refreshed=${refreshed}"
+                else
+                    echo >&2 "The image is up-to-date: no need to build it."
+                    echo "docker_image_build_mode=skip"
+                    echo "docker_image_id=$(docker image inspect --format '{{.Id}}' "${DOCKER_IMAGE_TAG}")"
+                fi
+                """).strip()],
+            workdir=location_to_dockerfile,
+            env={
+                "DOCKER_HOST": buildmaster_setup.docker_host_uri,
+                "DOCKER_IMAGE_TAG": docker_image_tag,
+                "BUILDBOT_WORKER_VERSION": buildbot_worker_version,
+                "FINGERPRINT_LABEL": self.DOCKER_IMAGE_FINGERPRINT_LABEL,
+                "REFRESHED_LABEL": self.DOCKER_IMAGE_REFRESHED_LABEL,
+                "REFRESH_DAYS": str(
+                    buildmaster_setup.docker_worker_images_refresh_days),
+                "refresh_docker_image": util.Interpolate(
+                    "%(prop:refresh_docker_image:#?|1|0)s"),
+            },
+        ))
+
+        def is_docker_image_build_required(step: BuildStep) -> bool:
+            return step.getProperty("docker_image_build_mode") != "skip"
+
         self.addStep(steps.ShellCommand(
             name="docker build",
             description="build the Dockerized CLIP OS build environment image",
-            command=[
-                "docker", "build",
-                "--no-cache",  # do not use cache to ensure up-to-date images
-                "--rm",  # remove intermediate containers
-                "--tag", docker_image_tag,
-                "--build-arg",
-                "BUILDBOT_WORKER_VERSION={}".format(buildbot_worker_version),
-                "."  # docker build requires the path to its context
-            ],
+            haltOnFailure=True,
+            doStepIf=is_docker_image_build_required,
+            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+                r"""
+                set -e -u -o pipefail
+
+                build_args=()
+                if [[ "${DOCKER_IMAGE_BUILD_MODE}" == "refresh" ]]; then
+                    # Do not use any cached layer to ensure up-to-date images
+                    # (the package manager cache mounts are still used):
+                    build_args+=(--no-cache)
+                fi
+
+                docker build "${build_args[@]}" \
+                    --rm \
+                    --tag "${DOCKER_IMAGE_TAG}" \
+                    --build-arg "BUILDBOT_WORKER_VERSION=${BUILDBOT_WORKER_VERSION}" \
+                    --label "${FINGERPRINT_LABEL}=${DOCKER_IMAGE_FINGERPRINT}" \
+                    --label "${REFRESHED_LABEL}=${DOCKER_IMAGE_REFRESHED}" \
+                    .
+                """).strip()],
             workdir=location_to_dockerfile,
+            env={
+                "DOCKER_HOST": buildmaster_setup.docker_host_uri,
+                # Required for the cache mounts of the Dockerfiles:
+                "DOCKER_BUILDKIT": "1",
+                "DOCKER_IMAGE_TAG": docker_image_tag,
+                "BUILDBOT_WORKER_VERSION": buildbot_worker_version,
+                "FINGERPRINT_LABEL": self.DOCKER_IMAGE_FINGERPRINT_LABEL,
+                "REFRESHED_LABEL": self.DOCKER_IMAGE_REFRESHED_LABEL,
+                "DOCKER_IMAGE_BUILD_MODE": util.Property("docker_image_build_mode"),
+                "DOCKER_IMAGE_FINGERPRINT": util.Property("docker_image_fingerprint"),
+                "DOCKER_IMAGE_REFRESHED": util.Property("docker_image_refreshed"),
+            },
+        ))
+
+        self.addStep(steps.SetPropertyFromCommand(
+            name="inspect docker image",
+            description="report the digest of the built image",
+            haltOnFailure=True,
+            doStepIf=is_docker_image_build_required,
+            property="docker_image_id",
+            command=["docker", "image", "inspect", "--format", "{{.Id}}",
+                     docker_image_tag],
             env={
                 "DOCKER_HOST": buildmaster_setup.docker_host_uri,
             },
         ))
 
+    @staticmethod
+    def _extractDockerImageProperties(rc: int, stdout: str,
+                                      stderr: str) -> Dict[str, str]:
+        properties = {}
+        for stdout_line in stdout.splitlines():
+            name, _, value = stdout_line.strip().partition("=")
+            if name.startswith("docker_image_") and value:
+                properties[name] = value
+        return properties
+
 
 class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
     """Build factory base class that provides the methods to manage a CLIP OS
@@ -131,6 +269,90 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
     REPO_DIR_ARCHIVE_ARTIFACT_FILENAME = "repo-dir.tar"
     GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME = "git-lfs-dirs.tar"
 
+    # The ".repo" directory archive above is only renewed periodically (this
+    # is the baseline). In between, the quick-sync artifacts producer only
+    # publishes the Git objects fetched since the baseline as a set of Git
+    # bundles (one per project) in the delta archive below. The baseline refs
+    # file lists the refs of all the projects at the time of the baseline:
+    REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME = "repo-dir-delta.tar"
+    REPO_BASELINE_REFS_ARTIFACT_FILENAME = "repo-baseline-refs.txt"
+
+    # The artifacts are stored in a content-addressed fashion on the
+    # buildmaster: the blobs are stored once under the objects subdirectory
+    # and each build artifacts directory only holds a manifest referencing
+    # them (see "scripts/artifacts.sh" for details):
+    ARTIFACTS_OBJECTS_SUBDIRECTORY = "objects"
+    ARTIFACTS_MANIFEST_FILENAME = "MANIFEST.sha256"
+
+    # The directory (relative to the workspace) where the full file listings
+    # of the archive and repo sync commands are kept when they fail (see
+    # `artifacts_summarize_log` in "scripts/artifacts.sh"):
+    FILE_LISTINGS_DIR = ".file-listings"
+
+    # The extended regular expression matching the per-project progress lines
+    # of repo (and of the Git commands it runs) to be summarized:
+    REPO_SYNC_LISTING_REGEXP = (
+        r"^(Fetching|Checking out|Updating files|Syncing|Garbage collecting"
+        r"|remote: |From | [-+*t!=] )")
+
+    # The shell function removing in the background the contents of the
+    # directory given by the TRASH_DIR environment variable (unless a reaper is
+    # already at work on it) with the lowest CPU and I/O priorities:
+    TRASH_REAPER_FUNCTION = textwrap.dedent(
+        r"""
+        reap_trash_in_background() {
+            sudo setsid -f bash -c '
+                exec 9> "$0/.reaper.lock"
+                flock -n 9 || exit 0
+                while [[ -n "$(find "$0" -mindepth 1 -maxdepth 1 \! -name .reaper.lock)" ]]; do
+                    ionice -c 3 nice -n 19 find "$0" -mindepth 1 -maxdepth 1 \
+                        \! -name .reaper.lock -exec rm -rf {} +
+                done
+            ' "${TRASH_DIR:?}" < /dev/null > /dev/null 2>&1
+        }
+        """).strip()
+
+    # The shell function mounting on the workspace (given by the "workspace"
+    # variable) the snapshot of the manifest revision given as first argument
+    # as lower layer and the layer given by the "layer" variable as upper
+    # layer. A shared lock on the snapshot is held for as long as the
+    # workspace is mounted on it (by a background process watching the mount)
+    # so that no build evicts the snapshot meanwhile, whatever the container
+    # running it (see `saveWorkspaceSnapshot`):
+    WORKSPACE_SNAPSHOT_MOUNT_FUNCTION = textwrap.dedent(
+        r"""
+        mount_snapshot() {
+            local snapshot="${SNAPSHOTS_DIR:?}/$1"
+            sudo touch "${snapshot}.lock" || return 1
+            exec 8< "${snapshot}.lock"
+            flock -s 8
+            if [[ ! -d "${snapshot}" ]]; then
+                echo >&2 "The workspace snapshot of revision $1 has been evicted."
+                exec 8<&-
+                return 1
+            fi
+            if ! sudo mkdir -p "${layer}/upper" "${layer}/work" ||
+                    ! echo "$1" | sudo tee "${layer}/revision" > /dev/null ||
+                    ! sudo mount -t overlay overlay \
+                        -o "lowerdir=${snapshot},upperdir=${layer}/upper,workdir=${layer}/work" \
+                        "${workspace}"; then
+                exec 8<&-
+                return 1
+            fi
+            sudo touch "${snapshot}"  # mark as recently used
+            setsid -f bash -c 'while mountpoint -q "$0"; do sleep 60; done' \
+                "${workspace}" < /dev/null > /dev/null 2>&1
+            exec 8<&-
+        }
+        """).strip()
+
+    # The build properties recording the parallelism chosen for the repo
+    # synchronization:
+    REPO_SYNC_PROPERTIES = (
+        "repo_sync_network_jobs",
+        "repo_sync_checkout_jobs",
+    )
+
     def __init__(self, *,
                  buildmaster_setup: clipos.buildmaster.SetupSettings):
         # Initialize Build factory from parent class:
@@ -138,30 +360,62 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
 
         self.buildmaster_setup = buildmaster_setup  # Buildbot setup settings
 
+        # Whether the steps declaring the custom CA certificates for the Git
+        # HTTPS remotes have already been added (see
+        # `_addCaCertsForHttpsGitRemotes`):
+        self._git_https_cacerts_declared = False
+
     def cleanupWorkspaceIfRequested(self):
         """Cleanup the workspace if this is requested via the build property
-        "cleanup_workspace"."""
+        "cleanup_workspace" (unless the build resumes a previous one via the
+        build property "resume_product_build" as the cleanup would throw away
+        the phases to resume).
+
+        The workspace contents are only moved aside (which is a mere rename as
+        the trash directory lies on the same volume) and then removed by a
+        background reaper with the lowest CPU and I/O priorities in order not
+        to delay the build."""
 
         self.addStep(steps.ShellCommand(
             name="cleanup workspace",
             description="cleanup workspace",
             haltOnFailure=True,
-            doStepIf=lambda step: bool(step.getProperty("cleanup_workspace")),
-            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+            doStepIf=lambda step: bool(
+                step.getProperty("cleanup_workspace") and
+                not step.getProperty("resume_product_build")),
+            command=["/usr/bin/env", "bash", "-c", self.TRASH_REAPER_FUNCTION + "\n\n" + textwrap.dedent(
                 r"""
                 set -e -u -o pipefail
 
+                sudo mkdir -p "${TRASH_DIR}"
+                trash="$(sudo mktemp -d -p "${TRASH_DIR}" workspace.XXXXXX)"
+
+                # Drop the writable layer of the workspace snapshot (if any):
+                workspace="$(pwd -P)"
+                layer="${SNAPSHOTS_DIR}/layers/$(printf '%s' "${workspace}" | sha256sum | cut -c1-16)"
+                if mountpoint -q "${workspace}"; then
+                    echo "Unmount the workspace snapshot..."
+                    sudo umount --lazy "${workspace}"
+                    cd "${workspace}"
+                fi
+                if [[ -d "${layer}" ]]; then
+                    sudo mv -T "${layer}" "${trash}/snapshot-layer"
+                fi
+
                 if [[ "${force_repo_quicksync_artifacts_download:-}" -ne 0 ]]; then
                     echo "Cleanup workspace completely..."
-                    sudo find . -delete
+                    sudo find . -mindepth 1 -maxdepth 1 \
+                        -exec mv -t "${trash}" {} +
                 else
                     echo "Cleanup workspace but keep repo quick-sync artifacts..."
-                    sudo find . -mindepth 1 \
-                        \! \( -path "./${repodir_archive_filename}" -or \
-                              -path "./${gitlfsdirs_archive_filename}" \) \
-                        -delete
+                    sudo find . -mindepth 1 -maxdepth 1 \
+                        \! \( -name "${repodir_archive_filename}*" -or \
+                              -name "${gitlfsdirs_archive_filename}*" \) \
+                        -exec mv -t "${trash}" {} +
                 fi
 
+                reap_trash_in_background
+
                 # List contents after cleanup (to ease CI debugging)
                 ls -la
                 """).strip()],
@@ -170,9 +424,236 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
                     "%(prop:force_repo_quicksync_artifacts_download:#?|1|0)s"),
                 "repodir_archive_filename": self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
                 "gitlfsdirs_archive_filename": self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
+                "TRASH_DIR": clipos.workers.DockerLatentWorker.WORKSPACES_TRASH_DIR,
+                "SNAPSHOTS_DIR": clipos.workers.DockerLatentWorker.WORKSPACES_SNAPSHOTS_DIR,
+            },
+        ))
+
+    def restoreWorkspaceSnapshotIfAny(self):
+        """Restore the workspace from the snapshot of the source tree
+        previously synchronized on this worker for the current manifest
+        revision (if any): this snapshot is mounted as the read-only lower
+        layer of an overlay filesystem on the workspace, the build writing
+        into a layer of its own. The retrieval of the quick-sync artifacts is
+        then skipped but the source tree is still synchronized on top of the
+        snapshot: the projects tracking a branch may have moved since the
+        snapshot was taken and the incremental repo sync only fetches what
+        has changed since then.
+
+        .. note::
+           This requires a privileged worker (for the overlay mount): the
+           step is skipped on the unprivileged ones.
+
+        """
+
+        def extract_workspace_snapshot_properties(rc: int, stdout: str,
+                                                  stderr: str) -> Dict[str, Any]:
+            properties = {}
+            for stdout_line in stdout.splitlines():
+                name, _, value = stdout_line.strip().partition("=")
+                if name == "workspace_snapshot_revision" and value:
+                    properties[name] = value
+                elif name == "workspace_snapshot_restored":
+                    properties[name] = (value == "1")
+            return properties
+
+        self.addStep(steps.SetPropertyFromCommand(
+            name="restore workspace snapshot",
+            description=line("""restore the synchronized source tree from the
+                             snapshot for the current manifest revision"""),
+            haltOnFailure=True,
+            doStepIf=lambda step: bool(
+                step.getProperty("clipos_docker_worker_privileged")),
+            extract_fn=extract_workspace_snapshot_properties,
+            command=["/usr/bin/env", "bash", "-c", self.WORKSPACE_SNAPSHOT_MOUNT_FUNCTION + "\n\n" + textwrap.dedent(
+                r"""
+                set -e -u -o pipefail
+
+                revision="$(git ls-remote "${REPO_MANIFEST_URL}" "${REPO_MANIFEST_BRANCH}" \
+                            | awk 'NR == 1 { print $1 }')"
+                if [[ -z "${revision}" && "${REPO_MANIFEST_BRANCH}" =~ ^[0-9a-f]{40}$ ]]; then
+                    revision="${REPO_MANIFEST_BRANCH}"
+                fi
+                echo "workspace_snapshot_revision=${revision}"
+
+                workspace="$(pwd -P)"
+                layer="${SNAPSHOTS_DIR}/layers/$(printf '%s' "${workspace}" | sha256sum | cut -c1-16)"
+
+                if ! mountpoint -q "${workspace}" && [[ -f "${layer}/revision" ]]; then
+                    # The writable layer of a previous build has outlived the
+                    # container in which it was mounted:
+                    echo >&2 "Remount the workspace snapshot of a previous build."
+                    if ! mount_snapshot "$(cat "${layer}/revision")"; then
+                        echo >&2 "Drop the writable layer of the previous build."
+                        sudo rm -rf "${layer}"
+                    fi
+                fi
+
+                restored=0
+                if mountpoint -q "${workspace}"; then
+                    if [[ -n "${revision}" && "$(cat "${layer}/revision")" == "${revision}" ]]; then
+                        echo >&2 "The workspace is already synchronized at revision ${revision}."
+                        restored=1
+                    fi
+                elif [[ -d .repo ]]; then
+                    echo >&2 "The workspace already holds a source tree: not using any snapshot."
+                elif [[ -n "${revision}" && -d "${SNAPSHOTS_DIR}/${revision}" ]] &&
+                        mount_snapshot "${revision}"; then
+                    echo >&2 "Restored the workspace from the snapshot of revision ${revision}."
+                    restored=1
+                else
+                    echo >&2 "No workspace snapshot for revision ${revision:-(unknown)}."
+                fi
+                echo "workspace_snapshot_restored=${restored}"
+                """).strip()],
+            env={
+                "REPO_MANIFEST_URL": util.Property("repository"),
+                "REPO_MANIFEST_BRANCH": util.Property("branch"),
+                "SNAPSHOTS_DIR": clipos.workers.DockerLatentWorker.WORKSPACES_SNAPSHOTS_DIR,
+            },
+        ))
+
+    def saveWorkspaceSnapshot(self):
+        """Turn the source tree freshly synchronized in the workspace into the
+        snapshot for the current manifest revision (the workspace contents are
+        moved into the snapshot which is then mounted back on the workspace
+        as in `restoreWorkspaceSnapshotIfAny`) and evict the snapshots which
+        are either too old or beyond the disk budget, except the ones still
+        mounted by a build (on any container sharing this volume).
+
+        If the snapshot cannot be saved and mounted, the source tree is moved
+        back into the workspace and the build is halted.
+
+        .. note::
+           This requires a privileged worker (for the overlay mount): the
+           step is skipped on the unprivileged ones.
+
+        """
+
+        def is_workspace_snapshot_to_save(step: BuildStep) -> bool:
+            # Only snapshot source trees synchronized in a clean workspace:
+            return bool(step.getProperty("clipos_docker_worker_privileged") and
+                        step.getProperty("cleanup_workspace") and
+                        step.getProperty("workspace_snapshot_revision") and
+                        not step.getProperty("workspace_snapshot_restored") and
+                        not step.getProperty("use_local_manifest"))
+
+        self.addStep(steps.ShellCommand(
+            name="save workspace snapshot",
+            description=line("""save the synchronized source tree as the
+                             snapshot for the current manifest revision"""),
+            haltOnFailure=True,
+            doStepIf=is_workspace_snapshot_to_save,
+            command=["/usr/bin/env", "bash", "-c", "\n\n".join([
+                self.TRASH_REAPER_FUNCTION,
+                self.WORKSPACE_SNAPSHOT_MOUNT_FUNCTION,
+                textwrap.dedent(
+                r"""
+                set -e -u -o pipefail
+
+                workspace="$(pwd -P)"
+                layer="${SNAPSHOTS_DIR}/layers/$(printf '%s' "${workspace}" | sha256sum | cut -c1-16)"
+                if mountpoint -q "${workspace}"; then
+                    echo "The workspace is already derived from a snapshot: not saving it."
+                    exit 0
+                elif [[ -d "${SNAPSHOTS_DIR}/${REVISION}" ]]; then
+                    echo "A snapshot for revision ${REVISION} already exists."
+                    exit 0
+                fi
+
+                echo "Save the workspace as the snapshot of revision ${REVISION}..."
+                sudo mkdir -p "${SNAPSHOTS_DIR}"
+                snapshot="$(sudo mktemp -d -p "${SNAPSHOTS_DIR}" .new.XXXXXX)"
+
+                # The source tree must be moved out of the workspace before
+                # mounting the snapshot on it: move it back if this fails.
+                restore_workspace() {
+                    echo >&2 "Saving the snapshot failed: move the source tree back into the workspace."
+                    if mountpoint -q "${workspace}"; then
+                        sudo umount "${workspace}"
+                    fi
+                    sudo find "${snapshot}" -mindepth 1 -maxdepth 1 \
+                        -exec mv -t "${workspace}" {} +
+                    sudo rm -rf "${snapshot}" "${SNAPSHOTS_DIR}/${REVISION}.size" "${layer}"
+                }
+                trap restore_workspace ERR
+
+                sudo find . -mindepth 1 -maxdepth 1 \
+                    \! \( -name "${repodir_archive_filename}*" -or \
+                          -name "${gitlfsdirs_archive_filename}*" \) \
+                    -exec mv -t "${snapshot}" {} +
+                sudo du -s --block-size=1 "${snapshot}" | cut -f1 \
+                    | sudo tee "${SNAPSHOTS_DIR}/${REVISION}.size" > /dev/null
+                sudo mv -T "${snapshot}" "${SNAPSHOTS_DIR}/${REVISION}"
+                snapshot="${SNAPSHOTS_DIR}/${REVISION}"
+
+                mount_snapshot "${REVISION}"
+                trap - ERR
+
+                # Evict the unused snapshots older than the maximum age and
+                # then the least recently used ones beyond the disk budget. A
+                # snapshot is in use as long as a shared lock is held on it (see
+                # mount_snapshot): it is only evicted while holding the
+                # exclusive lock, which no build can take while it is mounted.
+                budget=$(( MAX_SIZE_GIB * 1024 * 1024 * 1024 ))
+                total=0
+                trash=""
+                while read -r _ snapshot; do
+                    size="$(cat "${snapshot}.size" 2>/dev/null || echo 0)"
+                    sudo touch "${snapshot}.lock"
+                    exec 7< "${snapshot}.lock"
+                    if ! flock -n -x 7; then
+                        total=$(( total + size ))
+                        exec 7<&-
+                        continue  # in use
+                    fi
+                    if [[ -n "$(find "${snapshot}" -maxdepth 0 -mtime "+${MAX_AGE_DAYS}")" ]] ||
+                            (( total + size > budget )); then
+                        echo "Evict the workspace snapshot ${snapshot##*/}."
+                        if [[ -z "${trash}" ]]; then
+                            sudo mkdir -p "${TRASH_DIR}"
+                            trash="$(sudo mktemp -d -p "${TRASH_DIR}" snapshots.XXXXXX)"
+                        fi
+                        sudo mv -T "${snapshot}" "${trash}/${snapshot##*/}"
+                        sudo rm -f "${snapshot}.size" "${snapshot}.lock"
+                    else
+                        total=$(( total + size ))
+                    fi
+                    exec 7<&-
+                done < <(find "${SNAPSHOTS_DIR}" -mindepth 1 -maxdepth 1 -type d \
+                             -regex '.*/[0-9a-f]+' -printf '%T@ %p\n' | sort -rn)
+                if [[ -n "${trash}" ]]; then
+                    reap_trash_in_background
+                fi
+                """).strip(),
+            ])],
+            env={
+                "REVISION": util.Property("workspace_snapshot_revision"),
+                "MAX_SIZE_GIB": self._workerDiskBudgetGib(
+                    self.buildmaster_setup.workspace_snapshots_max_size_gib),
+                "MAX_AGE_DAYS": str(
+                    self.buildmaster_setup.workspace_snapshots_max_age_days),
+                "repodir_archive_filename": self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
+                "gitlfsdirs_archive_filename": self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
+                "TRASH_DIR": clipos.workers.DockerLatentWorker.WORKSPACES_TRASH_DIR,
+                "SNAPSHOTS_DIR": clipos.workers.DockerLatentWorker.WORKSPACES_SNAPSHOTS_DIR,
             },
         ))
 
+    @staticmethod
+    def _unlessWorkspaceSnapshotRestored(
+            doStepIf: Union[bool, Callable[[BuildStep], bool]] = True,
+    ) -> Callable[[BuildStep], bool]:
+        """Returns a ``doStepIf`` callable skipping the step if the workspace
+        has been restored from a snapshot (see `restoreWorkspaceSnapshotIfAny`)
+        and deferring to the given ``doStepIf`` otherwise."""
+
+        def checker(step: BuildStep) -> bool:
+            if step.getProperty("workspace_snapshot_restored"):
+                return False
+            return bool(doStepIf(step) if callable(doStepIf) else doStepIf)
+        return checker
+
     def syncSources(self, use_repo_quicksync_artifacts: bool = False):
         """Fetch repo manifest for a CLIP OS source tree and synchronize the
         complete source tree from scratch.
@@ -199,6 +680,7 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
             self.buildmaster_setup.private_settings_addendum and
             self.buildmaster_setup.private_settings_addendum.alternative_git_lfs_endpoint_url_template
         )
+        repo_mirror_provided = bool(self.buildmaster_setup.repo_mirror_host_dir)
 
         if additional_git_https_cacerts_provided:
             # Declare the CA certificates in the worker environment before
@@ -243,8 +725,15 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
             repo_sync_env.update({
                 "GIT_LFS_SKIP_DOWNLOAD_ERRORS": "1",
             })
+            if repo_mirror_provided:
+                # The Git objects are provided by the repo mirror bind-mounted
+                # in the worker (once initialized): the ".repo" directory
+                # artifacts are then left aside and only the Git LFS objects
+                # are to be retrieved from the artifacts.
+                self._initRepoWithMirrorReference()
             self._downloadSourceTreeQuicksyncArtifacts()
             self._extractRepoSourceTreeArtifact()
+            self._applyRepoSourceTreeDeltaArtifact()
 
         # Ok for the big ol' "repo init ... && repo sync"
         self._doRepoSync(env=repo_sync_env)
@@ -277,17 +766,263 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
         self._produceSourceTreeQuicksyncArtifacts()
         self._uploadSourceTreeQuicksyncArtifacts()
 
+    @staticmethod
+    def _workerDiskBudgetGib(budget_gib: int) -> Any:
+        """Returns the renderable of the share (in GiB) of the given disk
+        budget left to the workspaces volume of the worker running the build
+        (the budget of a kind of worker being split evenly among the volumes
+        of the workers of its warm pool)."""
+
+        @util.renderer
+        def worker_disk_budget_gib(props):
+            if not budget_gib:
+                return "0"
+            pool_size = props.getProperty("clipos_docker_worker_pool_size") or 1
+            return str(max(budget_gib // pool_size, 1))
+
+        return worker_disk_budget_gib
+
+    def _artifactsEnv(self, **env: Any) -> Dict[str, Any]:
+        """Returns the environment variables required by the artifacts helper
+        functions (see `clipos.steps.ArtifactsShellCommand`) completed with
+        the ones given as keyword arguments."""
+
+        return {
+            "ARTIFACTS_HTTP_URL": self.buildmaster_setup.artifacts_http_url,
+            "ARTIFACTS_FTP_URL": self.buildmaster_setup.artifacts_ftp_url,
+            "ARTIFACTS_COMPRESSION": util.Property(
+                "artifacts_compression",
+                default=self.buildmaster_setup.artifacts_compression),
+            "ARTIFACTS_TRANSFER_MODE": util.Property(
+                "artifacts_transfer_mode",
+                default=self.buildmaster_setup.artifacts_transfer_mode),
+            "ARTIFACTS_FETCH_MAX_PARALLEL_TRANSFERS": str(
+                self.buildmaster_setup.artifacts_fetch_max_parallel_transfers),
+            "ARTIFACTS_FETCH_SEGMENTS_PER_TRANSFER": str(
+                self.buildmaster_setup.artifacts_fetch_segments_per_transfer),
+            "ARTIFACTS_CACHE_DIR": (
+                clipos.workers.DockerLatentWorker.ARTIFACTS_CACHE_DIR
+                if self.buildmaster_setup.worker_artifacts_cache_max_size_gib
+                else ""),
+            "ARTIFACTS_CACHE_MAX_SIZE_GIB": self._workerDiskBudgetGib(
+                self.buildmaster_setup.worker_artifacts_cache_max_size_gib),
+            "ARTIFACTS_LOG_SUMMARY_INTERVAL": str(
+                self.buildmaster_setup.steps_log_summary_interval),
+            "ARTIFACTS_LISTINGS_DIR": self.FILE_LISTINGS_DIR,
+            **env,
+        }
+
+    def uploadFileListingsOnFailure(self):
+        """Upload onto the buildmaster the full file listings kept by the
+        failed archive and repo sync commands (these are only summarized in the
+        step logs) if the build has failed. The listings are then removed from
+        the workspace in any case."""
+
+        artifacts_url = (self.buildmaster_setup.artifacts_http_url or
+                         self.buildmaster_setup.artifacts_ftp_url)
+        # The upload of a missing directory raises an exception:
+        self.addStep(steps.SetPropertyFromCommand(
+            name="look for file listings",
+            alwaysRun=True,
+            flunkOnFailure=False,
+            doStepIf=lambda step: step.build.results == FAILURE,
+            hideStepIf=lambda results, step: results in (SUCCESS, SKIPPED),
+            property="file_listings_kept",
+            command=["/usr/bin/env", "bash", "-c",
+                     '[[ -d "$0" ]] && echo 1 || echo 0',
+                     self.FILE_LISTINGS_DIR],
+        ))
+        self.addStep(steps.DirectoryUpload(
+            name="upload file listings",
+            description="upload the file listings of the failed commands",
+            alwaysRun=True,
+            flunkOnFailure=False,
+            doStepIf=lambda step: bool(
+                step.build.results == FAILURE and
+                step.getProperty("file_listings_kept") == "1"),
+            hideStepIf=lambda results, step: results == SKIPPED,
+            workersrc=self.FILE_LISTINGS_DIR,
+            masterdest=compute_artifact_path(
+                self.buildmaster_setup.artifacts_dir,
+                "file-listings",
+                "buildername",
+                buildnumber_shard=True,
+            ),
+            url=compute_artifact_path(
+                artifacts_url,
+                "file-listings",
+                "buildername",
+                buildnumber_shard=True,
+            ) if artifacts_url else None,
+        ))
+        self.addStep(steps.ShellCommand(
+            name="remove file listings",
+            alwaysRun=True,
+            flunkOnFailure=False,
+            hideStepIf=lambda results, step: results == SUCCESS,
+            command=["rm", "-rf", self.FILE_LISTINGS_DIR],
+        ))
+
+    def _isArtifactsStreamingEnabled(self, step: BuildStep) -> bool:
+        """Returns whether the archive artifacts are streamed (i.e. neither
+        written before their upload nor downloaded before their extraction) for
+        the build of the given step."""
+
+        return step.getProperty(
+            "artifacts_transfer_mode",
+            self.buildmaster_setup.artifacts_transfer_mode) == "stream"
+
+    def _registerArtifactsOnBuildmaster(self, artifact_type: str,
+                                        **kwargs: Any):
+        """Publish the artifacts of type `artifact_type` saved by the current
+        build into its staging directory on the buildmaster (see
+        `compute_artifact_path`) and mark them as the latest ones.
+
+        The blobs referenced by the staged manifest that are not referenced by
+        any other build yet (i.e. the ones freshly uploaded) are first
+        verified against their digests (concurrently). The blobs are then
+        linked into the staging directory which is renamed into the build
+        directory and the "latest" symlink is swapped to it, both in one
+        operation: the consumers never see an incomplete build directory nor a
+        missing "latest" symlink."""
+
+        self.addStep(steps.MasterShellCommand(
+            name="register latest {} artifacts".format(artifact_type)[:50],
+            haltOnFailure=True,
+            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+                r"""
+                set -e -u -o pipefail
+
+                manifest="${STAGED_ARTIFACTS_DIR}/${MANIFEST_FILENAME}"
+                while read -r digest name; do
+                    blob="${OBJECTS_DIR}/${digest:0:2}/${digest}"
+                    if [[ ! -f "${blob}" ]]; then
+                        echo >&2 "The blob of artifact \"${name}\" is missing (${digest})."
+                        exit 1
+                    elif [[ "$(stat -c %h "${blob}")" -eq 1 ]]; then
+                        echo "${digest} ${blob}"
+                    fi
+                done < "${manifest}" \
+                    | xargs -r -d '\n' -P "$(nproc)" -n 1 bash -c '
+                        set -- $0
+                        if [[ "$(sha256sum < "$2" | cut -d" " -f1)" != "$1" ]]; then
+                            echo >&2 "Removing the corrupted blob $1."
+                            rm -f "$2"
+                            exit 255
+                        fi
+                        echo "Verified the blob $1."'
+
+                while read -r digest name; do
+                    ln -f "${OBJECTS_DIR}/${digest:0:2}/${digest}" \
+                        "${STAGED_ARTIFACTS_DIR}/${name}"
+                done < "${manifest}"
+
+                mv -T "${STAGED_ARTIFACTS_DIR}" "${BUILD_ARTIFACTS_DIR}"
+                ln -sfn "${BUILDNUMBER}" "${LATEST_ARTIFACTS_DIR}.$$"
+                mv -T "${LATEST_ARTIFACTS_DIR}.$$" "${LATEST_ARTIFACTS_DIR}"
+                echo "Published ${BUILD_ARTIFACTS_DIR} as the latest artifacts."
+                """).strip()],
+            env={
+                "OBJECTS_DIR": os.path.join(
+                    self.buildmaster_setup.artifacts_dir,
+                    self.ARTIFACTS_OBJECTS_SUBDIRECTORY),
+                "MANIFEST_FILENAME": self.ARTIFACTS_MANIFEST_FILENAME,
+                "BUILDNUMBER": util.Interpolate("%(prop:buildnumber)s"),
+                "STAGED_ARTIFACTS_DIR": compute_artifact_path(
+                    self.buildmaster_setup.artifacts_dir,
+                    artifact_type,
+                    "buildername",
+                    buildnumber_shard=True,
+                    staged=True,
+                ),
+                "BUILD_ARTIFACTS_DIR": compute_artifact_path(
+                    self.buildmaster_setup.artifacts_dir,
+                    artifact_type,
+                    "buildername",
+                    buildnumber_shard=True,
+                ),
+                "LATEST_ARTIFACTS_DIR": compute_artifact_path(
+                    self.buildmaster_setup.artifacts_dir,
+                    artifact_type,
+                    "buildername",
+                    buildnumber_shard="latest",
+                ),
+            },
+            **kwargs,
+        ))
+
     def _doRepoSync(self, env: Optional[Dict[str, str]] = None):
         """Do repo init and sync via the API provided by Buildbot that neatly
-        abstract the use of repo command line (which can be picky to use)."""
+        abstract the use of repo command line (which can be picky to use) with
+        a parallelism adapted to the worker.
+
+        The network fetch jobs are bounded by the number of connections to the
+        Git server the builds of the Docker host are allowed to open all
+        together and the local checkout jobs by the CPUs available to the
+        build. Both are computed in the worker beforehand and recorded in
+        build properties (see `REPO_SYNC_PROPERTIES`) and the repo sync is
+        then split into its network and checkout phases, each with its own
+        number of jobs and recording its duration in a build property (see
+        `clipos.steps.RepoSync`)."""
+
+        @util.renderer
+        def running_builds_on_docker_host(props):
+            worker = props.getBuild().workerforbuilder.worker
+            if isinstance(worker, clipos.workers.DockerLatentWorker):
+                return str(worker.running_builds_on_docker_host())
+            return "1"
+
+        def extract_repo_sync_properties(rc: int, stdout: str,
+                                         stderr: str) -> Dict[str, int]:
+            properties = {}
+            for stdout_line in stdout.splitlines():
+                name, _, value = stdout_line.strip().partition("=")
+                if name in self.REPO_SYNC_PROPERTIES and value.isdigit():
+                    properties[name] = int(value)
+            return properties
+
+        self.addStep(steps.SetPropertyFromCommand(
+            name="compute repo sync parallelism",
+            description="adapt the repo sync parallelism to the worker",
+            haltOnFailure=True,
+            extract_fn=extract_repo_sync_properties,
+            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+                r"""
+                set -e -u -o pipefail
+
+                cpus="$(nproc)"
+                builds="$(( RUNNING_BUILDS_ON_DOCKER_HOST > 1 ? RUNNING_BUILDS_ON_DOCKER_HOST : 1 ))"
+
+                # Fetching is mostly bound by the network latency (hence more
+                # jobs than CPUs) and by the connections to the Git server
+                # which are shared with the other builds of the Docker host:
+                network_jobs="$(( MAX_SERVER_CONNECTIONS / builds ))"
+                network_jobs="$(( network_jobs < 2 * cpus ? network_jobs : 2 * cpus ))"
+                network_jobs="$(( network_jobs > 1 ? network_jobs : 1 ))"
+                # Checking out is bound by the CPUs and the local I/O which
+                # are shared with the other builds of the Docker host:
+                checkout_jobs="$(( cpus / builds > 1 ? cpus / builds : 1 ))"
+                echo >&2 "${cpus} CPU(s), ${builds} build(s) running on the Docker host:" \
+                    "using ${network_jobs} network job(s) and ${checkout_jobs} checkout job(s)."
+
+                echo "repo_sync_network_jobs=${network_jobs}"
+                echo "repo_sync_checkout_jobs=${checkout_jobs}"
+                """).strip()],
+            env={
+                "RUNNING_BUILDS_ON_DOCKER_HOST": running_builds_on_docker_host,
+                "MAX_SERVER_CONNECTIONS": str(
+                    self.buildmaster_setup.repo_sync_max_server_connections),
+            },
+        ))
 
-        self.addStep(steps.Repo(
+        self.addStep(clipos.steps.RepoSync(
             name="repo init and sync",
             description="synchronize the CLIP OS source tree with repo",
             haltOnFailure=True,
             manifestURL=util.Property("repository"),
             manifestBranch=util.Property("branch"),
-            jobs=4,
+            jobs=util.Property("repo_sync_network_jobs", 4),
+            checkoutJobs=util.Property("repo_sync_checkout_jobs", 4),
             depth=0,  # Never shallow sync!
             syncAllBranches=True,  # All branches must be present for some features.
             env=env,
@@ -301,28 +1036,32 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
             return bool(step.getProperty("use_local_manifest") and
                         step.getProperty("local_manifest_xml"))
 
-        self.addStep(steps.ShellCommand(
+        self.addStep(clipos.steps.ArtifactsShellCommand(
             name="apply local-manifest",
             description=line("""apply local-manifest if specified and provided
                              by the build properties"""),
             haltOnFailure=True,
             doStepIf=assert_local_manifest_application,
-            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+            command=textwrap.dedent(
                 r"""
-                set -e -u -o pipefail
-
                 if [[ "${use_local_manifest:-}" -ne 0 ]]; then
                     mkdir .repo/local_manifests
                     echo "${local_manifest_xml:-}" \
                         > ".repo/local_manifests/local_manifest.xml"
 
-                    repo sync -j4
+                    artifacts_summarize_log "repo sync (network)" "${LISTING_REGEXP}" \
+                        repo sync --network-only --jobs="${repo_sync_network_jobs}"
+                    artifacts_summarize_log "repo sync (checkout)" "${LISTING_REGEXP}" \
+                        repo sync --local-only --jobs="${repo_sync_checkout_jobs}"
                 fi
-                """).strip()],
-            env={
-                "use_local_manifest": util.Interpolate("%(prop:use_local_manifest:#?|1|0)s"),
-                "local_manifest_xml": util.Interpolate("%(prop:local_manifest_xml)s"),
-            },
+                """).strip(),
+            env=self._artifactsEnv(
+                repo_sync_network_jobs=util.Interpolate("%(prop:repo_sync_network_jobs:-4)s"),
+                repo_sync_checkout_jobs=util.Interpolate("%(prop:repo_sync_checkout_jobs:-4)s"),
+                use_local_manifest=util.Interpolate("%(prop:use_local_manifest:#?|1|0)s"),
+                local_manifest_xml=util.Interpolate("%(prop:local_manifest_xml)s"),
+                LISTING_REGEXP=self.REPO_SYNC_LISTING_REGEXP,
+            ),
         ))
 
     def _addCaCertsForHttpsGitRemotes(self):
@@ -348,6 +1087,10 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
                 """Could not declare custom CA certificates for Git HTTPS
                 remotes if the Buildbot setup does not provide any."""))
 
+        if self._git_https_cacerts_declared:
+            return  # already declared by a previous step of this build
+        self._git_https_cacerts_declared = True
+
         for url, cacert_filepath in (self.buildmaster_setup.private_settings_addendum
                                                  .additional_git_https_cacerts
                                                  .items()):
@@ -454,214 +1197,545 @@ class ClipOsSourceTreeBuildFactoryBase(buildbot.process.factory.BuildFactory):
         ))
 
     def _pullGitLfsObjects(self):
-        """Pull the Git LFS objects in all the Git LFS-backed repositories"""
+        """Pull the Git LFS objects in the Git LFS-backed repositories which
+        miss some of them in their Git LFS object store (the Git LFS endpoint
+        is not even contacted for the others, whose Git LFS files are only
+        checked out from their store if they are still pointers, e.g. after
+        the extraction of the quick-sync artifacts). The pulls and the
+        checkouts are done concurrently across the projects."""
 
         self.addStep(steps.ShellCommand(
             name="pull git-lfs objects",
-            description="fetch and checkout the Git LFS objects",
+            description="fetch and checkout the missing Git LFS objects",
             haltOnFailure=True,
-            command=["repo", "forall",
-                     "-g", self.REPO_GROUP_FOR_GIT_LFS_BACKED_PROJECTS,
-                     "-c",
-                     "git", "lfs", "pull"],
+            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+                r"""
+                set -e -u -o pipefail
+
+                # Sort the projects into the ones missing some Git LFS objects
+                # in their store (to be pulled) and the ones in which some Git
+                # LFS files are only pointers (i.e. flagged by "-" instead of
+                # "*") although all the objects are present (to be checked
+                # out):
+                projects="$(mktemp)"
+                repo list --path-only --groups="${REPO_GROUP_FOR_GIT_LFS_BACKED_PROJECTS}" \
+                    | xargs -d '\n' -P "$(nproc)" -n 1 bash -c '
+                        set -e -u -o pipefail
+                        objects="$(git -C "$0" rev-parse --absolute-git-dir)/lfs/objects"
+                        action=""
+                        while read -r oid flag _; do
+                            if [[ ! -f "${objects}/${oid:0:2}/${oid:2:2}/${oid}" ]]; then
+                                action="pull"
+                                break
+                            elif [[ "${flag}" == "-" ]]; then
+                                action="checkout"
+                            fi
+                        done < <(git -C "$0" lfs ls-files --long)
+                        if [[ -n "${action}" ]]; then
+                            echo "${action} $0"
+                        fi' > "${projects}"
+
+                if [[ ! -s "${projects}" ]]; then
+                    echo "All the Git LFS objects are already present: nothing to pull."
+                    rm -f "${projects}"
+                    exit 0
+                fi
+
+                echo "Checking out the Git LFS files of $(grep -c '^checkout ' "${projects}") project(s)" \
+                    "and pulling the Git LFS objects of $(grep -c '^pull ' "${projects}") project(s)..."
+                xargs -d '\n' -P "${MAX_PARALLEL_PROJECTS}" -n 1 \
+                    bash -c 'set -o pipefail
+                             action="${0%% *}" path="${0#* }"
+                             git -C "${path}" -c lfs.concurrenttransfers="${CONCURRENT_TRANSFERS}" \
+                                 lfs "${action}" 2>&1 | sed "s|^|${path}: |"' \
+                    < "${projects}"
+                rm -f "${projects}"
+                """).strip()],
+            env={
+                "REPO_GROUP_FOR_GIT_LFS_BACKED_PROJECTS": self.REPO_GROUP_FOR_GIT_LFS_BACKED_PROJECTS,
+                "MAX_PARALLEL_PROJECTS": str(
+                    self.buildmaster_setup.git_lfs_pull_max_parallel_projects),
+                "CONCURRENT_TRANSFERS": str(
+                    self.buildmaster_setup.git_lfs_concurrent_transfers),
+            },
         ))
 
     def _produceSourceTreeQuicksyncArtifacts(self):
         """Produce the repo and Git LFS source tree archive artifacts to be
-        used by other builders"""
+        used by other builders.
 
-        self.addStep(steps.ShellCommand(
+        The ".repo" directory is only archived completely if the latest
+        baseline is too old (see the ``repo_quicksync_baseline_max_age_days``
+        setup setting) or if requested by the ``produce_repo_quicksync_baseline``
+        property. Otherwise, only the delta against the latest baseline is
+        archived and the baseline is carried over from the previous build."""
+
+        self.addStep(steps.SetPropertyFromCommand(
+            name="assert which quick-sync repo artifact to produce"[:50],
+            property="repo_quicksync_artifact_kind",
+            haltOnFailure=True,
+            command=clipos.steps.ArtifactsShellCommand.wrap(textwrap.dedent(
+                r"""
+                kind="baseline"
+                manifest="$(mktemp)"
+                artifacts_discard "${REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME}"
+                if [[ "${produce_repo_quicksync_baseline:-}" -ne 0 ]]; then
+                    echo >&2 "A new baseline is explicitly requested."
+                elif ! artifacts_remote_manifest "${LATEST_ARTIFACTS_PATH_ON_FTP}" \
+                        > "${manifest}"; then
+                    echo >&2 "No previous quick-sync artifacts to produce a delta against."
+                else
+                    repodir_entry="$(artifacts_manifest_lookup "${manifest}" \
+                        "${REPO_DIR_ARCHIVE_ARTIFACT_FILENAME}")"
+                    refs_entry="$(artifacts_manifest_lookup "${manifest}" \
+                        "${REPO_BASELINE_REFS_ARTIFACT_FILENAME}")"
+                    if [[ -z "${repodir_entry}" || -z "${refs_entry}" ]]; then
+                        echo >&2 "The previous quick-sync artifacts do not hold any baseline."
+                    else
+                        read -r _ _ baseline_timestamp baseline_buildnumber < <(
+                            artifacts_remote_get_stream \
+                                "$(artifacts_object_path "${refs_entry#* }")")
+                        baseline_age_days=$(( ($(date +%s) - baseline_timestamp + 43200) / 86400 ))
+                        if (( baseline_age_days >= BASELINE_MAX_AGE_DAYS )); then
+                            echo >&2 "The baseline of build ${baseline_buildnumber} is ${baseline_age_days} days old: renewing it."
+                        else
+                            echo >&2 "Producing a delta against the baseline of build ${baseline_buildnumber} (${baseline_age_days} days old)."
+                            artifacts_reference "${repodir_entry% *}" "${repodir_entry#* }"
+                            artifacts_reference "${refs_entry% *}" "${refs_entry#* }"
+                            kind="delta"
+                        fi
+                    fi
+                fi
+                rm -f "${manifest}"
+                echo "${kind}"
+                """).strip()),
+            env=self._artifactsEnv(
+                produce_repo_quicksync_baseline=util.Interpolate(
+                    "%(prop:produce_repo_quicksync_baseline:#?|1|0)s"),
+                BASELINE_MAX_AGE_DAYS=str(
+                    self.buildmaster_setup.repo_quicksync_baseline_max_age_days),
+                REPO_DIR_ARCHIVE_ARTIFACT_FILENAME=self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
+                REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME=self.REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME,
+                REPO_BASELINE_REFS_ARTIFACT_FILENAME=self.REPO_BASELINE_REFS_ARTIFACT_FILENAME,
+                LATEST_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
+                    "/", "quicksync-artifacts", "buildername",
+                    buildnumber_shard="latest",
+                ),
+            ),
+        ))
+
+        def is_repo_quicksync_artifact_kind(kind: str):
+            def checker(step: BuildStep) -> bool:
+                return step.getProperty("repo_quicksync_artifact_kind") == kind
+            return checker
+
+        self.addStep(clipos.steps.ArtifactsShellCommand(
             name="archive repo directory",
             description=line('''archive the ".repo" directory to serve as an
                              artifact for quicker synchronizations'''),
             haltOnFailure=True,
-            command=["bsdtar", "-cvf", self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
-                     ".repo"],
+            doStepIf=is_repo_quicksync_artifact_kind("baseline"),
+            command=textwrap.dedent(
+                r"""
+                artifacts_archive "${ARTIFACT_FILENAME}" .repo
+
+                # Record the refs of all the projects for the next deltas:
+                artifacts_discard "${REPO_BASELINE_REFS_ARTIFACT_FILENAME}"
+                {
+                    echo "# baseline $(date +%s) ${BUILDNUMBER}"
+                    repo forall -c \
+                        'git for-each-ref --format="${REPO_PATH} %(objectname)"' \
+                        | sort -u
+                } > "${REPO_BASELINE_REFS_ARTIFACT_FILENAME}"
+                """).strip(),
+            env=self._artifactsEnv(
+                ARTIFACT_FILENAME=self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
+                REPO_BASELINE_REFS_ARTIFACT_FILENAME=self.REPO_BASELINE_REFS_ARTIFACT_FILENAME,
+                BUILDNUMBER=util.Interpolate("%(prop:buildnumber)s"),
+            ),
+        ))
+
+        self.addStep(clipos.steps.ArtifactsShellCommand(
+            name="archive repo directory delta",
+            description=line("""archive the Git objects fetched since the
+                             latest ".repo" directory baseline as Git
+                             bundles"""),
+            haltOnFailure=True,
+            doStepIf=is_repo_quicksync_artifact_kind("delta"),
+            command=textwrap.dedent(
+                r"""
+                deltadir="$(mktemp -d)"
+                baseline_refs="$(mktemp)"
+                artifacts_remote_get_stream "$(artifacts_object_path \
+                    "$(cat "${REPO_BASELINE_REFS_ARTIFACT_FILENAME}.ref")")" \
+                    > "${baseline_refs}"
+
+                index=0
+                touch "${deltadir}/index"
+                while read -r path; do
+                    # Exclude from the bundle all the objects reachable from
+                    # the refs of the baseline still known by this project:
+                    exclusions=()
+                    while read -r object; do
+                        if git -C "${path}" cat-file -e "${object}" 2>/dev/null; then
+                            exclusions+=("^${object}")
+                        fi
+                    done < <(awk -v path="${path}" '$1 == path { print $2 }' \
+                                 "${baseline_refs}")
+                    if [[ "${#exclusions[@]}" -eq 0 ]]; then
+                        # Project not part of the baseline: let repo sync
+                        # fetch it completely on the consumer side.
+                        continue
+                    fi
+                    # Note: git bundle refuses to create empty bundles (i.e.
+                    # when the project has not changed since the baseline).
+                    if git -C "${path}" bundle create \
+                            "${deltadir}/${index}.bundle" \
+                            --all "${exclusions[@]}" 2>/dev/null; then
+                        echo "${index}.bundle ${path}" >> "${deltadir}/index"
+                        index=$((index + 1))
+                    fi
+                done < <(repo forall -c 'echo "${REPO_PATH}"')
+                echo "${index} project(s) changed since the baseline."
+
+                artifacts_archive "${ARTIFACT_FILENAME}" -C "${deltadir}" .
+                rm -rf "${deltadir}" "${baseline_refs}"
+                """).strip(),
+            env=self._artifactsEnv(
+                ARTIFACT_FILENAME=self.REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME,
+                REPO_BASELINE_REFS_ARTIFACT_FILENAME=self.REPO_BASELINE_REFS_ARTIFACT_FILENAME,
+            ),
         ))
 
         # HACK: We need to resort to this if we want to archive also the Git
         # LFS objects as repo does not encompass them as a symlink under
-        # ".repo/projects" as of today (Nov. 2018).
-        self.addStep(steps.ShellCommand(
+        # ".repo/projects" as of today (Nov. 2018). The more recent versions
+        # of repo make the ".git" directory of the projects a symlink to their
+        # directory under ".repo/projects" though: their Git LFS objects are
+        # then already part of the ".repo" directory archive (and bsdtar
+        # would refuse to extract them through this symlink anyway).
+        self.addStep(clipos.steps.ArtifactsShellCommand(
             name="archive git lfs directories",
             description=line("""archive the ".git/lfs" directories to serve as
                              an artifact for quicker synchronizations"""),
             haltOnFailure=True,
-            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+            command=textwrap.dedent(
                 r"""
-                set -e -u -o pipefail
-
                 # Retrieve all the .git/lfs valid paths
                 readarray -t potential_git_lfs_paths <<< \
                     "$(repo forall -c 'echo "${REPO_PATH}/.git/lfs"')"
                 git_lfs_paths=()
                 for path in "${potential_git_lfs_paths[@]}"; do
-                    if [[ -d "${path}" ]]; then
+                    if [[ -d "${path}" && ! -L "${path%/lfs}" ]]; then
                         git_lfs_paths+=("${path}")
                     fi
                 done
 
-                # Archive them
-                bsdtar -cvf "${ARTIFACT_FILENAME:?}" "${git_lfs_paths[@]}"
-                """).strip()],
-            env={
-                "ARTIFACT_FILENAME": self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
-            },
+                # Archive them (the archive is empty if there are none as the
+                # consumers of this artifact expect it anyway)
+                if [[ "${#git_lfs_paths[@]}" -eq 0 ]]; then
+                    git_lfs_paths=(-T /dev/null)
+                fi
+                artifacts_archive "${ARTIFACT_FILENAME:?}" "${git_lfs_paths[@]}"
+                """).strip(),
+            env=self._artifactsEnv(
+                ARTIFACT_FILENAME=self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
+            ),
         ))
 
     def _uploadSourceTreeQuicksyncArtifacts(self):
         """Upload the source tree artifacts to the buildmaster"""
 
-        self.addStep(steps.ShellCommand(
+        self.addStep(clipos.steps.ArtifactsShellCommand(
             name="save repo quick-sync artifacts on buildmaster",
             description=line(
                 """save the ".repo" directory archive and ".git/lfs"
                 directories archive as artifacts on the buildmaster"""),
             haltOnFailure=True,
-            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+            command=textwrap.dedent(
                 r"""
-                set -e -u -o pipefail
-                cat <<END_OF_LFTP_SCRIPT | lftp
-                connect ${ARTIFACTS_FTP_URL}
-                mkdir -p ${DESTINATION_PATH_IN_FTP}
-                cd ${DESTINATION_PATH_IN_FTP}
-                mput ${REPO_DIR_ARCHIVE_ARTIFACT_FILENAME} \
-                     ${GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME}
-                END_OF_LFTP_SCRIPT
-                """).strip()],
-            env={
-                "ARTIFACTS_FTP_URL": self.buildmaster_setup.artifacts_ftp_url,
-                "DESTINATION_PATH_IN_FTP": compute_artifact_path(
+                readarray -t archives < <(artifacts_local_archives \
+                    "${REPO_DIR_ARCHIVE_ARTIFACT_FILENAME}" \
+                    "${REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME}" \
+                    "${REPO_BASELINE_REFS_ARTIFACT_FILENAME}" \
+                    "${GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME}")
+                artifacts_push "${DESTINATION_PATH_IN_FTP}" "${archives[@]}"
+                """).strip(),
+            env=self._artifactsEnv(
+                DESTINATION_PATH_IN_FTP=compute_artifact_path(
                     "/", "quicksync-artifacts", "buildername",
                     buildnumber_shard=True,
+                    staged=True,
                 ),
-                "REPO_DIR_ARCHIVE_ARTIFACT_FILENAME": self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
-                "GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME": self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
-            },
-        ))
-        self.addStep(steps.MasterShellCommand(
-            name="symlink latest artifacts location on buildmaster",
-            haltOnFailure=True,
-            command=[
-                "ln", "-snf", util.Interpolate("%(prop:buildnumber)s"),
-                compute_artifact_path(
-                    self.buildmaster_setup.artifacts_dir,
-                    "quicksync-artifacts",
-                    "buildername",
-                    buildnumber_shard="latest",
-                ),
-            ],
+                REPO_DIR_ARCHIVE_ARTIFACT_FILENAME=self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
+                REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME=self.REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME,
+                REPO_BASELINE_REFS_ARTIFACT_FILENAME=self.REPO_BASELINE_REFS_ARTIFACT_FILENAME,
+                GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME=self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
+            ),
         ))
+        self._registerArtifactsOnBuildmaster("quicksync-artifacts")
 
     def _downloadSourceTreeQuicksyncArtifacts(self):
         """Download the source tree artifacts from the buildmaster and from the
-        builder directory output into the builder workspace."""
+        builder directory output into the builder workspace.
+
+        The quick-sync artifacts kept in the workspace from a previous build
+        are only downloaded again if they differ from the latest ones saved on
+        the buildmaster. Nothing is downloaded here if the artifacts are
+        streamed as they are then downloaded while being extracted. The
+        ".repo" directory artifacts are left aside if the repo mirror is used
+        instead (see `_initRepoWithMirrorReference`)."""
+
+        artifacts = [
+                (self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
+                 "retrieve repo directory artifact",
+                 'retrieve the ".repo" directory archive from the buildmaster',
+                 self._isRepoMirrorUnused),
+                (self.REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME,
+                 "retrieve repo directory delta artifact",
+                 'retrieve the ".repo" directory delta archive from the buildmaster',
+                 self._isRepoMirrorUnused),
+                (self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
+                 "retrieve git-lfs directories artifact",
+                 'retrieve the ".git/lfs" directories archive from the buildmaster',
+                 lambda step: True),
+        ]
+
+        for artifact_filename, step_name, description, is_needed in artifacts:
+            self.addStep(clipos.steps.ArtifactsShellCommand(
+                name=step_name,
+                description=description,
+                haltOnFailure=True,
+                doStepIf=self._unlessWorkspaceSnapshotRestored(
+                    lambda step, is_needed=is_needed: (
+                        not self._isArtifactsStreamingEnabled(step) and
+                        is_needed(step))),
+                command=textwrap.dedent(
+                    r"""
+                    if [[ "${force_repo_quicksync_artifacts_download:-}" -ne 0 ]]; then
+                        artifacts_discard "${ARTIFACT_FILENAME}"
+                    fi
+                    if [[ "${ARTIFACT_FILENAME}" == "${REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME}" ]] &&
+                            ! artifacts_remote_has "${LATEST_ARTIFACTS_PATH_ON_FTP}" \
+                                "${ARTIFACT_FILENAME}"; then
+                        echo "The latest quick-sync artifacts are a baseline: no delta to retrieve."
+                        artifacts_discard "${ARTIFACT_FILENAME}"
+                        exit 0
+                    fi
+                    artifacts_pull "${LATEST_ARTIFACTS_PATH_ON_FTP}" \
+                        "${ARTIFACT_FILENAME}"
+                    """).strip(),
+                env=self._artifactsEnv(
+                    force_repo_quicksync_artifacts_download=util.Interpolate(
+                        "%(prop:force_repo_quicksync_artifacts_download:#?|1|0)s"),
+                    ARTIFACT_FILENAME=artifact_filename,
+                    REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME=self.REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME,
+                    LATEST_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
+                        "/", "quicksync-artifacts",
+                        'buildername_providing_repo_quicksync_artifacts',
+                        buildnumber_shard="latest",
+                    ),
+                ),
+            ))
+
+    @staticmethod
+    def _isRepoMirrorUnused(step: BuildStep) -> bool:
+        """Returns whether the source tree of the build of the given step is
+        not synchronized with the repo mirror as reference (see
+        `_initRepoWithMirrorReference`)."""
+
+        return not step.getProperty("repo_mirror_used")
+
+    def _initRepoWithMirrorReference(self):
+        """Initialize the repo source tree with the repo mirror bind-mounted in
+        the worker as reference: the Git objects already present in the
+        mirror are then borrowed (via Git alternates) instead of being copied
+        into the workspace. The settings given to ``repo init`` are kept by
+        repo for the subsequent synchronizations.
+
+        The ``repo_mirror_used`` build property records whether the mirror
+        has been used: as long as it has not been initialized, the ".repo"
+        directory quick-sync artifacts are used instead."""
 
         self.addStep(steps.SetPropertyFromCommand(
-            name="assert which quicksync artifact download is required"[:50],
-            property="which_repo_quicksync_artifact_to_download",
-            doStepIf=lambda step: not bool(step.getProperty("force_repo_quicksync_artifacts_download")),
+            name="repo init with mirror reference",
+            description=line("""initialize the repo source tree with the repo
+                             mirror as reference object store"""),
+            haltOnFailure=True,
+            doStepIf=self._unlessWorkspaceSnapshotRestored(),
+            extract_fn=lambda rc, stdout, stderr: {
+                "repo_mirror_used": "repo_mirror_used=1" in stdout.splitlines(),
+            },
             command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
                 r"""
                 set -e -u -o pipefail
-                to_download=()  # which artifact will be downloaded
-                if [[ ! -f "${REPO_DIR_ARCHIVE_ARTIFACT_FILENAME}" ]]; then
-                    to_download+=("repo-dir")
-                fi
-                if [[ ! -f "${GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME}" ]]; then
-                    to_download+=("git-lfs-dirs")
+
+                if [[ ! -d "${REPO_MIRROR_DIR}/.repo" ]]; then
+                    echo >&2 "The repo mirror has not been initialized yet: not using it."
+                    echo "repo_mirror_used=0"
+                    exit 0
                 fi
-                echo "${to_download[@]}"
+
+                repo init --manifest-url="${REPO_MANIFEST_URL}" \
+                    --manifest-branch="${REPO_MANIFEST_BRANCH}" \
+                    --reference="${REPO_MIRROR_DIR}" >&2
+                echo "repo_mirror_used=1"
                 """).strip()],
-            haltOnFailure=False,
-            warnOnFailure=True,
             env={
-                "REPO_DIR_ARCHIVE_ARTIFACT_FILENAME": self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
-                "GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME": self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
+                "REPO_MIRROR_DIR": clipos.workers.DockerLatentWorker.REPO_MIRROR_DIR,
+                "REPO_MANIFEST_URL": util.Property("repository"),
+                "REPO_MANIFEST_BRANCH": util.Property("branch"),
             },
         ))
 
-        def is_artifact_download_required(quicksync_artifact_type):
-            def checker(step: BuildStep) -> bool:
-                return (
-                    bool(step.getProperty("force_repo_quicksync_artifacts_download")) or
-                    (quicksync_artifact_type in
-                     str(step.getProperty("which_repo_quicksync_artifact_to_download")).split())
-                )
-            return checker
-
-        self.addStep(steps.ShellCommand(
-            name="retrieve repo directory artifact",
-            description='retrieve the ".repo" directory archive from the buildmaster',
+    def updateRepoMirror(self):
+        """Update (or create if needed) the repo mirror bind-mounted in the
+        worker from the manifest given by the build properties. This mirror is
+        then used as reference object store by the other builders.
+
+        The mirror is seeded with the Git objects of the source tree that has
+        just been synchronized in the workspace so that only what has changed
+        since then is fetched from the network: the missing projects are
+        created with the workspace as reference (their borrowed objects being
+        then copied into the mirror as the workspace does not last) and the
+        existing ones fetch the branches of their workspace counterparts."""
+
+        self.addStep(clipos.steps.ArtifactsShellCommand(
+            name="update repo mirror",
+            description="update the repo mirror shared by the workers",
             haltOnFailure=True,
-            doStepIf=is_artifact_download_required("repo-dir"),
-            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+            command=textwrap.dedent(
                 r"""
-                set -e -u -o pipefail
-                cat <<END_OF_LFTP_SCRIPT | lftp
-                connect ${ARTIFACTS_FTP_URL}
-                set xfer:clobber yes
-                mget ${LATEST_REPO_DIR_ARCHIVE_ARTIFACT_FILEPATH_ON_FTP}
-                END_OF_LFTP_SCRIPT
-                """).strip()],
-            env={
-                "ARTIFACTS_FTP_URL": self.buildmaster_setup.artifacts_ftp_url,
-                "LATEST_REPO_DIR_ARCHIVE_ARTIFACT_FILEPATH_ON_FTP": compute_artifact_path(
+                # Keep the file listings in the workspace:
+                ARTIFACTS_LISTINGS_DIR="${PWD}/${ARTIFACTS_LISTINGS_DIR}"
+                workspace="${PWD}"
+                cd "${REPO_MIRROR_DIR}"
+
+                # Never update the mirror concurrently:
+                exec 9> .update.lock
+                flock 9
+
+                repo init --mirror --manifest-url="${REPO_MANIFEST_URL}" \
+                    --manifest-branch="${REPO_MANIFEST_BRANCH}" \
+                    --reference="${workspace}"
+
+                projects=()
+                while read -r name path remote; do
+                    projects+=("${name}")
+                    if [[ -d "${name}.git" ]]; then
+                        git --git-dir="${name}.git" fetch --quiet --no-tags \
+                            "${workspace}/${path}" \
+                            "+refs/remotes/${remote}/*:refs/heads/*"
+                        git --git-dir="${name}.git" update-ref -d refs/heads/HEAD \
+                            2>/dev/null || :
+                    fi
+                done < <(cd "${workspace}" && repo forall -c \
+                             'echo "${REPO_PROJECT} ${REPO_PATH} ${REPO_REMOTE}"')
+
+                artifacts_summarize_log "repo sync (mirror)" "${LISTING_REGEXP}" \
+                    repo sync --jobs="${REPO_SYNC_NETWORK_JOBS}"
+
+                # Never let the mirror depend on the workspace:
+                for name in "${projects[@]}"; do
+                    if [[ -f "${name}.git/objects/info/alternates" ]]; then
+                        git --git-dir="${name}.git" repack -a -d -q
+                        rm -f "${name}.git/objects/info/alternates"
+                    fi
+                done
+                """).strip(),
+            env=self._artifactsEnv(
+                REPO_SYNC_NETWORK_JOBS=util.Interpolate("%(prop:repo_sync_network_jobs:-4)s"),
+                REPO_MIRROR_DIR=clipos.workers.DockerLatentWorker.REPO_MIRROR_DIR,
+                REPO_MANIFEST_URL=util.Property("repository"),
+                REPO_MANIFEST_BRANCH=util.Property("branch"),
+                LISTING_REGEXP=self.REPO_SYNC_LISTING_REGEXP,
+            ),
+        ))
+
+    def _extractRepoSourceTreeArtifact(self):
+        """Extract the ".repo" archive artifact in the current working tree of
+        the builder."""
+
+        self.addStep(clipos.steps.ArtifactsShellCommand(
+            name="extract repo directory",
+            description=line("""extract the ".repo" directory archive artifact
+                             in the current working tree"""),
+            haltOnFailure=True,
+            doStepIf=self._unlessWorkspaceSnapshotRestored(
+                self._isRepoMirrorUnused),
+            command=r'artifacts_extract "${LATEST_ARTIFACTS_PATH_ON_FTP}" "${ARTIFACT_FILENAME}"',
+            env=self._artifactsEnv(
+                ARTIFACT_FILENAME=self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
+                LATEST_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
                     "/", "quicksync-artifacts",
                     'buildername_providing_repo_quicksync_artifacts',
-                    self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME,
                     buildnumber_shard="latest",
                 ),
-            },
+            ),
         ))
-        self.addStep(steps.ShellCommand(
-            name="retrieve git-lfs directories artifact",
-            description='retrieve the ".git/lfs" directories archive from the buildmaster',
+
+    def _applyRepoSourceTreeDeltaArtifact(self):
+        """Fetch the Git objects of the ".repo" directory delta archive
+        artifact (if the latest quick-sync artifacts provide one) into the
+        projects of the ".repo" directory extracted beforehand."""
+
+        self.addStep(clipos.steps.ArtifactsShellCommand(
+            name="apply repo directory delta",
+            description=line("""fetch the Git objects of the ".repo"
+                             directory delta archive artifact into the
+                             ".repo" directory"""),
             haltOnFailure=True,
-            doStepIf=is_artifact_download_required("git-lfs-dirs"),
-            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+            doStepIf=self._unlessWorkspaceSnapshotRestored(
+                self._isRepoMirrorUnused),
+            command=textwrap.dedent(
                 r"""
-                set -e -u -o pipefail
-                cat <<END_OF_LFTP_SCRIPT | lftp
-                connect ${ARTIFACTS_FTP_URL}
-                set xfer:clobber yes
-                mget ${LATEST_GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILEPATH_ON_FTP}
-                END_OF_LFTP_SCRIPT
-                """).strip()],
-            env={
-                "ARTIFACTS_FTP_URL": self.buildmaster_setup.artifacts_ftp_url,
-                "LATEST_GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILEPATH_ON_FTP": compute_artifact_path(
+                if ! artifacts_remote_has "${LATEST_ARTIFACTS_PATH_ON_FTP}" \
+                        "${ARTIFACT_FILENAME}"; then
+                    echo "The latest quick-sync artifacts are a baseline: no delta to apply."
+                    exit 0
+                fi
+
+                deltadir="$(mktemp -d -p . .repo-delta.XXXXXX)"
+                artifacts_extract "${LATEST_ARTIFACTS_PATH_ON_FTP}" \
+                    "${ARTIFACT_FILENAME}" -C "${deltadir}"
+                while read -r bundle path; do
+                    if [[ -d ".repo/projects/${path}.git" ]]; then
+                        git --git-dir=".repo/projects/${path}.git" fetch \
+                            --quiet --update-head-ok \
+                            "${deltadir}/${bundle}" '+refs/*:refs/*'
+                    fi
+                done < "${deltadir}/index"
+                rm -rf "${deltadir}"
+                """).strip(),
+            env=self._artifactsEnv(
+                ARTIFACT_FILENAME=self.REPO_DIR_DELTA_ARCHIVE_ARTIFACT_FILENAME,
+                LATEST_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
                     "/", "quicksync-artifacts",
                     'buildername_providing_repo_quicksync_artifacts',
-                    self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
                     buildnumber_shard="latest",
                 ),
-            },
-        ))
-
-    def _extractRepoSourceTreeArtifact(self):
-        """Extract the ".repo" archive artifact in the current working tree of
-        the builder."""
-
-        self.addStep(steps.ShellCommand(
-            name="extract repo directory",
-            description=line("""extract the ".repo" directory archive artifact
-                             in the current working tree"""),
-            haltOnFailure=True,
-            command=["bsdtar", "-xvf", self.REPO_DIR_ARCHIVE_ARTIFACT_FILENAME],
+            ),
         ))
 
     def _extractGitLfsArtifact(self):
         """Extract the ".git/lfs" directories archive artifact in the current
         working tree of the builder."""
 
-        self.addStep(steps.ShellCommand(
+        self.addStep(clipos.steps.ArtifactsShellCommand(
             name="extract git-lfs directories",
             description=line("""extract the ".git/lfs" directories archive
                              artifact in the current working tree"""),
             haltOnFailure=True,
-            command=["bsdtar", "-xvf",
-                     self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME],
+            doStepIf=self._unlessWorkspaceSnapshotRestored(),
+            command=r'artifacts_extract "${LATEST_ARTIFACTS_PATH_ON_FTP}" "${ARTIFACT_FILENAME}"',
+            env=self._artifactsEnv(
+                ARTIFACT_FILENAME=self.GIT_LFS_SUBDIRECTORIES_ARCHIVE_ARTIFACT_FILENAME,
+                LATEST_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
+                    "/", "quicksync-artifacts",
+                    'buildername_providing_repo_quicksync_artifacts',
+                    buildnumber_shard="latest",
+                ),
+            ),
         ))
 
 
@@ -676,6 +1750,9 @@ class RepoSyncFromScratchAndArchive(ClipOsSourceTreeBuildFactoryBase):
         self.cleanupWorkspaceIfRequested()
         self.syncSources(use_repo_quicksync_artifacts=False)  # i.e. from scratch
         self.produceAndUploadSourceTreeQuicksyncArtifacts()
+        if self.buildmaster_setup.repo_mirror_host_dir:
+            self.updateRepoMirror()
+        self.uploadFileListingsOnFailure()
 
 
 class ClipOsToolkitEnvironmentBuildFactoryBase(ClipOsSourceTreeBuildFactoryBase):
@@ -692,71 +1769,262 @@ class ClipOsToolkitEnvironmentBuildFactoryBase(ClipOsSourceTreeBuildFactoryBase)
             command=r"sudo rm -rf run && toolkit/setup.sh",
         ))
 
+    def _isStepwiseProductBuild(self, step: BuildStep) -> bool:
+        """Returns whether the product is built one recipe phase per step
+        (rather than all the recipes concurrently in one step) for the build
+        of the given step. This is always the case when resuming a build."""
+
+        return bool(step.getProperty("resume_product_build") or
+                    step.getProperty("product_build_mode") == "stepwise")
+
     def _getRequestedArtifactsFromBuildmaster(self, sdks: List[str],
                                               cache: List[str]):
-        for recipe in sdks:
-            product_name, recipe_name = recipe.split('/')
-            sdk_recipe_artifact_archive = "sdk:{}.{}.tar".format(product_name, recipe_name)
-            self.addStep(steps.ShellCommand(
-                name="retrieve {} SDK artifact".format(recipe)[:50],
-                description=line(
-                    """retrieve the SDK artifact for \"{}/{}\" from the
-                    appropriate builder artifacts output on
-                    buildmaster""").format(product_name, recipe_name),
-                haltOnFailure=True,
-                doStepIf=lambda step: bool(step.getProperty("reuse_sdks_artifacts")),
-                command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
-                    r"""
-                    set -e -u -o pipefail
-                    cat <<END_OF_LFTP_SCRIPT | lftp
-                    connect ${ARTIFACTS_FTP_URL}
-                    set xfer:clobber yes
-                    mget ${SOURCE_PATH_ON_FTP}
-                    END_OF_LFTP_SCRIPT
-                    """).strip()],
-                env={
-                    "ARTIFACTS_FTP_URL": self.buildmaster_setup.artifacts_ftp_url,
-                    "SOURCE_PATH_ON_FTP": compute_artifact_path(
-                        "/", "sdks",
-                        "buildername_providing_sdks_artifacts",
-                        sdk_recipe_artifact_archive,
-                        buildnumber_shard="latest",
-                    ),
-                },
-            ))
+        """Retrieve concurrently in one step the SDK and cache artifacts of the
+        given recipes (provided that their reuse is requested by the build
+        properties) from the appropriate builders artifacts output on the
+        buildmaster."""
+
+        def is_artifacts_download_required(step: BuildStep) -> bool:
+            return (
+                (bool(step.getProperty("reuse_sdks_artifacts")) or
+                 bool(step.getProperty("reuse_cache_artifacts"))) and
+                not self._isArtifactsStreamingEnabled(step)
+            )
+
+        sdk_artifacts = [
+            "sdk:{}.{}.tar".format(*recipe.split('/')) for recipe in sdks
+        ]
+        cache_artifacts = [
+            "cache:{}.{}.tar".format(*recipe.split('/')) for recipe in cache
+        ]
+
+        self.addStep(clipos.steps.ArtifactsShellCommand(
+            name="retrieve SDK and cache artifacts",
+            description=line(
+                """retrieve concurrently the SDK and cache artifacts from the
+                appropriate builders artifacts output on buildmaster"""),
+            haltOnFailure=True,
+            doStepIf=is_artifacts_download_required,
+            command=textwrap.dedent(
+                r"""
+                to_download=()
+                if [[ "${reuse_sdks_artifacts:-}" -ne 0 ]]; then
+                    for artifact in ${SDK_ARTIFACTS}; do
+                        to_download+=("${SDKS_ARTIFACTS_PATH_ON_FTP}" "${artifact}")
+                    done
+                fi
+                if [[ "${reuse_cache_artifacts:-}" -ne 0 ]]; then
+                    for artifact in ${CACHE_ARTIFACTS}; do
+                        to_download+=("${CACHE_ARTIFACTS_PATH_ON_FTP}" "${artifact}")
+                    done
+                fi
+                artifacts_pull_many "${to_download[@]}"
+                """).strip(),
+            env=self._artifactsEnv(
+                reuse_sdks_artifacts=util.Interpolate("%(prop:reuse_sdks_artifacts:#?|1|0)s"),
+                reuse_cache_artifacts=util.Interpolate("%(prop:reuse_cache_artifacts:#?|1|0)s"),
+                SDK_ARTIFACTS=" ".join(sdk_artifacts),
+                CACHE_ARTIFACTS=" ".join(cache_artifacts),
+                SDKS_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
+                    "/", "sdks",
+                    "buildername_providing_sdks_artifacts",
+                    buildnumber_shard="latest",
+                ),
+                CACHE_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
+                    "/", "cache",
+                    "buildername_providing_cache_artifacts",
+                    buildnumber_shard="latest",
+                ),
+            ),
+        ))
 
-        for recipe in cache:
-            product_name, recipe_name = recipe.split('/')
-            cache_recipe_artifact_archive = "cache:{}.{}.tar".format(product_name, recipe_name)
-            self.addStep(steps.ShellCommand(
-                name="retrieve {} cache artifact".format(recipe)[:50],
-                description=line(
-                    """retrieve the cache artifact for \"{}/{}\" from the
-                    appropriate builder artifacts output on
-                    buildmaster""").format(product_name, recipe_name),
-                haltOnFailure=True,
-                doStepIf=lambda step: bool(step.getProperty("reuse_cache_artifacts")),
-                command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+    # The recipes of the CLIP OS product as a dependency graph: each recipe is
+    # associated to the function of the "complete-build.sh" script to call for
+    # it and to the recipes it depends on. The independent recipes are built
+    # concurrently.
+    CLIPOS_RECIPES_GRAPH = [
+        ("clipos/sdk", "reuse-or-bootstrap_sdk", []),
+        ("clipos/sdk_debian", "reuse-or-bootstrap_sdk", []),
+        ("clipos/core", "build-image-configure-bundle_recipe", ["clipos/sdk"]),
+        ("clipos/efiboot", "build-image-configure-bundle_recipe", ["clipos/sdk"]),
+        ("clipos/qemu", "bundle_recipe",
+         ["clipos/sdk_debian", "clipos/core", "clipos/efiboot"]),
+    ]
+
+    # The phases of the recipes for each function of the "complete-build.sh"
+    # script used in the recipes dependency graph above (each phase being
+    # run by the "phase_<phase>" function of this script):
+    RECIPE_PHASES = {
+        "reuse-or-bootstrap_sdk": ["bootstrap", "archive_sdk"],
+        "build-image-configure_recipe": [
+            "build", "archive_cache", "image", "configure",
+        ],
+        "bundle_recipe": ["bundle", "archive_bundle"],
+        "build-image-configure-bundle_recipe": [
+            "build", "archive_cache", "image", "configure",
+            "bundle", "archive_bundle",
+        ],
+    }
+
+    # The directory (relative to the workspace) where are marked the recipe
+    # phases completed by the stepwise product builds:
+    BUILD_PHASES_MARKERS_DIR = ".build-phases"
+
+    # The directory on the buildmaster where are stored the results of the
+    # recipes keyed by the fingerprint of their inputs (see the
+    # ``use_recipe_results_cache`` build property):
+    RECIPE_RESULTS_PATH_ON_FTP = "/recipe-results"
+
+    # The build properties that must match (along with the fingerprint of the
+    # source tree) for a build to be skipped in favor of a previous one (see
+    # `skipBuildIfSourceTreeUnchanged`), i.e. the ones selecting the artifacts
+    # reused and produced by the build:
+    UNCHANGED_BUILD_KEY_PROPERTIES = [
+        "produce_sdks_artifacts",
+        "reuse_sdks_artifacts",
+        "buildername_providing_sdks_artifacts",
+        "produce_cache_artifacts",
+        "reuse_cache_artifacts",
+        "buildername_providing_cache_artifacts",
+        "produce_build_artifacts",
+    ]
+
+    # The path to the file defining the source tree fingerprinting helper
+    # functions:
+    SOURCE_TREE_LIBRARY_FILE = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), "scripts/source-tree.sh")
+
+    @classmethod
+    def sourceTreeLibrary(cls) -> str:
+        """Returns the contents of the source tree helper functions file"""
+
+        return read_text_file(cls.SOURCE_TREE_LIBRARY_FILE)
+
+    @staticmethod
+    def buildScriptsDigest() -> str:
+        """Returns the digest of the scripts run by the product builds (which
+        are therefore part of the inputs of the build)"""
+
+        current_location = os.path.dirname(os.path.realpath(__file__))
+        return hashlib.sha256("".join(
+            read_text_file(os.path.join(current_location, "scripts", name))
+            for name in ["artifacts.sh", "source-tree.sh", "complete-build.sh"]
+        ).encode()).hexdigest()
+
+    def skipBuildIfSourceTreeUnchanged(self):
+        """Compute the fingerprint of the inputs of the build from the
+        revisions of the projects resolved on their remote repositories (see
+        `_fingerprintSourceTree`) and, if the ``skip_build_if_unchanged``
+        build property is set, end the build right away when a previous
+        successful build of the same builder has been done with the same
+        fingerprint and the same artifacts settings (see
+        `clipos.steps.SkipBuildIfUnchanged`).
+
+        This is meant to be called before synchronizing the source tree in
+        order not to spend any time on an unchanged one. The fingerprint must
+        then be recomputed once the source tree is synchronized (see
+        `recordSourceTreeFingerprint`)."""
+
+        additional_git_https_cacerts_provided = bool(
+            self.buildmaster_setup.private_settings_addendum and
+            self.buildmaster_setup.private_settings_addendum.additional_git_https_cacerts
+        )
+        if additional_git_https_cacerts_provided:
+            # The remote repositories are queried before the source tree
+            # synchronization declares these CA certificates:
+            self._addCaCertsForHttpsGitRemotes()
+
+        self._fingerprintSourceTree(remote=True)
+
+        self.addStep(clipos.steps.SkipBuildIfUnchanged(
+            fingerprint_property="manifest_fingerprint",
+            key_properties=self.UNCHANGED_BUILD_KEY_PROPERTIES,
+        ))
+
+    def recordSourceTreeFingerprint(self):
+        """Recompute the fingerprint of the inputs of the build from the
+        revisions checked out in the synchronized source tree (see
+        `_fingerprintSourceTree`): the branches of the projects may have moved
+        since `skipBuildIfSourceTreeUnchanged` has resolved them and the
+        fingerprint recorded by the build must be the one of the sources
+        actually built."""
+
+        self._fingerprintSourceTree(remote=False)
+
+    def _fingerprintSourceTree(self, remote: bool):
+        """Compute the fingerprint of the inputs of the build (the revisions
+        of all the projects of the source tree, the build environment flavor
+        and the build scripts) into the ``manifest_fingerprint`` build
+        property with the ``source_tree_fingerprint`` function of the
+        "scripts/source-tree.sh" file (shared with the recipe results cache of
+        the "scripts/complete-build.sh" file).
+
+        :param remote: whether to resolve the revisions of the projects on
+            their remote repositories from the manifest rather than reading
+            them from the synchronized source tree
+
+        """
+
+        @util.renderer
+        def local_manifest_xml(props):
+            if not props.getProperty("use_local_manifest"):
+                return ""
+            return props.getProperty("local_manifest_xml") or ""
+
+        self.addStep(steps.SetPropertyFromCommand(
+            name=("fingerprint the remote source tree" if remote else
+                  "fingerprint the source tree"),
+            description=("compute the fingerprint of the source tree "
+                         "revisions resolved on the remotes" if remote else
+                         "compute the fingerprint of the source tree revisions"),
+            haltOnFailure=False,
+            flunkOnFailure=False,
+            warnOnFailure=True,
+            # Querying the remotes is only worth it to skip the build:
+            doStepIf=(lambda step: bool(step.getProperty(
+                "skip_build_if_unchanged"))) if remote else True,
+            hideStepIf=lambda results, step: results == SKIPPED,
+            property="manifest_fingerprint",
+            command=["/usr/bin/env", "bash", "-c", "{}\n\n{}".format(
+                self.sourceTreeLibrary(),
+                textwrap.dedent(
                     r"""
                     set -e -u -o pipefail
-                    cat <<END_OF_LFTP_SCRIPT | lftp
-                    connect ${ARTIFACTS_FTP_URL}
-                    set xfer:clobber yes
-                    mget ${SOURCE_PATH_ON_FTP}
-                    END_OF_LFTP_SCRIPT
-                    """).strip()],
-                env={
-                    "ARTIFACTS_FTP_URL": self.buildmaster_setup.artifacts_ftp_url,
-                    "SOURCE_PATH_ON_FTP": compute_artifact_path(
-                        "/", "cache",
-                        "buildername_providing_cache_artifacts",
-                        cache_recipe_artifact_archive,
-                        buildnumber_shard="latest",
-                    ),
-                },
-            ))
+
+                    source_tree_fingerprint ${SOURCE_TREE_REMOTE:+--remote}
+                    """).strip())],
+            env={
+                "SOURCE_TREE_REMOTE": "1" if remote else "",
+                "REPO_MANIFEST_URL": util.Property("repository"),
+                "REPO_MANIFEST_BRANCH": util.Property("branch"),
+                "LOCAL_MANIFEST_XML": local_manifest_xml,
+                "BUILD_ENVIRONMENT_FLAVOR": util.Property(
+                    "clipos_docker_image_flavor", ""),
+                "BUILD_SCRIPTS_DIGEST": self.buildScriptsDigest(),
+            },
+        ))
 
     def buildProduct(self, product_name: str):
+        """Build the given product by running its recipes in the order
+        allowed by its recipes dependency graph (see `CLIPOS_RECIPES_GRAPH`).
+
+        Depending on the ``product_build_mode`` build property, the recipes
+        are either all built in one step with at most as many recipes at once
+        as allowed by the
+        `clipos.buildmaster.SetupSettings.product_build_max_parallel_recipes`
+        setting ("concurrent", the default) or built one phase per step
+        ("stepwise"). In the latter case, the ``resume_product_build`` build
+        property makes the build skip the phases already completed in the
+        workspace by a previous build.
+
+        If the ``use_recipe_results_cache`` build property is set, the build,
+        image and configure phases of a recipe are skipped if its results have
+        already been produced for the same inputs (i.e. the same source tree
+        fingerprint as computed by `_fingerprintSourceTree` and the same SDK
+        artifacts, the SDKs bootstrapped by the build being identified by
+        their archives): the results stored on the buildmaster are restored
+        instead."""
+
         if product_name != 'clipos':
             raise NotImplementedError("Only \"clipos\" product is supported for the moment.")
 
@@ -766,22 +2034,121 @@ class ClipOsToolkitEnvironmentBuildFactoryBase(ClipOsSourceTreeBuildFactoryBase)
             cache=['clipos/core', 'clipos/efiboot'],
         )
         current_location = os.path.dirname(os.path.realpath(__file__))
-        with open(os.path.join(current_location, "scripts/complete-build.sh"),
-                  "r") as scriptfile:
-            self.addStep(clipos.steps.ToolkitEnvironmentShellCommand(
-                name="complete build",
-                haltOnFailure=False,
-                warnOnFailure=True,
-                flunkOnFailure=True,
-                command=scriptfile.read(),
-                env={
-                    "produce_sdks_artifacts": util.Interpolate("%(prop:produce_sdks_artifacts:#?|1|0)s"),
-                    "reuse_sdks_artifacts": util.Interpolate("%(prop:reuse_sdks_artifacts:#?|1|0)s"),
-                    "produce_cache_artifacts": util.Interpolate("%(prop:produce_cache_artifacts:#?|1|0)s"),
-                    "reuse_cache_artifacts": util.Interpolate("%(prop:reuse_cache_artifacts:#?|1|0)s"),
-                    "produce_build_artifacts": util.Interpolate("%(prop:produce_build_artifacts:#?|1|0)s"),
-                },
-            ))
+        # The build script makes use of the artifacts helper functions to
+        # produce and extract the archive artifacts and of the source tree
+        # helper functions to fingerprint the inputs of the recipes:
+        command = "{}\n\n{}\n\n{}".format(
+            clipos.steps.ArtifactsShellCommand.library(),
+            self.sourceTreeLibrary(),
+            read_text_file(os.path.join(current_location,
+                                        "scripts/complete-build.sh")))
+        env = self._artifactsEnv(
+            BUILD_PHASES_MARKERS_DIR=self.BUILD_PHASES_MARKERS_DIR,
+            produce_sdks_artifacts=util.Interpolate("%(prop:produce_sdks_artifacts:#?|1|0)s"),
+            reuse_sdks_artifacts=util.Interpolate("%(prop:reuse_sdks_artifacts:#?|1|0)s"),
+            produce_cache_artifacts=util.Interpolate("%(prop:produce_cache_artifacts:#?|1|0)s"),
+            reuse_cache_artifacts=util.Interpolate("%(prop:reuse_cache_artifacts:#?|1|0)s"),
+            produce_build_artifacts=util.Interpolate("%(prop:produce_build_artifacts:#?|1|0)s"),
+            use_recipe_results_cache=util.Interpolate("%(prop:use_recipe_results_cache:#?|1|0)s"),
+            RECIPE_RESULTS_PATH_ON_FTP=self.RECIPE_RESULTS_PATH_ON_FTP,
+            BUILD_ENVIRONMENT_FLAVOR=util.Property("clipos_docker_image_flavor", ""),
+            BUILD_SCRIPTS_DIGEST=self.buildScriptsDigest(),
+            SDKS_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
+                "/", "sdks",
+                "buildername_providing_sdks_artifacts",
+                buildnumber_shard="latest",
+            ),
+            CACHE_ARTIFACTS_PATH_ON_FTP=compute_artifact_path(
+                "/", "cache",
+                "buildername_providing_cache_artifacts",
+                buildnumber_shard="latest",
+            ),
+        )
+
+        # Either build all the recipes concurrently in one step...
+        self.addStep(clipos.steps.ToolkitEnvironmentShellCommand(
+            name="complete build",
+            haltOnFailure=False,
+            warnOnFailure=True,
+            flunkOnFailure=True,
+            doStepIf=lambda step: not self._isStepwiseProductBuild(step),
+            hideStepIf=lambda results, step: results == SKIPPED,
+            command=command,
+            env={
+                **env,
+                "RECIPES_GRAPH": "\n".join(
+                    " ".join([action, recipe, *dependencies])
+                    for recipe, action, dependencies in self.CLIPOS_RECIPES_GRAPH
+                ),
+                "RECIPES_MAX_PARALLEL_JOBS": str(
+                    self.buildmaster_setup.product_build_max_parallel_recipes),
+            },
+        ))
+
+        # ...or build them one phase per step (in an order compatible with
+        # the recipes dependency graph) in order to get the outcome and the
+        # duration of every phase and to be able to resume a failed build:
+        self.addStep(steps.SetPropertyFromCommand(
+            name="assert completed build phases",
+            haltOnFailure=True,
+            doStepIf=self._isStepwiseProductBuild,
+            hideStepIf=lambda results, step: results == SKIPPED,
+            extract_fn=lambda rc, stdout, stderr: {
+                "completed_build_phases": stdout.split(),
+            },
+            command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
+                r"""
+                set -e -u -o pipefail
+
+                if [[ "${resume_product_build:-}" -eq 0 ]]; then
+                    # Avoid leaving build results of previous run in out/:
+                    rm -rf out "${BUILD_PHASES_MARKERS_DIR}"
+                elif [[ -d "${BUILD_PHASES_MARKERS_DIR}" ]]; then
+                    ls -1 "${BUILD_PHASES_MARKERS_DIR}"
+                fi
+                """).strip()],
+            env={
+                "BUILD_PHASES_MARKERS_DIR": self.BUILD_PHASES_MARKERS_DIR,
+                "resume_product_build": util.Interpolate(
+                    "%(prop:resume_product_build:#?|1|0)s"),
+            },
+        ))
+
+        def is_build_phase_to_run(recipe: str, phase: str):
+            def checker(step: BuildStep) -> bool:
+                if (not self._isStepwiseProductBuild(step) or
+                        step.build.results == FAILURE):
+                    return False
+                completed = step.getProperty("completed_build_phases") or []
+                return "{}:{}".format(recipe.replace("/", ":"),
+                                      phase) not in completed
+            return checker
+
+        built_recipes = set()
+        for recipe, action, dependencies in self.CLIPOS_RECIPES_GRAPH:
+            if not built_recipes.issuperset(dependencies):
+                raise ValueError(line(
+                    """The recipes dependency graph is not topologically
+                    sorted: {!r} is listed before one of its dependencies
+                    """.format(recipe)))
+            for phase in self.RECIPE_PHASES[action]:
+                self.addStep(clipos.steps.ToolkitEnvironmentShellCommand(
+                    name="{}: {}".format(recipe, phase.replace("_", " "))[:50],
+                    haltOnFailure=False,
+                    warnOnFailure=True,
+                    flunkOnFailure=True,
+                    doStepIf=is_build_phase_to_run(recipe, phase),
+                    hideStepIf=lambda results, step: results == SKIPPED,
+                    command=command,
+                    env={
+                        **env,
+                        "BUILD_RECIPE": recipe,
+                        "BUILD_PHASE": phase,
+                        "RECIPE_DEPENDENCIES": " ".join(dependencies),
+                    },
+                ))
+            built_recipes.add(recipe)
+
         self._identifyAndSaveProducedArtifactsOntoBuildmaster()
 
     def _identifyAndSaveProducedArtifactsOntoBuildmaster(self):
@@ -828,45 +2195,25 @@ class ClipOsToolkitEnvironmentBuildFactoryBase(ClipOsSourceTreeBuildFactoryBase)
             return checker
 
         for artifact_type in ['sdks', 'cache', 'build']:
-            self.addStep(steps.ShellCommand(
+            self.addStep(clipos.steps.ArtifactsShellCommand(
                 name="save {} artifact on buildmaster".format(artifact_type)[:50],
                 description="save the {} artifact archive on the buildmaster".format(artifact_type),
                 haltOnFailure=True,
                 doStepIf=is_artifact_save_necessary(artifact_type),
-                command=["/usr/bin/env", "bash", "-c", textwrap.dedent(
-                    r"""
-                    set -e -u -o pipefail
-                    cat <<END_OF_LFTP_SCRIPT | lftp
-                    connect ${ARTIFACTS_FTP_URL}
-                    lcd ${SOURCE_PATH_ON_WORKER}
-                    mkdir -p ${DESTINATION_PATH_IN_FTP}
-                    cd ${DESTINATION_PATH_IN_FTP}
-                    mput *
-                    END_OF_LFTP_SCRIPT
-                    """).strip()],
-                env={
-                    "ARTIFACTS_FTP_URL": self.buildmaster_setup.artifacts_ftp_url,
-                    "SOURCE_PATH_ON_WORKER": 'artifacts/{}'.format(artifact_type),
-                    "DESTINATION_PATH_IN_FTP": compute_artifact_path(
+                command=r'artifacts_push "${DESTINATION_PATH_IN_FTP}" "${SOURCE_PATH_ON_WORKER}"/*',
+                env=self._artifactsEnv(
+                    SOURCE_PATH_ON_WORKER='artifacts/{}'.format(artifact_type),
+                    DESTINATION_PATH_IN_FTP=compute_artifact_path(
                         "/", artifact_type, "buildername",
                         buildnumber_shard=True,
+                        staged=True,
                     ),
-                },
+                ),
             ))
-            self.addStep(steps.MasterShellCommand(
-                name="symlink latest {} artifacts".format(artifact_type)[:50],
-                haltOnFailure=True,
+            self._registerArtifactsOnBuildmaster(
+                artifact_type,
                 doStepIf=is_artifact_save_necessary(artifact_type),
-                command=[
-                    "ln", "-snf", util.Interpolate("%(prop:buildnumber)s"),
-                    compute_artifact_path(
-                        self.buildmaster_setup.artifacts_dir,
-                        artifact_type,
-                        "buildername",
-                        buildnumber_shard="latest",
-                    ),
-                ],
-            ))
+            )
 
 
 class ClipOsProductBuildBuildFactory(ClipOsToolkitEnvironmentBuildFactoryBase):
@@ -875,9 +2222,17 @@ class ClipOsProductBuildBuildFactory(ClipOsToolkitEnvironmentBuildFactoryBase):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
+        self.skipBuildIfSourceTreeUnchanged()
+        # Keep the workspace of a build skipped as unchanged:
         self.cleanupWorkspaceIfRequested()
+        if self.buildmaster_setup.workspace_snapshots_max_size_gib:
+            self.restoreWorkspaceSnapshotIfAny()
         self.syncSources(use_repo_quicksync_artifacts=True)
+        if self.buildmaster_setup.workspace_snapshots_max_size_gib:
+            self.saveWorkspaceSnapshot()
+        self.recordSourceTreeFingerprint()
         self.buildProduct("clipos")
+        self.uploadFileListingsOnFailure()
 
 
 # vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -13,7 +13,7 @@ import yaml
 from buildbot.plugins import util
 from buildbot.www.auth import NoAuth  # when served locally for debug purposes
 
-from .commons import line  # utility functions and stuff
+from .commons import line, memoized_property  # utility functions and stuff
 
 
 class SetupSettings(object):
@@ -149,6 +149,9 @@ class SetupSettings(object):
                 # Authentication settings for the web UI and REST API:
                 'auth': auth,
                 'authz': authz,
+
+                # Change notifications web hook (see webhook_changes_enabled):
+                **self._change_hook_settings(),
             },
 
             # Buildmaster/workers network related settings
@@ -165,7 +168,24 @@ class SetupSettings(object):
             'buildbotNetUsageData': None,
         }
 
-    @property
+    def _change_hook_settings(self) -> Dict[str, Any]:
+        """The web UI settings of the change notifications web hook (if
+        enabled)."""
+
+        if not self.webhook_changes_enabled:
+            return {}
+        settings = {
+            # The "base" dialect takes the change attributes (repository,
+            # project, branch, revision, author, etc.) as form fields:
+            'change_hook_dialects': {'base': {}},
+        }  # type: Dict[str, Any]
+        if self.secrets and self.secrets.change_hook_passwd_file:
+            settings['change_hook_auth'] = [
+                "file:{}".format(self.secrets.change_hook_passwd_file),
+            ]
+        return settings
+
+    @memoized_property
     def pb_port(self) -> int:
         """The TCP port on which the Buildbot master instance will listen using
         Twistd PB (Perspective Broker) protocol."""
@@ -175,7 +195,7 @@ class SetupSettings(object):
         else:
             return 9989
 
-    @property
+    @memoized_property
     def config_git_clone_url(self) -> str:
         """The Buildbot configuration Git repository"""
 
@@ -184,7 +204,7 @@ class SetupSettings(object):
         else:
             return "file://{}".format(os.path.dirname(os.path.realpath(__file__)))
 
-    @property
+    @memoized_property
     def config_git_revision(self) -> str:
         """The revision/Git branch to use for the Buildbot configuration Git
         repository to watch for changes."""
@@ -194,7 +214,7 @@ class SetupSettings(object):
         else:
             return "master"
 
-    @property
+    @memoized_property
     def buildbot_url(self) -> str:
         """The public URL on which Buildbot will be exposed for the Web UI."""
 
@@ -203,7 +223,7 @@ class SetupSettings(object):
         else:
             return "http://localhost:8010/"
 
-    @property
+    @memoized_property
     def www_port(self) -> int:
         """The public URL on which Buildbot will be exposed for the Web UI."""
 
@@ -212,7 +232,68 @@ class SetupSettings(object):
         else:
             return 8010
 
-    @property
+    @memoized_property
+    def metrics_port(self) -> int:
+        """The TCP port on which the build metrics are exposed in the
+        Prometheus/OpenMetrics format to be scraped locally (see
+        `clipos.metrics.MetricsService`). Setting this to 0 disables the
+        metrics endpoint."""
+
+        if self.__settings:
+            return int(self.__settings.get("BUILDBOT_METRICS_PORT", 0))
+        else:
+            return 0
+
+    @memoized_property
+    def metrics_interface(self) -> str:
+        """The interface on which the build metrics endpoint listens (the
+        loopback interface by default)."""
+
+        if self.__settings:
+            return self.__settings.get("BUILDBOT_METRICS_INTERFACE",
+                                       "127.0.0.1")
+        else:
+            return "127.0.0.1"
+
+    @memoized_property
+    def webhook_changes_enabled(self) -> bool:
+        """Whether the changes of the CLIP OS sources can be notified to the
+        buildmaster through its web hook (i.e. on the ``change_hook/base`` path
+        of the web UI, protected by the change hook password file from the
+        secrets if any).
+        This is enabled by default for local deployments so that changes can
+        be fed to the buildmaster by hand (e.g. with curl)."""
+
+        if self.__settings:
+            return bool(self.__settings.get("BUILDBOT_WEBHOOK_CHANGES", False))
+        else:
+            return True
+
+    @memoized_property
+    def changes_tree_stable_timer(self) -> int:
+        """The time (in seconds) without any new change to the CLIP OS sources
+        after which the changes received so far trigger a single build (i.e.
+        the bursts of changes, such as the merge of a topic spanning several
+        projects, are coalesced into one build)."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_CHANGES_TREE_STABLE_TIMER", 300))
+        else:
+            return 300
+
+    @memoized_property
+    def gerrit_stream_events(self) -> Optional[Dict[str, Any]]:
+        """The settings of the connection to the Gerrit server hosting the
+        CLIP OS sources to listen to its stream-events (see
+        `PrivateSettingsAddendum.gerrit_stream_events`), if any."""
+
+        if self.private_settings_addendum:
+            return self.private_settings_addendum.gerrit_stream_events
+        else:
+            return None
+
+    @memoized_property
     def db_url(self) -> str:
         """The database URL for Buildbot master instance."""
 
@@ -230,7 +311,7 @@ class SetupSettings(object):
         else:
             return "sqlite:///state.sqlite"
 
-    @property
+    @memoized_property
     def artifacts_dir(self) -> str:
         """The directory where to store the build artifacts in the Buildbot
         master instance context."""
@@ -240,17 +321,369 @@ class SetupSettings(object):
         else:
             return "artifacts"
 
-    @property
+    @memoized_property
     def artifacts_ftp_url(self) -> Optional[str]:
         """The URL pointing to the directory where are stored on an anonymous
-        FTP server the artifacts built by the Buildbot workers."""
+        FTP server the artifacts built by the Buildbot workers (only used if
+        `artifacts_http_url` is not set)."""
+
+        if self.__settings:
+            return self.__settings.get("BUILDBOT_ARTIFACTS_FTP_URL")
+        else:
+            return None
+
+    @memoized_property
+    def artifacts_http_port(self) -> int:
+        """The TCP port on which the buildmaster exposes the artifacts
+        directory to the workers over HTTP (see `clipos.artifacts`). Setting
+        this to 0 disables this service."""
+
+        if self.__settings:
+            return int(self.__settings.get("BUILDBOT_ARTIFACTS_HTTP_PORT", 0))
+        else:
+            return 0
+
+    @memoized_property
+    def artifacts_http_interface(self) -> str:
+        """The address of the interface on which the artifacts HTTP service
+        listens. As this service does not authenticate the workers, this must
+        be the interface of the network of the workers (the service only
+        listens on the loopback interface by default)."""
+
+        if self.__settings:
+            return self.__settings.get("BUILDBOT_ARTIFACTS_HTTP_INTERFACE",
+                                       "127.0.0.1")
+        else:
+            return "127.0.0.1"
+
+    @memoized_property
+    def artifacts_http_url(self) -> Optional[str]:
+        """The URL of the artifacts HTTP service of the buildmaster as reached
+        by the Buildbot workers. When set, the workers transfer the artifacts
+        through this service rather than through the anonymous FTP server (see
+        `artifacts_ftp_url`)."""
+
+        if self.__settings:
+            return self.__settings.get("BUILDBOT_ARTIFACTS_HTTP_URL") or None
+        else:
+            return None
+
+    @memoized_property
+    def artifacts_retention_builds(self) -> Dict[str, int]:
+        """The number of latest builds of each builder whose artifacts are
+        kept on the buildmaster by the artifacts janitor, i.e. a mapping of
+        the artifact types (e.g. ``build``, ``sdks`` or ``file-listings``) to
+        this number (the ``*`` key giving it for the unlisted types). The
+        builds pointed by the ``latest`` symlinks and the pinned builds (i.e.
+        with a ``PINNED`` file in their artifacts directory) are always
+        kept."""
+
+        defaults = {
+            "build": 7,
+            "file-listings": 10,
+            "*": 3,
+        }
+        if self.__settings:
+            return {
+                **defaults,
+                **{name: int(count) for name, count in self.__settings.get(
+                    "BUILDBOT_ARTIFACTS_RETENTION_BUILDS", {}).items()},
+            }
+        else:
+            return defaults
+
+    @memoized_property
+    def artifacts_recipe_results_retention_days(self) -> int:
+        """The number of days the cached results of the recipes are kept on
+        the buildmaster by the artifacts janitor."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_ARTIFACTS_RECIPE_RESULTS_RETENTION_DAYS", 14))
+        else:
+            return 14
+
+    @memoized_property
+    def artifacts_max_size_gib(self) -> int:
+        """The disk budget (in GiB) of the artifacts stored on the
+        buildmaster: beyond it, the artifacts janitor evicts the artifacts of
+        the oldest builds (except the latest and pinned ones) and the oldest
+        recipe results. Setting this to 0 disables this budget."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_ARTIFACTS_MAX_SIZE_GIB", 0))
+        else:
+            return 0
+
+    @memoized_property
+    def artifacts_compression(self) -> str:
+        """The compression to apply by default to the archive artifacts:
+        either ``none`` or ``zstd:<level>`` (e.g. ``zstd:3`` for a fast
+        compression or ``zstd:19`` for a strong one). This can be overridden
+        per build with the ``artifacts_compression`` property."""
+
+        if self.__settings:
+            return self.__settings.get("BUILDBOT_ARTIFACTS_COMPRESSION",
+                                       "zstd:3")
+        else:
+            return "zstd:3"
+
+    @memoized_property
+    def artifacts_transfer_mode(self) -> str:
+        """The way the archive artifacts are transferred by default between
+        the workers and the buildmaster: either ``file`` (the archives are
+        written on the worker volume) or ``stream`` (the archives are created
+        while being uploaded and extracted while being downloaded). This can
+        be overridden per build with the ``artifacts_transfer_mode``
+        property."""
+
+        if self.__settings:
+            return self.__settings.get("BUILDBOT_ARTIFACTS_TRANSFER_MODE",
+                                       "file")
+        else:
+            return "file"
+
+    @memoized_property
+    def artifacts_fetch_max_parallel_transfers(self) -> int:
+        """The maximum number of artifacts downloaded concurrently by the
+        workers in the steps fetching several artifacts at once."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_ARTIFACTS_FETCH_MAX_PARALLEL_TRANSFERS", 4))
+        else:
+            return 4
+
+    @memoized_property
+    def artifacts_fetch_segments_per_transfer(self) -> int:
+        """The number of chunks downloaded in parallel for each artifact by
+        the workers in the steps fetching several artifacts at once."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_ARTIFACTS_FETCH_SEGMENTS_PER_TRANSFER", 4))
+        else:
+            return 4
+
+    @memoized_property
+    def worker_artifacts_cache_max_size_gib(self) -> int:
+        """The maximum size (in GiB) of the artifacts cache kept by each kind
+        of Dockerized worker in its workspaces volumes across builds (the least
+        recently used artifacts are evicted beyond this size). This budget is
+        split evenly among the volumes of the workers of a warm pool (see
+        `docker_worker_warm_pool_sizes`). Setting this to 0 disables this
+        cache."""
 
         if self.__settings:
-            return self.__settings["BUILDBOT_ARTIFACTS_FTP_URL"]
+            return int(self.__settings.get(
+                "BUILDBOT_WORKER_ARTIFACTS_CACHE_MAX_SIZE_GIB", 100))
+        else:
+            return 100
+
+    @memoized_property
+    def steps_log_summary_interval(self) -> int:
+        """The interval (in seconds) at which the progress of the archive
+        creations and extractions and of the repo synchronizations is
+        summarized in the step logs instead of listing every file (the full
+        listings are only uploaded onto the buildmaster for the failed builds).
+        Setting this to 0 disables this filtering."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_STEPS_LOG_SUMMARY_INTERVAL", 30))
+        else:
+            return 30
+
+    @memoized_property
+    def repo_quicksync_baseline_max_age_days(self) -> int:
+        """The age (in days) from which the source tree quick-sync artifacts
+        producer builder publishes a new complete ".repo" directory archive
+        (the baseline) rather than a delta against the previous baseline."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_REPO_QUICKSYNC_BASELINE_MAX_AGE_DAYS", 7))
+        else:
+            return 7
+
+    @memoized_property
+    def product_build_max_parallel_recipes(self) -> int:
+        """The maximum number of recipes built concurrently by a product build
+        (0 means one recipe per 8 CPUs of the worker)."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_PRODUCT_BUILD_MAX_PARALLEL_RECIPES", 0))
+        else:
+            return 0
+
+    @memoized_property
+    def repo_sync_max_server_connections(self) -> int:
+        """The maximum number of concurrent connections to the Git repositories
+        server that the builds running on the same Docker host may open all
+        together when synchronizing the source tree with repo."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_REPO_SYNC_MAX_SERVER_CONNECTIONS", 16))
+        else:
+            return 16
+
+    @memoized_property
+    def git_lfs_pull_max_parallel_projects(self) -> int:
+        """The maximum number of Git LFS-backed projects for which the Git LFS
+        objects are pulled concurrently."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_GIT_LFS_PULL_MAX_PARALLEL_PROJECTS", 4))
+        else:
+            return 4
+
+    @memoized_property
+    def git_lfs_concurrent_transfers(self) -> int:
+        """The number of concurrent Git LFS objects transfers (done in batches)
+        for each Git LFS-backed project (see ``lfs.concurrenttransfers`` in
+        git-lfs-config(5))."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_GIT_LFS_CONCURRENT_TRANSFERS", 8))
+        else:
+            return 8
+
+    @memoized_property
+    def workspace_snapshots_max_size_gib(self) -> int:
+        """The disk budget (in GiB) for the snapshots of the synchronized
+        source trees kept by each kind of privileged Dockerized worker (one
+        per manifest revision) to restore the workspaces of the CLIP OS
+        builds. This budget is split evenly among the volumes of the workers
+        of a warm pool (see `docker_worker_warm_pool_sizes`). Setting this to
+        0 disables these snapshots."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_WORKSPACE_SNAPSHOTS_MAX_SIZE_GIB", 200))
+        else:
+            return 200
+
+    @memoized_property
+    def workspace_snapshots_max_age_days(self) -> int:
+        """The age (in days since their last use) from which the snapshots of
+        the synchronized source trees are evicted."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_WORKSPACE_SNAPSHOTS_MAX_AGE_DAYS", 7))
+        else:
+            return 7
+
+    @memoized_property
+    def repo_mirror_host_dir(self) -> Optional[str]:
+        """The directory on the Docker host holding a ``repo --mirror`` tree of
+        the CLIP OS source tree. If set, this mirror is maintained by the
+        repo-sync builder and bind-mounted read-only into the other Dockerized
+        workers which then use it as a reference object store (instead of
+        retrieving the ".repo" directory quick-sync artifacts)."""
+
+        if self.__settings:
+            return self.__settings.get("BUILDBOT_REPO_MIRROR_HOST_DIR") or None
         else:
             return None
 
-    @property
+    @memoized_property
+    def docker_worker_images_refresh_days(self) -> int:
+        """The age (in days) from which the Dockerized workers images are
+        rebuilt from scratch (i.e. without reusing any cached layer) rather
+        than only when their inputs change."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_DOCKER_WORKER_IMAGES_REFRESH_DAYS", 7))
+        else:
+            return 7
+
+    @memoized_property
+    def docker_host_cpus(self) -> int:
+        """The number of CPUs of the Docker host to share between the builds.
+        If the Docker daemon is reached through a local UNIX socket, these
+        are by default the CPUs of the buildmaster host. Otherwise, the CPUs
+        are not accounted unless set (see `clipos.capacity`)."""
+
+        if self.__settings and "BUILDBOT_DOCKER_HOST_CPUS" in self.__settings:
+            return int(self.__settings["BUILDBOT_DOCKER_HOST_CPUS"])
+        elif self._docker_host_is_local():
+            return os.cpu_count() or 1
+        else:
+            return 0
+
+    @memoized_property
+    def docker_host_memory_gib(self) -> float:
+        """The memory (in GiB) of the Docker host to share between the builds.
+        If the Docker daemon is reached through a local UNIX socket, this is
+        by default the memory of the buildmaster host. Otherwise, the memory
+        is not accounted unless set (see `clipos.capacity`)."""
+
+        if (self.__settings and
+                "BUILDBOT_DOCKER_HOST_MEMORY_GIB" in self.__settings):
+            return float(self.__settings["BUILDBOT_DOCKER_HOST_MEMORY_GIB"])
+        elif self._docker_host_is_local():
+            return (os.sysconf("SC_PAGE_SIZE") *
+                    os.sysconf("SC_PHYS_PAGES") / 1024**3)
+        else:
+            return 0
+
+    def _docker_host_is_local(self) -> bool:
+        """Whether the Docker daemon runs on the buildmaster host."""
+
+        return self.docker_host_uri.startswith("unix://")
+
+    @memoized_property
+    def docker_host_disk_gib(self) -> float:
+        """The disk space (in GiB) of the Docker host to share between the
+        builds (this is not accounted if set to 0, which is the default)."""
+
+        if self.__settings:
+            return float(self.__settings.get(
+                "BUILDBOT_DOCKER_HOST_DISK_GIB", 0))
+        else:
+            return 0
+
+    @memoized_property
+    def docker_worker_warm_pool_sizes(self) -> Dict[str, int]:
+        """The number of Dockerized workers to keep started and connected in
+        advance (ready to take a build) for each kind of worker, i.e. a
+        mapping of the flavor names (suffixed by ``_privileged`` for the
+        privileged workers) to the size of their warm pool. The kinds of
+        workers not listed there are only started on demand.
+
+        Each worker of a warm pool has its own workspaces volume: the disk
+        space taken by the workspaces of a kind of worker is multiplied by the
+        size of its pool (the budgets of the artifacts cache and of the
+        workspace snapshots being split among these volumes)."""
+
+        if self.__settings:
+            return {
+                name: int(size) for name, size in self.__settings.get(
+                    "BUILDBOT_DOCKER_WORKER_WARM_POOL_SIZES", {}).items()
+            }
+        else:
+            return {}
+
+    @memoized_property
+    def docker_worker_warm_pool_idle_timeout(self) -> int:
+        """The time (in seconds) after which an idle warm pool worker is
+        replaced by a fresh one. Setting this to 0 keeps the idle warm pool
+        workers forever."""
+
+        if self.__settings:
+            return int(self.__settings.get(
+                "BUILDBOT_DOCKER_WORKER_WARM_POOL_IDLE_TIMEOUT", 3600))
+        else:
+            return 3600
+
+    @memoized_property
     def docker_host_uri(self) -> str:
         """The URL to the host Docker daemon socket"""
 
@@ -263,22 +696,23 @@ class SetupSettings(object):
             # network. Classical UNIX socket for the Docker daemon is assumed.
             return "unix:///var/run/docker.sock"
 
-    @property
-    def buildmaster_host_for_dockerized_workers(self) -> str:
+    @memoized_property
+    def buildmaster_host_for_dockerized_workers(self) -> Optional[str]:
         """The hostname/IP address to advertise to workers upon creation to
         join the Buildmaster. This setting is handy when dealing with private
-        IPs (e.g. when exposed via a IPsec tunnel)."""
+        IPs (e.g. when exposed via a IPsec tunnel).
+
+        If not set, the fully qualified domain name of the buildmaster host is
+        advertised instead, but it is only resolved when the first worker
+        container gets started (see `clipos.workers.DockerLatentWorker`) rather
+        than upon configuration loading as this may block on DNS."""
 
         try:
             return self.__settings["BUILDBOT_MASTER_HOST_FOR_DOCKERIZED_WORKERS"]
         except (KeyError, TypeError):
-            # Fallback to what Buildbot would have computed if this setting was
-            # not set...  See documentation for `masterFQDN` parameter of class
-            # `DockerLatentWorker` in Buildbot for details:
-            import socket
-            return socket.getfqdn()
+            return None
 
-    @property
+    @memoized_property
     def docker_worker_containers_network_mode(self) -> str:
         """The networking mode to use for the Docker containers that will be
         created by this master Buildbot instance as DockerLatentWorker."""
@@ -289,7 +723,7 @@ class SetupSettings(object):
         else:
             return ""   # TODO: should we use "host" in that case?
 
-    @property
+    @memoized_property
     def clipos_manifest_git_url(self) -> str:
         """The URL to the CLIP OS project manifest Git repository URL. This is
         provided by the private assets and defaults to the public one on GitHub
@@ -302,7 +736,7 @@ class SetupSettings(object):
             # defaults to the public repository
             return "https://review.clip-os.org/clipos/manifest"
 
-    @property
+    @memoized_property
     def _private_settings_addendum_dir(self) -> Optional[str]:
         """The path to the private settings addendum directory (if this path is
         specified as relative, it will be computed from the Buildbot master
@@ -311,7 +745,7 @@ class SetupSettings(object):
         if self.__settings:
             return self.__settings.get("BUILDBOT_PRIVATE_SETTINGS_ADDENDUM_DIR")
 
-    @property
+    @memoized_property
     def _private_settings_addendum_yamlfile(self) -> Optional[str]:
         """The path to the private settings addendum YAML file describing
         additional settings (if this path is specified as relative, it will be
@@ -320,7 +754,7 @@ class SetupSettings(object):
         if self.__settings:
             return self.__settings.get("BUILDBOT_PRIVATE_SETTINGS_ADDENDUM_YAMLFILE")
 
-    @property
+    @memoized_property
     def _secrets_dir(self) -> Optional[str]:
         """The path to the secrets directory (if this path is specified as
         relative, it will be computed from the Buildbot master configuration
@@ -329,7 +763,7 @@ class SetupSettings(object):
         if self.__settings:
             return self.__settings.get("BUILDBOT_SECRETS_DIR")
 
-    @property
+    @memoized_property
     def _secrets_yamlfile(self) -> Optional[str]:
         """The path to the secrets YAML file (if this path is specified as
         relative, it will be computed from the Buildbot master configuration
@@ -356,7 +790,7 @@ class PrivateSettingsAddendum(object):
         with open(os.path.join(self.directory, yamlfile), 'r') as fp:
             self.__settings = yaml.safe_load(fp)
 
-    @property
+    @memoized_property
     def clipos_manifest_git_url(self) -> Optional[str]:
         """The URL to the CLIP OS project manifest Git repository URL. This is
         provided by the private assets and defaults to the public one on GitHub
@@ -364,7 +798,7 @@ class PrivateSettingsAddendum(object):
 
         return self.__settings.get("clipos_manifest_git_url")
 
-    @property
+    @memoized_property
     def alternative_git_lfs_endpoint_url_template(self) -> Optional[string.Template]:
         """The potentially-provided alternative Git LFS endpoint URL template
         string to use in place of the Git LFS endpoint advertised by the
@@ -381,7 +815,7 @@ class PrivateSettingsAddendum(object):
             # Normalize this into a string.Template
             return string.Template(template_string)
 
-    @property
+    @memoized_property
     def additional_git_https_cacerts(self) -> Dict[str, str]:
         """Potential additional CA Certificates for HTTPS Git remotes. This is
         provided by the private assets."""
@@ -396,6 +830,30 @@ class PrivateSettingsAddendum(object):
         }
         return cacerts_dict
 
+    @memoized_property
+    def gerrit_stream_events(self) -> Optional[Dict[str, Any]]:
+        """The settings of the connection to the Gerrit server whose
+        stream-events notify the changes of the CLIP OS sources: a mapping
+        with the ``server``, ``port`` (29418 by default) and ``username`` keys
+        along with an optional ``identity_file`` (the SSH private key,
+        relative to the private settings addendum dir). This is provided by
+        the private assets and defaults to `None` (i.e. no Gerrit change
+        source)."""
+
+        gerrit = self.__settings.get("gerrit_stream_events")
+        if not gerrit:
+            return None
+        settings = {
+            "server": gerrit["server"],
+            "port": int(gerrit.get("port", 29418)),
+            "username": gerrit["username"],
+            "identity_file": None,
+        }  # type: Dict[str, Any]
+        if gerrit.get("identity_file"):
+            settings["identity_file"] = os.path.join(
+                self.directory, str(gerrit["identity_file"]).lstrip('/'))
+        return settings
+
 class Secrets(object):
     """Class for the secrets handled by the Buildbot master instance
 
@@ -412,23 +870,34 @@ class Secrets(object):
         with open(os.path.join(self.directory, yamlfile), 'r') as fp:
             self.__settings = yaml.safe_load(fp)
 
-    @property
+    @memoized_property
     def auth_backend(self) -> str:
         """The backend to use for authentication."""
 
         return self.__settings['auth']['backend']
 
-    @property
+    @memoized_property
     def auth_backend_parameters(self) -> Any:
         """The parameters for the chosen authentication backend."""
 
         return self.__settings['auth']['parameters'][self.auth_backend]
 
-    @property
+    @memoized_property
     def admin_usernames(self) -> Any:
         """The administrator usernames list"""
 
         return self.__settings['admins']
 
+    @memoized_property
+    def change_hook_passwd_file(self) -> Optional[str]:
+        """The path to the file (relative to the secrets dir) of the
+        ``username:password`` lines giving the credentials required to notify
+        changes through the buildmaster web hook, if any."""
+
+        passwd_file = self.__settings.get('change_hook_passwd_file')
+        if passwd_file:
+            return os.path.join(self.directory, str(passwd_file).lstrip('/'))
+        return None
+
 
 # vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -0,0 +1,148 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Resource capacity model of the Docker host on which the builds run in order
+to admit a build only when the Docker host has room for it."""
+
+import time
+
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Tuple
+
+from buildbot.process.build import Build
+from twisted.internet import reactor
+from twisted.python import log
+
+
+class BuildCost(NamedTuple):
+    """The estimated resources required by a build (these are peak values)"""
+
+    cpus: float
+    memory_gib: float
+    disk_gib: float
+
+
+class DockerHostCapacity(object):
+    """Account the resources of a Docker host used by the builds of the
+    builders registered against it (see `admission`) in order to admit a new
+    build only if the Docker host can sustain it along with the builds already
+    running. A postponed build is retried periodically as the builds of the
+    other builders may free the resources it requires.
+
+    :param cpus: the number of CPUs of the Docker host
+    :param memory_gib: the memory (in GiB) of the Docker host
+    :param disk_gib: the disk space (in GiB) available to the builds on the
+        Docker host
+
+    A resource set to 0 is not accounted.
+
+    """
+
+    # The time (in seconds) during which a build admitted but not started yet
+    # (i.e. whose build request is still being claimed) is still accounted.
+    # Once started (even while its latent worker is being substantiated), the
+    # build is accounted as running until it ends, whether it fails to start
+    # or not:
+    ADMISSION_GRACE_PERIOD = 60
+
+    # The delay (in seconds) after which the postponed builds are retried:
+    ADMISSION_RETRY_DELAY = 60
+
+    def __init__(self, cpus: float, memory_gib: float,
+                 disk_gib: float = 0) -> None:
+        self.capacity = BuildCost(cpus=cpus, memory_gib=memory_gib,
+                                  disk_gib=disk_gib)
+        self.costs = {}  # type: Dict[str, BuildCost]
+
+        # The builds admitted but not running yet (build request ID -> the
+        # builder name and the admission time):
+        self._admitted = {}  # type: Dict[int, Tuple[str, float]]
+
+        # The pending retries of the postponed builds (by builder name):
+        self._retries = {}  # type: Dict[str, Any]
+
+    def admission(self, builder_name: str,
+                  cost: BuildCost) -> Callable[..., bool]:
+        """Register the estimated cost of the builds of the given builder and
+        return the function to use as ``canStartBuild`` in its
+        configuration."""
+
+        self.costs[builder_name] = cost
+
+        def canStartBuild(builder: Any, wfb: Any, request: Any) -> bool:
+            return self.admit(builder, request)
+
+        return canStartBuild
+
+    def admit(self, builder: Any, request: Any) -> bool:
+        """Returns whether a build of the given builder for the given build
+        request can be started now (and account it if this is the case)."""
+
+        # The builds of a builder are started one after another: the previous
+        # build admitted for this builder is either running or has not been
+        # started at all by now.
+        for request_id, (builder_name, _) in list(self._admitted.items()):
+            if builder_name == builder.name:
+                del self._admitted[request_id]
+
+        cost = self.costs[builder.name]
+        used = self.used(builder.master)
+        if any(used):
+            available = [
+                limit - in_use
+                for limit, in_use in zip(self.capacity, used)
+            ]
+            for resource, required, left in zip(BuildCost._fields, cost,
+                                                available):
+                limit = getattr(self.capacity, resource)
+                if limit and required > left:
+                    log.msg("Build of {} postponed: {} {} required but only "
+                            "{} available on the Docker host".format(
+                                builder.name, required, resource, left))
+                    self._retryLater(builder)
+                    return False
+        # Otherwise the Docker host is idle: admit the build even if its cost
+        # exceeds the capacity of the Docker host (it would never run
+        # otherwise).
+
+        self._admitted[request.id] = (builder.name, time.monotonic())
+        return True
+
+    def used(self, master: Any) -> BuildCost:
+        """Returns the resources used by the builds running (or admitted) on
+        the Docker host."""
+
+        used = [0.0] * len(BuildCost._fields)
+        started_requests = set()
+        for build in self._running_builds(master):
+            started_requests.update(req.id for req in build.requests)
+            for index, value in enumerate(self.costs[build.builder.name]):
+                used[index] += value
+
+        now = time.monotonic()
+        for request_id, (builder_name, admitted_at) in list(
+                self._admitted.items()):
+            if (request_id in started_requests or
+                    now - admitted_at > self.ADMISSION_GRACE_PERIOD):
+                del self._admitted[request_id]
+                continue
+            for index, value in enumerate(self.costs[builder_name]):
+                used[index] += value
+
+        return BuildCost(*used)
+
+    def _retryLater(self, builder: Any) -> None:
+        """Make the botmaster reconsider the build requests of the given
+        builder after a delay (unless this is already planned)."""
+
+        retry = self._retries.get(builder.name)
+        if retry is None or not retry.active():
+            self._retries[builder.name] = reactor.callLater(
+                self.ADMISSION_RETRY_DELAY,
+                builder.botmaster.maybeStartBuildsForBuilder, builder.name)
+
+    def _running_builds(self, master: Any) -> Iterator[Build]:
+        for builder in master.botmaster.builders.values():
+            if builder.name in self.costs:
+                yield from builder.building
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
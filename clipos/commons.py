@@ -4,8 +4,11 @@
 """Miscellanous utility functions and helpers that may be used globally in this
 code base."""
 
+import os
 import textwrap
 
+from typing import Any, Callable, Dict, Tuple
+
 
 def rewrap(msg: str) -> str:
     """Rewrap a message by stripping the unneeded indentation and removing
@@ -29,4 +32,41 @@ def line(msg: str) -> str:
     return ' '.join([line.strip() for line in msg.split("\n")
                                   if len(line.strip())])
 
+
+class memoized_property(object):
+    """Decorator turning a method into a property computed only once per
+    instance (upon its first access), its value being then stored in the
+    instance dictionary. This is akin to ``functools.cached_property`` from
+    Python 3.8."""
+
+    def __init__(self, method: Callable[[Any], Any]) -> None:
+        self.method = method
+        self.name = method.__name__
+        self.__doc__ = method.__doc__
+
+    def __get__(self, instance: Any, owner: Any = None) -> Any:
+        if instance is None:
+            return self
+        value = self.method(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
+# The contents of the files read by read_text_file (by path) along with their
+# modification time:
+_text_files_cache = {}  # type: Dict[str, Tuple[int, str]]
+
+
+def read_text_file(path: str) -> str:
+    """Returns the contents of the given text file. The file is only read again
+    if it has been modified since the last call (this spares reading again the
+    scripts embedded in the build steps upon each configuration reload)."""
+
+    mtime = os.stat(path).st_mtime_ns
+    cached = _text_files_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r") as fp:
+            cached = _text_files_cache[path] = (mtime, fp.read())
+    return cached[1]
+
 # vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
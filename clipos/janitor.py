@@ -0,0 +1,444 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Garbage collection of the artifacts directory of the buildmaster.
+
+The artifacts directory is laid out as described in the "scripts/artifacts.sh"
+file: the build directories (``<type>/<buildername>/<buildnumber>``) only hold
+a manifest and hard links to the blobs stored once in the ``objects``
+directory, the results of the recipes are stored under ``recipe-results``
+(keyed by the fingerprint of their inputs) and the file listings of the failed
+builds under ``file-listings``.
+
+The collection applies the following policies:
+
+* the latest builds of each builder are kept for each artifact type (see
+  `SetupSettings.artifacts_retention_builds`) along with the build pointed by
+  the "latest" symlink and the builds pinned by a ``PINNED`` file in their
+  directory,
+* the recipe results are kept for a given number of days,
+* the staging directories and the blobs left over by interrupted uploads are
+  removed after a grace period,
+* the blobs no longer referenced by any manifest are removed,
+* if the artifacts still exceed the disk budget, the oldest builds and recipe
+  results (except the latest and pinned builds) are evicted until the budget
+  is met.
+
+Everything to remove is determined first and then removed in bulk. This module
+is run as a script by the artifacts janitor builder (see
+`ArtifactsJanitorConfigurator`) in a process of its own with the lowest CPU
+and I/O priorities, which does not block the buildmaster.
+
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import sys
+import time
+
+from typing import Any, Counter, Dict, Iterator, List, Optional, Set
+
+from buildbot.configurators import ConfiguratorBase
+from buildbot.plugins import schedulers, steps, util, worker
+
+
+# The subdirectories of the artifacts directory that are not artifact types:
+OBJECTS_SUBDIRECTORY = "objects"
+RECIPE_RESULTS_SUBDIRECTORY = "recipe-results"
+
+# The names used in the artifacts directory (see the factories and the
+# "scripts/artifacts.sh" file):
+MANIFEST_FILENAME = "MANIFEST.sha256"
+STAGING_SUBDIRECTORY = ".staging"
+LATEST_SYMLINK = "latest"
+
+# The file marking a build directory as pinned (i.e. never collected):
+PIN_FILENAME = "PINNED"
+
+
+def disk_usage(path: str) -> int:
+    """Returns the bytes of the file or of the files of the directory given
+    as argument."""
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        return sum(os.lstat(os.path.join(root, name)).st_size
+                   for root, _, files in os.walk(path) for name in files)
+    return os.lstat(path).st_size
+
+
+def human_size(count: float) -> str:
+    """Returns the given count of bytes in a human readable form."""
+
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if count < 1024:
+            return "{:.1f} {}".format(count, unit)
+        count /= 1024
+    return "{:.1f} TiB".format(count)
+
+
+class ArtifactsEntry(object):
+    """A directory of the artifacts directory holding a manifest (a build
+    directory, a staging directory or recipe results) or file listings."""
+
+    def __init__(self, path: str, kind: str, protected: bool = False) -> None:
+        self.path = path
+        self.kind = kind
+        self.protected = protected
+        self.mtime = os.lstat(path).st_mtime
+        self.digests = set()  # type: Set[str]
+        # The bytes of the files only held by this directory (i.e. not links
+        # to blobs):
+        self.own_bytes = 0
+
+        manifest = os.path.join(path, MANIFEST_FILENAME)
+        if os.path.isfile(manifest):
+            with open(manifest, "r") as fp:
+                for manifest_line in fp:
+                    fields = manifest_line.split()
+                    if fields:
+                        self.digests.add(fields[0])
+        for root, _, files in os.walk(path):
+            for name in files:
+                stat = os.lstat(os.path.join(root, name))
+                if stat.st_nlink == 1:
+                    self.own_bytes += stat.st_size
+
+    def __repr__(self) -> str:
+        return "<{} {}>".format(self.kind, self.path)
+
+
+class ArtifactsCollector(object):
+    """Garbage collector of the artifacts directory (see the module
+    documentation for the policies it applies).
+
+    :param artifacts_dir: the artifacts directory
+    :param retention_builds: the number of latest builds to keep per builder
+        for each artifact type (the "*" key giving the default)
+    :param recipe_results_max_age_days: the age (in days) from which the
+        recipe results are removed
+    :param max_size_bytes: the disk budget of the artifacts (0 for none)
+    :param grace_period: the age (in seconds) from which the staging
+        directories and the blobs left over by interrupted uploads are removed
+
+    """
+
+    def __init__(self, artifacts_dir: str, retention_builds: Dict[str, int],
+                 recipe_results_max_age_days: float, max_size_bytes: int,
+                 grace_period: float = 86400) -> None:
+        self.artifacts_dir = artifacts_dir
+        self.retention_builds = retention_builds
+        self.recipe_results_max_age_days = recipe_results_max_age_days
+        self.max_size_bytes = max_size_bytes
+        self.grace_period = grace_period
+        self.now = time.time()
+
+    def _retention(self, artifact_type: str) -> int:
+        return max(1, self.retention_builds.get(
+            artifact_type, self.retention_builds.get("*", 3)))
+
+    def _isStale(self, path: str) -> bool:
+        return self.now - os.lstat(path).st_mtime > self.grace_period
+
+    def _scanBuilds(self, kept: List[ArtifactsEntry],
+                    victims: List[ArtifactsEntry]) -> None:
+        for artifact_type in sorted(os.listdir(self.artifacts_dir)):
+            type_dir = os.path.join(self.artifacts_dir, artifact_type)
+            if (artifact_type in (OBJECTS_SUBDIRECTORY,
+                                  RECIPE_RESULTS_SUBDIRECTORY) or
+                    not os.path.isdir(type_dir) or
+                    os.path.islink(type_dir)):
+                continue
+            retention = self._retention(artifact_type)
+            for builder in sorted(os.listdir(type_dir)):
+                builder_dir = os.path.join(type_dir, builder)
+                if os.path.islink(builder_dir) or not os.path.isdir(builder_dir):
+                    continue
+                latest = None
+                if os.path.islink(os.path.join(builder_dir, LATEST_SYMLINK)):
+                    latest = os.readlink(
+                        os.path.join(builder_dir, LATEST_SYMLINK)).rstrip("/")
+
+                builds = sorted(
+                    (name for name in os.listdir(builder_dir)
+                     if name.isdigit() and
+                     os.path.isdir(os.path.join(builder_dir, name))),
+                    key=int, reverse=True)
+                for index, number in enumerate(builds):
+                    build_dir = os.path.join(builder_dir, number)
+                    entry = ArtifactsEntry(
+                        build_dir, artifact_type,
+                        protected=(number == latest or os.path.exists(
+                            os.path.join(build_dir, PIN_FILENAME))))
+                    if index < retention or entry.protected:
+                        kept.append(entry)
+                    else:
+                        victims.append(entry)
+
+                # The builds staged but never published (e.g. because their
+                # publication failed):
+                staging_dir = os.path.join(builder_dir, STAGING_SUBDIRECTORY)
+                if os.path.isdir(staging_dir):
+                    for name in os.listdir(staging_dir):
+                        entry = ArtifactsEntry(
+                            os.path.join(staging_dir, name), "staging")
+                        if self._isStale(entry.path):
+                            victims.append(entry)
+                        else:
+                            kept.append(entry)
+
+    def _scanRecipeResults(self, kept: List[ArtifactsEntry],
+                           victims: List[ArtifactsEntry]) -> None:
+        results_dir = os.path.join(self.artifacts_dir,
+                                   RECIPE_RESULTS_SUBDIRECTORY)
+        if not os.path.isdir(results_dir):
+            return
+        max_age = self.recipe_results_max_age_days * 86400
+        for fingerprint in os.listdir(results_dir):
+            entry = ArtifactsEntry(os.path.join(results_dir, fingerprint),
+                                   RECIPE_RESULTS_SUBDIRECTORY)
+            if self.now - entry.mtime > max_age:
+                victims.append(entry)
+            else:
+                kept.append(entry)
+
+    def _blobs(self) -> Iterator[os.DirEntry]:
+        objects_dir = os.path.join(self.artifacts_dir, OBJECTS_SUBDIRECTORY)
+        if not os.path.isdir(objects_dir):
+            return
+        for shard in os.scandir(objects_dir):
+            # The streamed uploads are handled as upload leftovers:
+            if (shard.name != STAGING_SUBDIRECTORY and
+                    shard.is_dir(follow_symlinks=False)):
+                yield from (blob for blob in os.scandir(shard.path)
+                            if blob.is_file(follow_symlinks=False))
+
+    def collect(self, dry_run: bool = False) -> Dict[str, Any]:
+        """Collect the garbage of the artifacts directory and returns the
+        report of the collection."""
+
+        kept = []  # type: List[ArtifactsEntry]
+        victims = []  # type: List[ArtifactsEntry]
+        self._scanBuilds(kept, victims)
+        self._scanRecipeResults(kept, victims)
+
+        references = collections.Counter()  # type: Counter[str]
+        for entry in kept:
+            references.update(entry.digests)
+
+        # The blobs (by digest) along with their size and whether they are
+        # left over by an interrupted upload:
+        blobs = {}  # type: Dict[str, Any]
+        leftovers = []  # type: List[str]
+        for blob in self._blobs():
+            if blob.name.endswith(".part"):
+                if self._isStale(blob.path):
+                    leftovers.append(blob.path)
+                continue
+            stat = blob.stat(follow_symlinks=False)
+            blobs[blob.name] = (blob.path, stat.st_size, stat.st_mtime)
+        staging_dir = os.path.join(self.artifacts_dir, OBJECTS_SUBDIRECTORY,
+                                   STAGING_SUBDIRECTORY)
+        if os.path.isdir(staging_dir):
+            leftovers.extend(entry.path for entry in os.scandir(staging_dir)
+                             if self._isStale(entry.path))
+
+        # The blobs not referenced anymore (the fresh ones may belong to a
+        # build being published):
+        freed = set(digest for digest, (_, _, mtime) in blobs.items()
+                    if not references[digest] and
+                    self.now - mtime > self.grace_period)
+
+        total = (sum(size for digest, (_, size, _) in blobs.items()
+                     if digest not in freed) +
+                 sum(entry.own_bytes for entry in kept))
+
+        # Enforce the disk budget by evicting the oldest entries:
+        evicted = []  # type: List[ArtifactsEntry]
+        if self.max_size_bytes:
+            candidates = sorted((entry for entry in kept
+                                 if not entry.protected and
+                                 entry.kind != "staging"),
+                                key=lambda entry: entry.mtime)
+            for entry in candidates:
+                if total <= self.max_size_bytes:
+                    break
+                evicted.append(entry)
+                total -= entry.own_bytes
+                for digest in entry.digests:
+                    references[digest] -= 1
+                    if (not references[digest] and digest in blobs and
+                            digest not in freed):
+                        freed.add(digest)
+                        total -= blobs[digest][1]
+        over_budget = bool(self.max_size_bytes and
+                           total > self.max_size_bytes)
+
+        removed = victims + evicted
+        reclaimed = (sum(entry.own_bytes for entry in removed) +
+                     sum(blobs[digest][1] for digest in freed) +
+                     sum(disk_usage(path) for path in leftovers))
+
+        for entry in victims:
+            print("Removing {} (beyond retention)".format(entry.path))
+        for entry in evicted:
+            print("Removing {} (over the disk budget)".format(entry.path))
+        print("Removing {} unreferenced blob(s) and {} upload leftover(s)"
+              .format(len(freed), len(leftovers)))
+        if not dry_run:
+            for path in [entry.path for entry in removed] + leftovers:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.unlink(path)
+            for digest in freed:
+                os.unlink(blobs[digest][0])
+
+        return {
+            "dry_run": dry_run,
+            "removed_directories": len(removed),
+            "removed_blobs": len(freed),
+            "removed_leftovers": len(leftovers),
+            "reclaimed_bytes": reclaimed,
+            "remaining_bytes": total,
+            "max_size_bytes": self.max_size_bytes,
+            "over_budget": over_budget,
+        }
+
+
+class ArtifactsJanitorConfigurator(ConfiguratorBase):
+    """Configurator adding the builder collecting periodically the garbage of
+    the artifacts directory of the buildmaster (see `ArtifactsCollector`)
+    along with its local worker, its nightly scheduler and a force scheduler
+    (to run it on demand, possibly as a dry run).
+
+    :param buildmaster_setup: the buildmaster setup settings giving the
+        artifacts directory and its retention policies
+    :param nightly_kwargs: the time specification of the nightly scheduler
+        (see the Buildbot ``Nightly`` scheduler)
+
+    """
+
+    NAME = "artifacts-janitor"
+
+    def __init__(self, buildmaster_setup: Any, **nightly_kwargs: Any) -> None:
+        super().__init__()
+        self.buildmaster_setup = buildmaster_setup
+        self.nightly_kwargs = nightly_kwargs
+
+    def configure(self, config_dict: Dict[str, Any]) -> None:
+        super().configure(config_dict)
+        setup = self.buildmaster_setup
+
+        janitor_worker = worker.LocalWorker(self.NAME + "-localworker")
+        config_dict.setdefault('workers', []).append(janitor_worker)
+        config_dict.setdefault('protocols', {}).setdefault('null', {})
+
+        config_dict.setdefault('builders', []).append(util.BuilderConfig(
+            name=self.NAME,
+            description="Collect the garbage of the artifacts directory",
+            tags=['janitor'],
+            workernames=[janitor_worker.name],
+            factory=util.BuildFactory([
+                steps.MasterShellCommand(
+                    name="collect artifacts garbage",
+                    description="collect the garbage of the artifacts",
+                    command=[
+                        # Run with the lowest CPU and I/O priorities:
+                        "/usr/bin/env", "bash", "-c", (
+                            'flags=(); '
+                            'if [[ "${dry_run}" -ne 0 ]]; then '
+                            'flags+=(--dry-run); fi; '
+                            'if command -v ionice > /dev/null; then '
+                            'exec ionice -c 3 nice -n 19 "$@" "${flags[@]}"; '
+                            'else exec nice -n 19 "$@" "${flags[@]}"; fi'),
+                        "artifacts-janitor",
+                        sys.executable, os.path.realpath(__file__),
+                        setup.artifacts_dir,
+                        "--retention-builds",
+                        json.dumps(setup.artifacts_retention_builds),
+                        "--recipe-results-max-age-days",
+                        str(setup.artifacts_recipe_results_retention_days),
+                        "--max-size-gib", str(setup.artifacts_max_size_gib),
+                    ],
+                    env={
+                        "dry_run": util.Interpolate(
+                            "%(prop:dry_run:#?|1|0)s"),
+                    },
+                ),
+            ]),
+        ))
+
+        config_dict.setdefault('schedulers', []).extend([
+            schedulers.Nightly(
+                name=self.NAME,
+                builderNames=[self.NAME],
+                **self.nightly_kwargs,
+            ),
+            schedulers.ForceScheduler(
+                name=self.NAME + "-force",
+                buttonName="Collect the garbage of the artifacts now",
+                builderNames=[self.NAME],
+                codebases=[util.CodebaseParameter(
+                    "",
+                    branch=util.FixedParameter(name="branch", default=""),
+                    revision=util.FixedParameter(name="revision", default=""),
+                    repository=util.FixedParameter(name="repository",
+                                                   default=""),
+                    project=util.FixedParameter(name="project", default=""),
+                )],
+                properties=[
+                    util.BooleanParameter(
+                        name="dry_run",
+                        label="Only report what would be removed",
+                        default=False,
+                    ),
+                ],
+            ),
+        ])
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0])
+    parser.add_argument("artifacts_dir", help="the artifacts directory")
+    parser.add_argument("--retention-builds", default="{}",
+                        help="JSON mapping of the artifact types to the "
+                             "number of builds to keep per builder")
+    parser.add_argument("--recipe-results-max-age-days", type=float,
+                        default=14)
+    parser.add_argument("--max-size-gib", type=float, default=0,
+                        help="disk budget of the artifacts (0 for none)")
+    parser.add_argument("--grace-period", type=float, default=86400,
+                        help="age (in seconds) of the upload leftovers to "
+                             "remove")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report what would be removed")
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    report = ArtifactsCollector(
+        args.artifacts_dir,
+        retention_builds=json.loads(args.retention_builds),
+        recipe_results_max_age_days=args.recipe_results_max_age_days,
+        max_size_bytes=int(args.max_size_gib * 1024**3),
+        grace_period=args.grace_period,
+    ).collect(dry_run=args.dry_run)
+
+    print("{} {} in {:.0f} seconds, {} of artifacts left{}.".format(
+        "Would reclaim" if args.dry_run else "Reclaimed",
+        human_size(report["reclaimed_bytes"]), time.monotonic() - start,
+        human_size(report["remaining_bytes"]),
+        " (over the disk budget of {})".format(
+            human_size(report["max_size_bytes"]))
+        if report["over_budget"] else ""))
+    print("artifacts-janitor: {}".format(json.dumps(report, sort_keys=True)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -0,0 +1,269 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Buildmaster service exposing the metrics of the builds (step durations,
+artifacts transfers, build queues and latent workers start latency) in the
+Prometheus/OpenMetrics text format for capacity tuning purposes."""
+
+import datetime
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from buildbot import config
+from buildbot.data import resultspec
+from buildbot.process.results import SKIPPED
+from buildbot.util import service
+from twisted.internet import defer, reactor, task
+from twisted.python import log
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+try:
+    import prometheus_client
+    import prometheus_client.twisted
+except ImportError:  # checked upon configuration (see MetricsService)
+    prometheus_client = None
+
+from .steps import ArtifactsShellCommand
+
+
+# The buckets (in seconds) of the durations histograms: the steps range from a
+# few seconds to several hours (e.g. the build of the core recipe):
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600,
+                    7200, 14400, float("inf"))
+
+
+def _timestamp(value: Any) -> Optional[float]:
+    """Returns the given data API date (either a datetime or an epoch) as an
+    epoch (or None if not set)."""
+
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return value
+
+
+class MetricsService(service.BuildbotService):
+    """Buildmaster service exporting (on ``http://<interface>:<port>/metrics``)
+    the following metrics, labelled by builder and worker flavor:
+
+    * the durations of the build steps (the synchronization of the sources,
+      the transfers and extractions of the artifacts, the setup of the
+      toolkit, the phases of the recipes, etc.),
+    * the bytes of artifacts transferred per artifact type (as accounted by
+      `clipos.steps.ArtifactsShellCommand`),
+    * the number of build requests waiting per builder and their waiting time,
+    * the start latency of the latent workers (i.e. the duration of the
+      preparation of the worker for a build).
+
+    This requires the ``prometheus_client`` Python package.
+
+    :param port: the TCP port to listen to
+    :param interface: the interface to listen on (only locally by default)
+
+    """
+
+    name = "clipos-metrics"
+
+    # The pseudo step of the builds accounting the start of the worker:
+    WORKER_PREPARATION_STEP = "worker_preparation"
+
+    # The interval (in seconds) at which the build queues are polled:
+    QUEUES_POLL_INTERVAL = 15
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self.port = None  # type: Optional[int]
+        self.interface = None  # type: Optional[str]
+        self._listening_port = None  # type: Any
+        self._consumers = []  # type: List[Any]
+        self._queues_polling = None  # type: Optional[task.LoopingCall]
+
+        # The builder name and worker flavor of the builds (by build ID) and
+        # the names of the builders and the flavors of the workers (by ID):
+        self._builds = {}  # type: Dict[int, Tuple[str, str]]
+        self._builders = {}  # type: Dict[int, str]
+        self._flavors = {}  # type: Dict[int, str]
+        super().__init__(*args, **kwargs)
+
+        if prometheus_client is None:
+            return  # see checkConfig
+        self.registry = prometheus_client.CollectorRegistry()
+        self.step_duration = prometheus_client.Histogram(
+            "clipos_build_step_duration_seconds",
+            "Duration of the build steps",
+            ["builder", "flavor", "step"],
+            buckets=DURATION_BUCKETS, registry=self.registry)
+        self.worker_start_latency = prometheus_client.Histogram(
+            "clipos_worker_start_latency_seconds",
+            "Duration of the preparation (e.g. start) of the workers",
+            ["builder", "flavor"],
+            buckets=DURATION_BUCKETS, registry=self.registry)
+        self.artifacts_transferred = prometheus_client.Counter(
+            "clipos_artifacts_transferred_bytes",
+            "Bytes of artifacts transferred between workers and buildmaster",
+            ["builder", "flavor", "direction", "artifact_type"],
+            registry=self.registry)
+        self.queue_depth = prometheus_client.Gauge(
+            "clipos_build_requests_waiting",
+            "Number of build requests waiting to be started",
+            ["builder"], registry=self.registry)
+        self.queue_wait = prometheus_client.Histogram(
+            "clipos_build_request_wait_seconds",
+            "Time between the submission of build requests and the start of "
+            "their build",
+            ["builder"], buckets=DURATION_BUCKETS, registry=self.registry)
+
+    def checkConfig(self, port: int, interface: str = "127.0.0.1") -> None:
+        if prometheus_client is None:
+            config.error("the prometheus_client Python package is required "
+                         "to expose the buildmaster metrics")
+
+    @defer.inlineCallbacks
+    def reconfigService(self, port: int,
+                        interface: str = "127.0.0.1") -> Any:
+        if self.running and (port, interface) != (self.port, self.interface):
+            yield self._stopListening()
+        self.port = port
+        self.interface = interface
+        if self.running and self._listening_port is None:
+            self._startListening()
+
+    @defer.inlineCallbacks
+    def startService(self) -> Any:
+        yield super().startService()
+        for routing_key, callback in [
+                (("builds", None, "new"), self._onBuildStarted),
+                (("builds", None, "finished"), self._onBuildFinished),
+                (("steps", None, "finished"), self._onStepFinished),
+        ]:
+            consumer = yield self.master.mq.startConsuming(
+                self._safely(callback), routing_key)
+            self._consumers.append(consumer)
+        self._queues_polling = task.LoopingCall(self._pollBuildQueues)
+        self._queues_polling.start(self.QUEUES_POLL_INTERVAL, now=True)
+        self._startListening()
+
+    @defer.inlineCallbacks
+    def stopService(self) -> Any:
+        for consumer in self._consumers:
+            consumer.stopConsuming()
+        self._consumers = []
+        if self._queues_polling and self._queues_polling.running:
+            self._queues_polling.stop()
+        yield self._stopListening()
+        yield super().stopService()
+
+    def _startListening(self) -> None:
+        root = Resource()
+        root.putChild(b"metrics",
+                      prometheus_client.twisted.MetricsResource(
+                          registry=self.registry))
+        self._listening_port = reactor.listenTCP(
+            self.port, Site(root), interface=self.interface)
+        log.msg("Exposing the buildmaster metrics on http://{}:{}/metrics"
+                .format(self.interface, self.port))
+
+    @defer.inlineCallbacks
+    def _stopListening(self) -> Any:
+        if self._listening_port is not None:
+            yield self._listening_port.stopListening()
+            self._listening_port = None
+
+    @staticmethod
+    def _safely(callback: Any) -> Any:
+        """Returns the given MQ callback logging (rather than propagating) its
+        failures: the metrics must never disturb the builds."""
+
+        def consume(key: Tuple[str, ...], message: Dict[str, Any]) -> Any:
+            d = defer.maybeDeferred(callback, message)
+            d.addErrback(log.err, "while accounting metrics for {!r}"
+                         .format(key))
+            return d
+        return consume
+
+    @defer.inlineCallbacks
+    def _builderName(self, builderid: int) -> Any:
+        if builderid not in self._builders:
+            builder = yield self.master.data.get(("builders", builderid))
+            self._builders[builderid] = builder["name"] if builder else "?"
+        return self._builders[builderid]
+
+    @defer.inlineCallbacks
+    def _workerFlavor(self, workerid: Optional[int]) -> Any:
+        if workerid not in self._flavors:
+            flavor = "unknown"
+            if workerid is not None:
+                worker = yield self.master.data.get(("workers", workerid))
+                if worker:
+                    flavor = getattr(
+                        self.master.workers.workers.get(worker["name"]),
+                        "flavor", "local")
+            self._flavors[workerid] = flavor
+        return self._flavors[workerid]
+
+    @defer.inlineCallbacks
+    def _buildLabels(self, buildid: int) -> Any:
+        """Returns the builder name and the worker flavor of the build."""
+
+        if buildid not in self._builds:
+            build = yield self.master.data.get(("builds", buildid))
+            builder = yield self._builderName(build["builderid"])
+            flavor = yield self._workerFlavor(build.get("workerid"))
+            self._builds[buildid] = (builder, flavor)
+        return self._builds[buildid]
+
+    @defer.inlineCallbacks
+    def _onBuildStarted(self, build: Dict[str, Any]) -> Any:
+        request = yield self.master.data.get(
+            ("buildrequests", build["buildrequestid"]))
+        submitted_at = _timestamp(request and request.get("submitted_at"))
+        started_at = _timestamp(build.get("started_at"))
+        if submitted_at is not None and started_at is not None:
+            builder = yield self._builderName(build["builderid"])
+            self.queue_wait.labels(builder).observe(
+                max(started_at - submitted_at, 0))
+
+    @defer.inlineCallbacks
+    def _onBuildFinished(self, build: Dict[str, Any]) -> Any:
+        builder, flavor = yield self._buildLabels(build["buildid"])
+        self._builds.pop(build["buildid"], None)
+        properties = yield self.master.data.get(
+            ("builds", build["buildid"], "properties"))
+        transferred, _ = (properties or {}).get(
+            ArtifactsShellCommand.TRANSFERRED_BYTES_PROPERTY, ({}, None))
+        for key, count in (transferred or {}).items():
+            direction, _, artifact_type = key.partition(":")
+            self.artifacts_transferred.labels(
+                builder, flavor, direction, artifact_type).inc(count)
+
+    @defer.inlineCallbacks
+    def _onStepFinished(self, step: Dict[str, Any]) -> Any:
+        started_at = _timestamp(step.get("started_at"))
+        complete_at = _timestamp(step.get("complete_at"))
+        if (step.get("results") == SKIPPED or started_at is None or
+                complete_at is None):
+            return
+        duration = max(complete_at - started_at, 0)
+        builder, flavor = yield self._buildLabels(step["buildid"])
+        if step["name"] == self.WORKER_PREPARATION_STEP:
+            self.worker_start_latency.labels(builder, flavor).observe(duration)
+        else:
+            self.step_duration.labels(
+                builder, flavor, step["name"]).observe(duration)
+
+    @defer.inlineCallbacks
+    def _pollBuildQueues(self) -> Any:
+        try:
+            requests = yield self.master.data.get(
+                ("buildrequests",),
+                filters=[resultspec.Filter("claimed", "eq", [False])])
+            waiting = {}  # type: Dict[str, int]
+            for request in requests:
+                builder = yield self._builderName(request["builderid"])
+                waiting[builder] = waiting.get(builder, 0) + 1
+            for builderid in list(self._builders):
+                builder = self._builders[builderid]
+                self.queue_depth.labels(builder).set(waiting.get(builder, 0))
+        except Exception:
+            log.err(None, "while polling the build queues for metrics")
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -0,0 +1,132 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+"""Schedulers reacting to the changes of the CLIP OS source tree (i.e. of the
+manifest or of any of the projects it lists) as notified by the change sources
+(Gerrit stream-events or the buildmaster web hook)."""
+
+from typing import Any, Iterable, List, Optional
+
+from buildbot.plugins import schedulers, util
+from buildbot.process.buildrequest import BuildRequest
+from buildbot.process.properties import Properties
+from twisted.internet import defer
+
+
+def clipos_sources_change_filter(
+        branch: str,
+        excluded_repositories: Iterable[str] = (),
+) -> util.ChangeFilter:
+    """Returns the change filter retaining the changes of the CLIP OS source
+    tree made on the given branch (whatever the project they are made to,
+    except the excluded repositories, e.g. the one of this buildbot
+    configuration).
+
+    The Gerrit change source reports the branches of the ``ref-updated``
+    events either as is or as full references depending on its version, both
+    forms are therefore accepted."""
+
+    branches = {branch, "refs/heads/{}".format(branch)}
+    excluded = {url.rstrip("/") for url in excluded_repositories if url}
+
+    def filter_fn(change: Any) -> bool:
+        return (change.branch in branches and
+                (change.repository or "").rstrip("/") not in excluded)
+
+    return util.ChangeFilter(filter_fn=filter_fn)
+
+
+class ManifestBuildsetsMixin(object):
+    """Mixin for the change-based schedulers building the CLIP OS source tree
+    as a whole.
+
+    The changes may come from any of the projects of the manifest whereas the
+    builds only know how to synchronize a whole source tree from its manifest
+    repository (see the ``repository`` and ``branch`` properties in
+    `clipos.build_factories`): the buildsets are therefore always created from
+    the default source stamps of the scheduler (i.e. the manifest repository
+    and branch given in its codebases) and the changed projects are only
+    recorded in the ``changed_projects`` property.
+
+    As these buildsets have no changes attached, the pending build requests
+    they create can be collapsed with each other (see
+    `collapse_identical_requests`).
+
+    """
+
+    CHANGED_PROJECTS_PROPERTY = "changed_projects"
+
+    @defer.inlineCallbacks
+    def addBuildsetForChanges(self, waited_for: bool = False,
+                              reason: str = "",
+                              external_idstring: Optional[str] = None,
+                              changeids: Optional[List[int]] = None,
+                              builderNames: Optional[List[str]] = None,
+                              properties: Optional[Properties] = None,
+                              **kwargs: Any) -> Any:
+        projects = set()
+        for changeid in changeids or []:
+            change = yield self.master.data.get(("changes", changeid))
+            if change:
+                projects.add(change["project"] or change["repository"])
+
+        properties = properties or Properties()
+        properties.setProperty(self.CHANGED_PROJECTS_PROPERTY,
+                               sorted(projects), "Scheduler")
+        result = yield self.addBuildsetForSourceStampsWithDefaults(
+            reason="{} ({} change(s) to {})".format(
+                reason, len(changeids or []),
+                ", ".join(sorted(projects)) or "the sources"),
+            sourcestamps=[],
+            waited_for=waited_for,
+            external_idstring=external_idstring,
+            builderNames=builderNames,
+            properties=properties,
+            **kwargs)
+        return result
+
+
+class ManifestChangesScheduler(ManifestBuildsetsMixin,
+                               schedulers.SingleBranchScheduler):
+    """Scheduler triggering a build of the CLIP OS source tree once its
+    changes settle down: all the changes received until no other change
+    arrives for ``treeStableTimer`` seconds make up a single buildset."""
+
+
+class ManifestChangesNightly(ManifestBuildsetsMixin, schedulers.Nightly):
+    """Nightly scheduler for the CLIP OS source tree which, when used with
+    ``onlyIfChanged``, does not trigger any build if no change has been made
+    to the sources since its last build."""
+
+
+@defer.inlineCallbacks
+def collapse_identical_requests(master: Any, builder: Any,
+                                request1: Any, request2: Any) -> Any:
+    """The ``collapseRequests`` function of the CLIP OS builders: a pending
+    build request is only collapsed with another one if they build the same
+    source stamps (as for the default behavior) and with the same properties.
+    This spares queueing several builds of the same sources while a build is
+    running without ever merging builds that would produce different artifacts
+    (e.g. a nightly build producing the SDKs with an incremental one)."""
+
+    collapsible = yield BuildRequest.canBeCollapsed(master, request1,
+                                                    request2)
+    if not collapsible:
+        return False
+    if request1["buildsetid"] == request2["buildsetid"]:
+        return True
+
+    properties = []
+    for request in (request1, request2):
+        buildset_properties = yield master.data.get(
+            ("buildsets", request["buildsetid"], "properties"))
+        # The changed projects do not change what is built:
+        properties.append({
+            name: value
+            for name, (value, _) in (buildset_properties or {}).items()
+            if name not in (ManifestBuildsetsMixin.CHANGED_PROJECTS_PROPERTY,
+                            "scheduler")
+        })
+    return properties[0] == properties[1]
+
+# vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
@@ -0,0 +1,1037 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+# Helper functions to store and retrieve the build artifacts on the
+# buildmaster. This file is not meant to be executed but to be sourced by the
+# build steps commands (see the ArtifactsShellCommand class).
+#
+# The artifacts are stored in a content-addressed fashion in the artifacts
+# directory of the buildmaster, exposed either via the artifacts HTTP service of
+# the buildmaster pointed by the ARTIFACTS_HTTP_URL environment variable (see
+# the clipos.artifacts module) or, if unset, via the anonymous FTP server
+# pointed by the ARTIFACTS_FTP_URL environment variable:
+#
+#   objects/<2 first digest chars>/<digest>
+#       The artifact blobs, named after their SHA-256 digest. A blob is
+#       uploaded only once whatever the number of builds that produced it.
+#
+#   <type>/<buildername>/<buildnumber>/MANIFEST.sha256
+#       The manifest of the artifacts produced by a build (in the sha256sum
+#       output format), each entry referencing a blob by its digest.
+#
+#   <type>/<buildername>/<buildnumber>/<artifact name>
+#       Hard links to the blobs referenced by the manifest (these are created
+#       on the buildmaster side, see the factories).
+#
+#   <type>/<buildername>/latest -> <buildnumber>
+#       The symlink to the latest build that produced artifacts.
+#
+#   <type>/<buildername>/.staging/<buildnumber>/MANIFEST.sha256
+#       The manifest uploaded by a build whose artifacts are not published
+#       yet: the buildmaster verifies the blobs it references, links them
+#       into this staging directory, renames it into the build directory and
+#       then swaps the "latest" symlink, each in one operation (see the
+#       factories). A build directory is therefore never seen incomplete.
+#
+# The manifests read from the buildmaster are snapshotted upon their first read
+# by a command: all the artifacts it retrieves from a "latest" build directory
+# thus come from the same build even if another one gets published meanwhile.
+# The digests of the blobs are verified upon their retrieval (or while they
+# are being extracted when streamed).
+#
+# The archive artifacts can be compressed according to the ARTIFACTS_COMPRESSION
+# environment variable ("none" or "zstd:<level>", the compressed archives get a
+# ".zst" suffix) and transferred according to the ARTIFACTS_TRANSFER_MODE
+# environment variable:
+#
+#   "file"
+#       The archives are written in the workspace before being uploaded and
+#       are downloaded into the workspace before being extracted.
+#
+#   "stream"
+#       The archives are streamed to the buildmaster while being created and
+#       extracted while being downloaded: they never land on the worker volume.
+#       The archive files are then replaced by ".streamed" stub files recording
+#       the digest and the size of the blob uploaded into the staging area of
+#       the buildmaster until they get saved as artifacts of the build.
+#
+# An artifact can also be carried over from a previous build without being
+# downloaded: it is then replaced by a ".ref" stub file recording the digest of
+# the blob already stored on the buildmaster (see artifacts_reference).
+#
+# If the ARTIFACTS_CACHE_DIR environment variable is set, the blobs transferred
+# by the worker are also kept (as hard links named after their digest) in this
+# directory which is expected to lie on the same volume as the workspace but
+# outside of it. This cache is looked up before any download and is bounded to
+# ARTIFACTS_CACHE_MAX_SIZE_GIB gibibytes by evicting the least recently used
+# blobs.
+#
+# If the ARTIFACTS_LOG_SUMMARY_INTERVAL environment variable is set to a
+# positive number of seconds, the file listings of the archive creations and
+# extractions (and of the other commands run with artifacts_summarize_log) are
+# replaced in the step logs by progress summaries emitted at this interval.
+# These listings are kept compressed in the ARTIFACTS_LISTINGS_DIR directory
+# only when the command fails.
+#
+# The transfers through the artifacts HTTP service are resumed where they
+# stopped when interrupted (e.g. by a dropped connection): the downloads by
+# range requests and the uploads (made by chunks) from the bytes already
+# received by the service. The large blobs are downloaded as several segments
+# in parallel.
+
+ARTIFACTS_MANIFEST_FILENAME="MANIFEST.sha256"
+ARTIFACTS_STAGING_PATH="/objects/.staging"
+
+# The directory of the snapshots of the manifests read by the current command
+# (shared by its subshells, see artifacts_remote_manifest). Note that a command
+# setting its own EXIT trap must remove it by itself.
+_ARTIFACTS_MANIFESTS_SNAPSHOTS="${TMPDIR:-/tmp}/artifacts-manifests.$$"
+trap 'rm -rf "${_ARTIFACTS_MANIFESTS_SNAPSHOTS}"' EXIT
+
+# The number of attempts of each transfer through the artifacts HTTP service
+# (each attempt resuming the transfer where the previous one stopped), the size
+# of the chunks in which the files are uploaded and the minimal size of the
+# segments in which the blobs are downloaded in parallel:
+ARTIFACTS_HTTP_ATTEMPTS=5
+ARTIFACTS_HTTP_UPLOAD_CHUNK_SIZE=$(( 64 * 1024 * 1024 ))
+ARTIFACTS_HTTP_MIN_SEGMENT_SIZE=$(( 16 * 1024 * 1024 ))
+
+# Run the lftp commands read from the standard input against the artifacts FTP
+# server.
+_artifacts_lftp() {
+    { echo "connect ${ARTIFACTS_FTP_URL:?}"; cat; } | lftp
+}
+
+# Run curl against the path of the artifacts HTTP service given as first
+# argument with the options given as following arguments.
+_artifacts_curl() {
+    local path="${1:?}"
+    shift
+    curl --silent --show-error --fail "$@" "${ARTIFACTS_HTTP_URL%/}${path}"
+}
+
+# Print the size of the file at the given path of the artifacts HTTP service
+# (or fail if there is no such file).
+_artifacts_http_size() {
+    local size
+    size="$(_artifacts_curl "${1:?}" --head \
+            | tr -d '\r' | awk 'tolower($1) == "content-length:" { print $2 }')" \
+        && [[ -n "${size}" ]] && echo "${size}"
+}
+
+# Write onto the standard output the bytes of the file at the path of the
+# artifacts HTTP service given as first argument, from the offset given as
+# second argument (0 by default) to the one given as third argument (the end of
+# the file by default). An interrupted transfer is resumed from the last byte
+# received.
+_artifacts_http_fetch() {
+    # Each attempt reopens the standard output, which truncates it if it is a
+    # regular file: the bytes are therefore always written through a pipe.
+    if [[ ! -p /dev/stdout ]]; then
+        _artifacts_http_fetch "$@" | cat
+        return "${PIPESTATUS[0]}"
+    fi
+
+    local source="${1:?}" offset="${2:-0}" last="${3:-}"
+    local attempt=1 received range
+    while :; do
+        range=()
+        if (( offset > 0 )) || [[ -n "${last}" ]]; then
+            range=(--range "${offset}-${last}")
+        fi
+        # The bytes go through the file descriptor 3 while the count of bytes
+        # received is captured:
+        received=0
+        if { received="$(_artifacts_curl "${source}" "${range[@]}" \
+                         --write-out '%{size_download}' --output /dev/fd/3)"; \
+           } 3>&1; then
+            return 0
+        fi
+        offset=$(( offset + ${received:-0} ))
+        if [[ -n "${last}" ]] && (( offset > last )); then
+            return 0
+        elif (( attempt >= ARTIFACTS_HTTP_ATTEMPTS )); then
+            echo >&2 "Download of \"${source}\" failed after ${attempt} attempt(s)."
+            return 1
+        fi
+        attempt=$(( attempt + 1 ))
+        echo >&2 "Resuming the download of \"${source}\" from byte ${offset} (attempt ${attempt})..."
+        sleep "${attempt}"
+    done
+}
+
+# Download the file at the path of the artifacts HTTP service given as first
+# argument into the local file given as second argument, as the number of
+# segments given as third argument (1 by default) downloaded in parallel.
+_artifacts_http_get() {
+    local source="${1:?}" destination="${2:?}" segments="${3:-1}"
+    local size length first pid pids=() status=0
+    size="$(_artifacts_http_size "${source}")" || return 1
+    length=$(( (size + segments - 1) / segments ))
+    if (( length < ARTIFACTS_HTTP_MIN_SEGMENT_SIZE )); then
+        length="${ARTIFACTS_HTTP_MIN_SEGMENT_SIZE}"
+    fi
+
+    : > "${destination}"
+    for (( first = 0; first < size; first += length )); do
+        (
+            set -o pipefail
+            _artifacts_http_fetch "${source}" "${first}" \
+                "$(( (first + length < size ? first + length : size) - 1 ))" \
+                | dd of="${destination}" bs=1M iflag=fullblock \
+                     oflag=seek_bytes seek="${first}" conv=notrunc status=none
+        ) &
+        pids+=("$!")
+    done
+    for pid in "${pids[@]}"; do
+        wait "${pid}" || status=1
+    done
+    return "${status}"
+}
+
+# Upload the local file given as first argument onto the path of the artifacts
+# HTTP service given as second argument by chunks (see the clipos.artifacts
+# module). An interrupted upload is resumed from the bytes received by the
+# service.
+_artifacts_http_put() {
+    local source="${1:?}" destination="${2:?}"
+    local size length offset=0 attempt=1 code
+    size="$(stat -c %s "${source}")"
+    if (( size == 0 )); then
+        _artifacts_curl "${destination}" --upload-file "${source}" \
+            --output /dev/null
+        return
+    fi
+
+    # The blobs being content-addressed, an upload left over by a previous
+    # command can be resumed as well:
+    if [[ "${destination}" == /objects/* ]]; then
+        offset="$(_artifacts_http_size "${destination}.part" 2>/dev/null)" \
+            || offset=0
+        if (( offset >= size )); then
+            offset=0
+        elif (( offset > 0 )); then
+            echo "Resuming the upload of \"${destination}\" from byte ${offset}..."
+        fi
+    fi
+
+    while (( offset < size )); do
+        length=$(( size - offset ))
+        if (( length > ARTIFACTS_HTTP_UPLOAD_CHUNK_SIZE )); then
+            length="${ARTIFACTS_HTTP_UPLOAD_CHUNK_SIZE}"
+        fi
+        if code="$(dd if="${source}" bs=1M iflag=skip_bytes,count_bytes \
+                        skip="${offset}" count="${length}" status=none \
+                    | _artifacts_curl "${destination}" --upload-file - \
+                          --header "Content-Range: bytes ${offset}-$(( offset + length - 1 ))/${size}" \
+                          --output /dev/null --write-out '%{http_code}')"; then
+            offset=$(( offset + length ))
+            attempt=1
+            continue
+        fi
+
+        # Only the offset mismatches are worth resuming among the refusals:
+        if [[ "${code}" == 4* && "${code}" != 409 ]]; then
+            echo >&2 "Upload of \"${destination}\" refused by the buildmaster (HTTP ${code})."
+            return 1
+        elif (( offset + length == size )) && [[ \
+                "$(_artifacts_http_size "${destination}" 2>/dev/null)" == "${size}" ]]; then
+            return 0  # only the response to the last chunk got lost
+        elif (( attempt >= ARTIFACTS_HTTP_ATTEMPTS )); then
+            echo >&2 "Upload of \"${destination}\" failed after ${attempt} attempt(s)."
+            return 1
+        fi
+        attempt=$(( attempt + 1 ))
+        sleep "${attempt}"
+        offset="$(_artifacts_http_size "${destination}.part" 2>/dev/null)" \
+            || offset=0
+        echo >&2 "Resuming the upload of \"${destination}\" from byte ${offset} (attempt ${attempt})..."
+    done
+}
+
+# Print the SHA-256 digest of the file given as argument.
+artifacts_digest() {
+    sha256sum < "${1:?}" | cut -d' ' -f1
+}
+
+# Print the path on the buildmaster of the blob of the given digest.
+artifacts_object_path() {
+    local digest="${1:?}"
+    echo "/objects/${digest:0:2}/${digest}"
+}
+
+# Return successfully if the given path exists on the buildmaster.
+artifacts_remote_exists() {
+    if [[ -n "${ARTIFACTS_HTTP_URL:-}" ]]; then
+        _artifacts_curl "${1:?}" --head --output /dev/null 2>/dev/null
+        return
+    fi
+    _artifacts_lftp >/dev/null 2>&1 <<END_OF_LFTP_SCRIPT
+cls -1 "${1:?}"
+END_OF_LFTP_SCRIPT
+}
+
+# Upload a local file onto the buildmaster. The file is uploaded under a
+# temporary name and then renamed so that a partially uploaded file is never
+# exposed under its final name.
+artifacts_remote_put() {
+    local source="${1:?}" destination="${2:?}"
+    if [[ -n "${ARTIFACTS_HTTP_URL:-}" ]]; then
+        _artifacts_http_put "${source}" "${destination}"
+        return
+    fi
+    _artifacts_lftp <<END_OF_LFTP_SCRIPT
+mkdir -p -f "${destination%/*}"
+put "${source}" -o "${destination}.part"
+mv "${destination}.part" "${destination}"
+END_OF_LFTP_SCRIPT
+}
+
+# Download a file from the buildmaster.
+artifacts_remote_get() {
+    local source="${1:?}" destination="${2:?}"
+    if [[ -n "${ARTIFACTS_HTTP_URL:-}" ]]; then
+        _artifacts_http_get "${source}" "${destination}"
+        return
+    fi
+    _artifacts_lftp <<END_OF_LFTP_SCRIPT
+set xfer:clobber yes
+get "${source}" -o "${destination}"
+END_OF_LFTP_SCRIPT
+}
+
+# Upload the standard input onto the buildmaster.
+artifacts_remote_put_stream() {
+    if [[ -n "${ARTIFACTS_HTTP_URL:-}" ]]; then
+        _artifacts_curl "${1:?}" --upload-file - --output /dev/null
+        return
+    fi
+    curl --silent --show-error --fail --ftp-create-dirs --upload-file - \
+        "${ARTIFACTS_FTP_URL%/}${1:?}"
+}
+
+# Download a file from the buildmaster onto the standard output.
+artifacts_remote_get_stream() {
+    if [[ -n "${ARTIFACTS_HTTP_URL:-}" ]]; then
+        _artifacts_http_fetch "${1:?}"
+        return
+    fi
+    curl --silent --show-error --fail "${ARTIFACTS_FTP_URL%/}${1:?}"
+}
+
+# Report the count of bytes given as third argument transferred in the
+# direction given as first argument ("upload" or "download") for the artifacts
+# of the build directory given as second argument (these reports are accounted
+# in the buildmaster metrics, see the ArtifactsShellCommand class).
+_artifacts_account() {
+    local type="${2#/}"
+    echo "artifacts-transfer: ${1:?} ${type%%/*} ${3:?}"
+}
+
+# Rename a file on the buildmaster.
+artifacts_remote_move() {
+    local source="${1:?}" destination="${2:?}"
+    if [[ -n "${ARTIFACTS_HTTP_URL:-}" ]]; then
+        _artifacts_curl "${source}" --request MOVE \
+            --header "Destination: ${destination}" --output /dev/null
+        return
+    fi
+    _artifacts_lftp <<END_OF_LFTP_SCRIPT
+mkdir -p -f "${destination%/*}"
+mv "${source}" "${destination}"
+END_OF_LFTP_SCRIPT
+}
+
+# Remove a file from the buildmaster.
+artifacts_remote_remove() {
+    if [[ -n "${ARTIFACTS_HTTP_URL:-}" ]]; then
+        _artifacts_curl "${1:?}" --request DELETE --output /dev/null
+        return
+    fi
+    _artifacts_lftp <<END_OF_LFTP_SCRIPT
+rm -f "${1:?}"
+END_OF_LFTP_SCRIPT
+}
+
+# Print onto the standard output the manifest of the build directory given as
+# argument (e.g. "/quicksync-artifacts/repo-sync/latest"). The manifest is only
+# retrieved upon its first read by the current command: the subsequent reads
+# get this snapshot (the first snapshot stored wins when several subshells
+# retrieve it at once).
+artifacts_remote_manifest() {
+    local source="${1:?}" snapshot
+    snapshot="${_ARTIFACTS_MANIFESTS_SNAPSHOTS}/$(printf '%s' "${source}" \
+                                                  | sha256sum | cut -c1-16)"
+    if [[ ! -f "${snapshot}" ]]; then
+        mkdir -p "${_ARTIFACTS_MANIFESTS_SNAPSHOTS}"
+        if ! artifacts_remote_get_stream \
+                "${source}/${ARTIFACTS_MANIFEST_FILENAME}" \
+                > "${snapshot}.${BASHPID}"; then
+            rm -f "${snapshot}.${BASHPID}"
+            return 1
+        fi
+        mv -n "${snapshot}.${BASHPID}" "${snapshot}"
+        rm -f "${snapshot}.${BASHPID}"
+    fi
+    cat "${snapshot}"
+}
+
+# Return successfully if the artifact named after the second argument (possibly
+# completed by a compression suffix) is referenced by the manifest of the build
+# directory given as first argument.
+artifacts_remote_has() {
+    local entry
+    entry="$(artifacts_remote_manifest "${1:?}" \
+             | artifacts_manifest_lookup /dev/stdin "${2:?}")"
+    [[ -n "${entry}" ]]
+}
+
+# Print the name and the digest (separated by a space) of the artifact entry
+# named after the second argument (possibly completed by a compression suffix)
+# in the manifest file given as first argument.
+artifacts_manifest_lookup() {
+    local manifest="${1:?}" name="${2:?}"
+    awk -v name="${name}" \
+        '$2 == name || $2 == name ".zst" { print $2, $1; exit }' "${manifest}"
+}
+
+# Print the suffix of the archives compressed according to the
+# ARTIFACTS_COMPRESSION setting.
+_artifacts_compression_suffix() {
+    case "${ARTIFACTS_COMPRESSION:-none}" in
+        none) ;;
+        zstd:*) echo ".zst" ;;
+        *)
+            echo >&2 "Unsupported artifacts compression \"${ARTIFACTS_COMPRESSION}\"."
+            return 1
+            ;;
+    esac
+}
+
+# Compress the standard input onto the standard output according to the
+# ARTIFACTS_COMPRESSION setting (with as many threads as available cores).
+_artifacts_compress() {
+    local level
+    case "${ARTIFACTS_COMPRESSION:-none}" in
+        none) cat ;;
+        zstd:*)
+            level="${ARTIFACTS_COMPRESSION#zstd:}"
+            if [[ "${level}" -gt 19 ]]; then
+                zstd --quiet --threads=0 --ultra "-${level}"
+            else
+                zstd --quiet --threads=0 "-${level}"
+            fi
+            ;;
+    esac
+}
+
+# Decompress the standard input onto the standard output according to the
+# suffix of the archive name given as argument.
+_artifacts_decompress() {
+    case "${1:?}" in
+        *.zst) zstd --quiet --decompress --stdout ;;
+        *) cat ;;
+    esac
+}
+
+# Print all the local file names that may stand for the artifact named after
+# the argument (either compressed or not, either an actual file or a stub).
+_artifacts_variants() {
+    local name="${1:?}" variant
+    for variant in "${name}" "${name}.zst"; do
+        echo "${variant}"
+        echo "${variant}.streamed"
+        echo "${variant}.ref"
+    done
+}
+
+# Print the local archive artifact files (either compressed or not, either
+# actual archives or stubs) found for the names given as arguments.
+artifacts_local_archives() {
+    local name file
+    for name in "$@"; do
+        while read -r file; do
+            if [[ -f "${file}" ]]; then
+                echo "${file}"
+            fi
+        done < <(_artifacts_variants "${name}")
+    done
+}
+
+# Remove any local copy of the artifacts named after the arguments.
+artifacts_discard() {
+    local name
+    for name in "$@"; do
+        _artifacts_variants "${name}" | xargs -d '\n' rm -f
+    done
+}
+
+# Replace any local copy of the artifact named after the first argument by a
+# stub referencing the blob of the digest given as second argument (which is
+# expected to be already stored on the buildmaster) so that it gets carried
+# over into the manifest of the current build without being transferred.
+artifacts_reference() {
+    local name="${1:?}" digest="${2:?}"
+    artifacts_discard "${name%.zst}"
+    echo "${digest}" > "${name}.ref"
+}
+
+# Print the digest of the local archive artifact named after the first
+# argument (either compressed or not, either an actual archive or a stub) or
+# nothing if there is none.
+artifacts_local_digest() {
+    local file
+    file="$(artifacts_local_archives "${1:?}" | head -n 1)"
+    case "${file}" in
+        "") ;;
+        *.streamed) cut -d' ' -f1 "${file}" ;;
+        *.ref) cat "${file}" ;;
+        *) sha256sum "${file}" | cut -d' ' -f1 ;;
+    esac
+}
+
+# Run the command given as arguments (following a label and the extended
+# regular expression matching the file listing lines of its error output) with
+# its file listing summarized according to the ARTIFACTS_LOG_SUMMARY_INTERVAL
+# setting. The full listing is kept compressed in the ARTIFACTS_LISTINGS_DIR
+# directory only if the command fails (see the factories for its upload onto
+# the buildmaster).
+artifacts_summarize_log() {
+    local label="${1:?}" regexp="${2:?}"
+    shift 2
+
+    if [[ "${ARTIFACTS_LOG_SUMMARY_INTERVAL:-0}" -le 0 ]]; then
+        "$@"
+        return
+    fi
+
+    local listing filter_fd filter_pid stdin_fd status=0
+    mkdir -p "${ARTIFACTS_LISTINGS_DIR:?}"
+    listing="$(mktemp --suffix=.log.gz \
+               "${ARTIFACTS_LISTINGS_DIR}/${label//[^a-zA-Z0-9._:-]/_}.XXXXXX")"
+    exec {filter_fd}> >(_artifacts_log_filter "${label}" "${regexp}" "${listing}")
+    filter_pid="$!"
+    # Run the command as a background job to preserve its errexit behavior:
+    exec {stdin_fd}<&0
+    "$@" <&"${stdin_fd}" 2>&"${filter_fd}" &
+    wait "$!" || status=$?
+    exec {filter_fd}>&- {stdin_fd}<&-
+    wait "${filter_pid}"  # for the listing to be complete
+
+    if [[ "${status}" -eq 0 ]]; then
+        rm -f "${listing}"
+    else
+        echo >&2 "The full listing of \"${label}\" is kept in \"${listing}\"."
+    fi
+    return "${status}"
+}
+
+# Filter the lines read from the standard input: the lines matching the
+# extended regular expression given as second argument are written compressed
+# into the file given as third argument and summarized every
+# ARTIFACTS_LOG_SUMMARY_INTERVAL seconds (along with the byte counts output by
+# _artifacts_meter if any), the other lines are passed through.
+_artifacts_log_filter() {
+    local label="${1:?}" regexp="${2:?}" listing="${3:?}"
+
+    # Note: srand() returns the previous seed (i.e. the time of day when
+    # seeded without argument), this is the portable way to get the time in
+    # awk.
+    awk -v label="${label}" -v regexp="${regexp}" \
+        -v interval="${ARTIFACTS_LOG_SUMMARY_INTERVAL}" \
+        -v compressor="gzip -c > '${listing}'" '
+        function now() { srand(); return srand() }
+        function human(count,   units, i) {
+            split("B KiB MiB GiB TiB", units, " ")
+            for (i = 1; count >= 1024 && i < 5; i++) { count /= 1024 }
+            return sprintf("%.1f %s", count, units[i])
+        }
+        function summary(final,   elapsed, message) {
+            last = now()
+            elapsed = (last > start) ? last - start : 1
+            message = sprintf("%d files (%.0f files/s)", files, files / elapsed)
+            if (metered) {
+                message = message sprintf(", %s (%s/s)", human(bytes),
+                                          human(bytes / elapsed))
+            }
+            printf "[%s] %s%s\n", label, (final ? "done: " : ""), message
+            fflush()
+        }
+        BEGIN { start = now(); last = start }
+        /^[0-9]+$/ {
+            bytes = $0; metered = 1
+            if (now() - last >= interval) { summary(0) }
+            next
+        }
+        $0 ~ regexp {
+            files++
+            print | compressor
+            if (files % 1000 == 0 && now() - last >= interval) { summary(0) }
+            next
+        }
+        { print; fflush() }
+        END { close(compressor); summary(1) }
+    ' >&2
+}
+
+# Pass the standard input through while printing on the error output the count
+# of bytes passed so far every ARTIFACTS_LOG_SUMMARY_INTERVAL seconds (this is
+# summarized by artifacts_summarize_log).
+_artifacts_meter() {
+    if [[ "${ARTIFACTS_LOG_SUMMARY_INTERVAL:-0}" -gt 0 ]] &&
+            command -v pv >/dev/null; then
+        pv -f -n -b -i "${ARTIFACTS_LOG_SUMMARY_INTERVAL}"
+    else
+        cat
+    fi
+}
+
+# Pass the standard input through while writing the count of bytes passed into
+# the file given as first argument (once the whole input has been passed).
+_artifacts_count() {
+    local countfile="${1:?}"
+    local fifo counter status=0
+    fifo="$(mktemp -u)"
+    mkfifo "${fifo}"
+    wc -c < "${fifo}" > "${countfile}" &
+    counter="$!"
+    tee "${fifo}" || status=$?
+    wait "${counter}" || status=$?
+    rm -f "${fifo}"
+    return "${status}"
+}
+
+# Create an archive artifact of the paths given as arguments (following the
+# name of the archive and the optional "--sudo" flag to run bsdtar with root
+# privileges). Depending on the ARTIFACTS_TRANSFER_MODE setting, the archive is
+# either written locally or streamed into the buildmaster staging area.
+artifacts_archive() {
+    local name="${1:?}"
+    if [[ "${name}" == "--sudo" ]]; then
+        name="${2:?}"
+    fi
+    artifacts_summarize_log "archive ${name##*/}" '^a ' \
+        _artifacts_archive "$@"
+}
+
+_artifacts_archive() {
+    local bsdtar=(bsdtar)
+    if [[ "${1:-}" == "--sudo" ]]; then
+        bsdtar=(sudo bsdtar)
+        shift
+    fi
+    local name="${1:?}"
+    shift
+
+    local archive
+    archive="${name}$(_artifacts_compression_suffix)"
+    artifacts_discard "${name}"
+
+    if [[ "${ARTIFACTS_TRANSFER_MODE:-file}" != "stream" ]]; then
+        "${bsdtar[@]}" -cvf - "$@" | _artifacts_meter | _artifacts_compress \
+            > "${archive}"
+        return
+    fi
+
+    local staging fifo digestfile countfile
+    staging="${ARTIFACTS_STAGING_PATH}/$(cat /proc/sys/kernel/random/uuid)"
+    fifo="$(mktemp -u)"
+    digestfile="$(mktemp)"
+    countfile="$(mktemp)"
+    mkfifo "${fifo}"
+    sha256sum < "${fifo}" | cut -d' ' -f1 > "${digestfile}" &
+    echo "Streaming archive \"${archive}\" to the buildmaster staging area..."
+    "${bsdtar[@]}" -cvf - "$@" | _artifacts_meter | _artifacts_compress \
+        | tee "${fifo}" | _artifacts_count "${countfile}" \
+        | artifacts_remote_put_stream "${staging}"
+    wait $!
+    # The upload is accounted once the destination of the artifact is known
+    # (see artifacts_push):
+    printf '%s %s %s\n' "$(cat "${digestfile}")" "${staging}" \
+        "$(cat "${countfile}")" > "${archive}.streamed"
+    rm -f "${fifo}" "${digestfile}" "${countfile}"
+}
+
+# Extract the archive artifact named after the second argument (possibly
+# completed by a compression suffix) from the build directory given as first
+# argument (e.g. "/sdks/clipos/latest"). The remaining arguments are passed on
+# to bsdtar. Depending on the ARTIFACTS_TRANSFER_MODE setting, the archive is
+# either expected to be present locally or streamed from the buildmaster.
+artifacts_extract() {
+    artifacts_summarize_log "extract ${2:?}" '^x ' _artifacts_extract "$@"
+}
+
+_artifacts_extract() {
+    local source="${1:?}" name="${2:?}"
+    shift 2
+
+    if [[ "${ARTIFACTS_TRANSFER_MODE:-file}" != "stream" ]]; then
+        local archive
+        for archive in "${name}" "${name}.zst"; do
+            if [[ -f "${archive}" ]]; then
+                _artifacts_decompress "${archive}" < "${archive}" \
+                    | _artifacts_meter | bsdtar -xvf - "$@"
+                return
+            fi
+        done
+        echo >&2 "Archive artifact \"${name}\" could not be found."
+        return 1
+    fi
+
+    local manifest entry
+    manifest="$(mktemp)"
+    artifacts_remote_manifest "${source}" > "${manifest}" || {
+        rm -f "${manifest}"
+        return 1
+    }
+    entry="$(artifacts_manifest_lookup "${manifest}" "${name}")"
+    rm -f "${manifest}"
+    if [[ -z "${entry}" ]]; then
+        echo >&2 "Artifact \"${name}\" is not referenced by the manifest of \"${source}\"."
+        return 1
+    fi
+
+    local cached="${ARTIFACTS_CACHE_DIR:-}/${entry#* }"
+    if [[ -n "${ARTIFACTS_CACHE_DIR:-}" && -f "${cached}" ]]; then
+        echo "Extracting artifact \"${entry% *}\" from the worker artifacts cache (${entry#* })..."
+        touch "${cached}"  # mark as recently used
+        if ! _artifacts_verify "${entry#* }" "${entry% *}" < "${cached}" \
+                | _artifacts_decompress "${entry% *}" | _artifacts_meter \
+                | bsdtar -xvf - "$@"; then
+            echo >&2 "Evicting blob ${entry#* } from the worker artifacts cache."
+            rm -f "${cached}"
+            return 1
+        fi
+        return
+    fi
+
+    local countfile status=0
+    countfile="$(mktemp)"
+    echo "Streaming and extracting artifact \"${entry% *}\" (${entry#* })..."
+    artifacts_remote_get_stream "$(artifacts_object_path "${entry#* }")" \
+        | _artifacts_count "${countfile}" \
+        | _artifacts_verify "${entry#* }" "${entry% *}" \
+        | _artifacts_decompress "${entry% *}" | _artifacts_meter \
+        | bsdtar -xvf - "$@" || status=$?
+    _artifacts_account download "${source}" "$(cat "${countfile}")"
+    rm -f "${countfile}"
+    return "${status}"
+}
+
+# Pass the standard input through while computing its digest and fail (once
+# the whole input has been passed) if it does not match the digest given as
+# first argument for the artifact named after the second argument. This
+# verifies the artifacts while they are being extracted.
+_artifacts_verify() {
+    local digest="${1:?}" name="${2:?}"
+    local fifo digestfile checker status=0
+    fifo="$(mktemp -u)"
+    digestfile="$(mktemp)"
+    mkfifo "${fifo}"
+    sha256sum < "${fifo}" | cut -d' ' -f1 > "${digestfile}" &
+    checker="$!"
+    tee "${fifo}" || status=$?
+    wait "${checker}" || status=$?
+    if [[ "${status}" -eq 0 && "$(cat "${digestfile}")" != "${digest}" ]]; then
+        echo >&2 "Artifact \"${name}\" does not match its expected digest."
+        status=1
+    fi
+    rm -f "${fifo}" "${digestfile}"
+    return "${status}"
+}
+
+# Store the given local files as artifacts of the build directory given as
+# first argument (e.g. "/sdks/clipos/42"). The blobs already known by the
+# buildmaster are not uploaded again.
+artifacts_push() {
+    local destination="${1:?}"
+    shift
+
+    local manifest file name digest staging size
+    manifest="$(mktemp)"
+    for file in "$@"; do
+        name="${file##*/}"
+        if [[ "${name}" == *.ref ]]; then
+            # The artifact is carried over from a previous build:
+            name="${name%.ref}"
+            read -r digest < "${file}"
+            if ! artifacts_remote_exists "$(artifacts_object_path "${digest}")"; then
+                echo >&2 "Artifact \"${name}\" references an unknown blob (${digest})."
+                rm -f "${manifest}"
+                return 1
+            fi
+            echo "Artifact \"${name}\" carried over from a previous build (${digest})."
+        elif [[ "${name}" == *.streamed ]]; then
+            # The archive has already been streamed into the staging area:
+            name="${name%.streamed}"
+            read -r digest staging size < "${file}"
+            _artifacts_account upload "${destination}" "${size:-0}"
+            if artifacts_remote_exists "$(artifacts_object_path "${digest}")"; then
+                echo "Artifact \"${name}\" already stored on the buildmaster (${digest}): dropping streamed copy."
+                artifacts_remote_remove "${staging}"
+            else
+                echo "Storing streamed artifact \"${name}\" (${digest})..."
+                artifacts_remote_move "${staging}" \
+                    "$(artifacts_object_path "${digest}")"
+            fi
+        else
+            digest="$(artifacts_digest "${file}")"
+            if artifacts_remote_exists "$(artifacts_object_path "${digest}")"; then
+                echo "Artifact \"${name}\" already stored on the buildmaster (${digest}): skipping upload."
+            else
+                echo "Uploading artifact \"${name}\" (${digest})..."
+                artifacts_remote_put "${file}" \
+                    "$(artifacts_object_path "${digest}")"
+                _artifacts_account upload "${destination}" \
+                    "$(stat -c %s "${file}")"
+            fi
+            _artifacts_cache_store "${digest}" "${file}"
+        fi
+        printf '%s  %s\n' "${digest}" "${name}" >> "${manifest}"
+    done
+
+    echo "Saving artifacts manifest into \"${destination}\":"
+    cat "${manifest}"
+    artifacts_remote_put "${manifest}" \
+        "${destination}/${ARTIFACTS_MANIFEST_FILENAME}"
+    rm -f "${manifest}"
+}
+
+# Make the blob of the digest given as first argument available locally under
+# the name given as second argument if possible (i.e. if the local file already
+# matches this digest or if the blob is found in the worker artifacts cache) and
+# return successfully in that case.
+_artifacts_local_lookup() {
+    local digest="${1:?}" name="${2:?}"
+    local cached="${ARTIFACTS_CACHE_DIR:-}/${digest}"
+
+    if [[ -n "${ARTIFACTS_CACHE_DIR:-}" && -f "${cached}" ]]; then
+        touch "${cached}"  # mark as recently used
+        if [[ ! "${name}" -ef "${cached}" ]]; then
+            echo "Artifact \"${name}\" found in the worker artifacts cache (${digest})."
+            ln -f "${cached}" "${name}"
+        fi
+        return 0
+    fi
+
+    if [[ -f "${name}" && "$(artifacts_digest "${name}")" == "${digest}" ]]; then
+        _artifacts_cache_store "${digest}" "${name}"
+        return 0
+    fi
+    return 1
+}
+
+# Keep in the worker artifacts cache (if enabled) the local file given as
+# second argument as the blob of the digest given as first argument and evict
+# the least recently used blobs if the cache exceeds its size budget.
+_artifacts_cache_store() {
+    local digest="${1:?}" name="${2:?}"
+    if [[ -z "${ARTIFACTS_CACHE_DIR:-}" ]]; then
+        return 0
+    fi
+
+    mkdir -p "${ARTIFACTS_CACHE_DIR}"
+    ln -f "${name}" "${ARTIFACTS_CACHE_DIR}/${digest}"
+    touch "${ARTIFACTS_CACHE_DIR}/${digest}"
+    (
+        # Several builds may share this cache: serialize the evictions.
+        flock 9
+        local budget=$(( ${ARTIFACTS_CACHE_MAX_SIZE_GIB:-0} * 1024 * 1024 * 1024 ))
+        local total size blob
+        total="$(find "${ARTIFACTS_CACHE_DIR}" -maxdepth 1 -type f \
+                     ! -name .lock -printf '%s\n' | awk '{ s += $1 } END { print s + 0 }')"
+        while read -r size blob; do
+            if (( total <= budget )); then
+                break
+            fi
+            echo "Evicting blob ${blob##*/} from the worker artifacts cache."
+            rm -f "${blob}"
+            total=$(( total - size ))
+        done < <(find "${ARTIFACTS_CACHE_DIR}" -maxdepth 1 -type f \
+                     ! -name .lock -printf '%T@ %s %p\n' \
+                     | sort -n | cut -d' ' -f2-)
+    ) 9> "${ARTIFACTS_CACHE_DIR}/.lock"
+}
+
+# Drop any local copy of the artifact named after the first argument which has
+# another compression than the one of the manifest entry name given as second
+# argument.
+_artifacts_drop_other_variants() {
+    local name="${1:?}" entry_name="${2:?}"
+    if [[ "${entry_name}" == "${name}" ]]; then
+        rm -f "${name}.zst"
+    else
+        rm -f "${name}"
+    fi
+}
+
+# Retrieve into the current working directory the artifacts named after the
+# arguments following the first one (possibly completed by a compression
+# suffix) from the build directory given as first argument (e.g.
+# "/sdks/clipos/latest"). The local files that already match the digests
+# referenced by the manifest are not downloaded again.
+artifacts_pull() {
+    local source="${1:?}"
+    shift
+
+    local manifest entry name digest
+    manifest="$(mktemp)"
+    artifacts_remote_manifest "${source}" > "${manifest}" || {
+        rm -f "${manifest}"
+        return 1
+    }
+
+    for name in "$@"; do
+        entry="$(artifacts_manifest_lookup "${manifest}" "${name}")"
+        if [[ -z "${entry}" ]]; then
+            echo >&2 "Artifact \"${name}\" is not referenced by the manifest of \"${source}\"."
+            rm -f "${manifest}"
+            return 1
+        fi
+        _artifacts_drop_other_variants "${name}" "${entry% *}"
+        name="${entry% *}"
+        digest="${entry#* }"
+
+        if _artifacts_local_lookup "${digest}" "${name}"; then
+            echo "Artifact \"${name}\" is already up-to-date (${digest}): skipping download."
+            continue
+        fi
+
+        echo "Downloading artifact \"${name}\" (${digest})..."
+        artifacts_remote_get "$(artifacts_object_path "${digest}")" \
+            "${name}.part"
+        if [[ "$(artifacts_digest "${name}.part")" != "${digest}" ]]; then
+            echo >&2 "Artifact \"${name}\" does not match its expected digest."
+            rm -f "${name}.part" "${manifest}"
+            return 1
+        fi
+        mv -f "${name}.part" "${name}"
+        _artifacts_account download "${source}" "$(stat -c %s "${name}")"
+        _artifacts_cache_store "${digest}" "${name}"
+    done
+
+    rm -f "${manifest}"
+}
+
+# Retrieve concurrently into the current working directory the artifacts given
+# as pairs of arguments: the build directory (e.g. "/sdks/clipos/latest") and
+# the name of the artifact (possibly completed by a compression suffix). At
+# most ARTIFACTS_FETCH_MAX_PARALLEL_TRANSFERS transfers are made at once (all
+# through one session with the FTP server), each one being segmented into
+# ARTIFACTS_FETCH_SEGMENTS_PER_TRANSFER parallel chunks. The local files that
+# already match the digests referenced by the manifests are not downloaded
+# again.
+artifacts_pull_many() {
+    local parallel="${ARTIFACTS_FETCH_MAX_PARALLEL_TRANSFERS:-4}"
+    local segments="${ARTIFACTS_FETCH_SEGMENTS_PER_TRANSFER:-4}"
+
+    local source name entry digest
+    local pending=() sources=()
+    while [[ "$#" -gt 0 ]]; do
+        source="${1:?}" name="${2:?}"
+        shift 2
+
+        entry="$(artifacts_remote_manifest "${source}" \
+                 | artifacts_manifest_lookup /dev/stdin "${name}")"
+        if [[ -z "${entry}" ]]; then
+            echo >&2 "Artifact \"${name}\" is not referenced by the manifest of \"${source}\"."
+            return 1
+        fi
+        _artifacts_drop_other_variants "${name}" "${entry% *}"
+        name="${entry% *}"
+        digest="${entry#* }"
+
+        if _artifacts_local_lookup "${digest}" "${name}"; then
+            echo "Artifact \"${name}\" is already up-to-date (${digest}): skipping download."
+            continue
+        fi
+        pending+=("${digest} ${name}")
+        sources+=("${source}")
+    done
+
+    if [[ "${#pending[@]}" -eq 0 ]]; then
+        return
+    fi
+
+    local start elapsed
+    echo "Downloading ${#pending[@]} artifact(s) with up to ${parallel} concurrent transfer(s)..."
+    start="$(date +%s)"
+    if [[ -n "${ARTIFACTS_HTTP_URL:-}" ]]; then
+        _artifacts_http_get_many "${parallel}" "${segments}" "${pending[@]}"
+    else
+        _artifacts_lftp_get_many "${parallel}" "${segments}" "${pending[@]}"
+    fi
+    elapsed="$(( $(date +%s) - start ))"
+    echo "Downloaded ${#pending[@]} artifact(s) ($(printf '%s\n' "${pending[@]}" \
+        | cut -d' ' -f2 | sed 's/$/.part/' | xargs -d '\n' du -ch \
+        | tail -n 1 | cut -f1)) in ${elapsed} second(s)."
+
+    # Verify the digests of all the downloaded artifacts concurrently:
+    printf '%s\n' "${pending[@]}" | xargs -d '\n' -P "${parallel}" -n 1 \
+        bash -c 'set -- $0
+                 if [[ "$(sha256sum < "$2.part" | cut -d" " -f1)" != "$1" ]]; then
+                     echo >&2 "Artifact \"$2\" does not match its expected digest."
+                     rm -f "$2.part"
+                     exit 255
+                 fi
+                 mv -f "$2.part" "$2"'
+
+    local index item
+    for index in "${!pending[@]}"; do
+        item="${pending[${index}]}"
+        _artifacts_account download "${sources[${index}]}" \
+            "$(stat -c %s "${item#* }")"
+        _artifacts_cache_store "${item% *}" "${item#* }"
+    done
+}
+
+# Download into "<name>.part" files the blobs given as "<digest> <name>"
+# arguments following the maximum number of concurrent transfers and the
+# number of segments per transfer, through the artifacts HTTP service.
+_artifacts_http_get_many() {
+    local parallel="${1:?}" segments="${2:?}"
+    shift 2
+    # The transfers are run by separate shells (see xargs) which get the
+    # definitions of the functions and settings they need:
+    printf '%s\n' "$@" | xargs -d '\n' -P "${parallel}" -n 1 bash -c "
+        $(declare -f artifacts_object_path _artifacts_curl \
+                     _artifacts_http_size _artifacts_http_fetch \
+                     _artifacts_http_get)
+        $(declare -p ARTIFACTS_HTTP_ATTEMPTS ARTIFACTS_HTTP_MIN_SEGMENT_SIZE)"'
+        set -u -o pipefail
+        set -- $0
+        _artifacts_http_get "$(artifacts_object_path "$1")" "$2.part" '"${segments}"'
+        '
+}
+
+# Download into "<name>.part" files the blobs given as "<digest> <name>"
+# arguments following the maximum number of concurrent transfers and the
+# number of segments per transfer, through one session with the artifacts FTP
+# server (whose transfers log is printed afterwards).
+_artifacts_lftp_get_many() {
+    local parallel="${1:?}" segments="${2:?}"
+    shift 2
+
+    local lftpscript xferlog item status=0
+    lftpscript="$(mktemp)"
+    xferlog="$(mktemp)"
+    cat > "${lftpscript}" <<END_OF_LFTP_SCRIPT
+set xfer:clobber yes
+set xfer:log yes
+set xfer:log-file "${xferlog}"
+set cmd:queue-parallel ${parallel}
+END_OF_LFTP_SCRIPT
+    for item in "$@"; do
+        echo "queue pget -c -n ${segments} \"$(artifacts_object_path "${item% *}")\" -o \"${item#* }.part\"" \
+            >> "${lftpscript}"
+    done
+    echo "wait all" >> "${lftpscript}"
+
+    _artifacts_lftp < "${lftpscript}" || status=$?
+    echo "Transfers summary (per-artifact throughput):"
+    cat "${xferlog}"
+    rm -f "${lftpscript}" "${xferlog}"
+    return "${status}"
+}
+
+# vim: set ts=4 sts=4 sw=4 et ft=sh:
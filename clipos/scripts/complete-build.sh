@@ -13,81 +13,341 @@ set -x
 : "${produce_cache_artifacts:?}"
 : "${reuse_cache_artifacts:?}"
 : "${produce_build_artifacts:?}"
+: "${SDKS_ARTIFACTS_PATH_ON_FTP:?}"
+: "${CACHE_ARTIFACTS_PATH_ON_FTP:?}"
+: "${use_recipe_results_cache:?}"
+: "${RECIPE_RESULTS_PATH_ON_FTP:?}"
 
+# This script either runs a single phase of a recipe (if both BUILD_PHASE and
+# BUILD_RECIPE are set) or all the recipes of the dependency graph given by
+# RECIPES_GRAPH (see run_recipes_graph below).
 
-reuse-or-bootstrap_sdk() {
+# Note: the artifacts helper functions (artifacts_archive, artifacts_extract,
+# etc.) and the source tree helper functions (source_tree_fingerprint) are
+# expected to be defined beforehand (see "artifacts.sh" and "source-tree.sh").
+
+
+#
+# Recipe results cache (the results of the build, image and configure phases
+# of a recipe are stored as artifacts keyed by the fingerprint of the recipe
+# inputs in order to skip these phases when these inputs are unchanged):
+#
+
+# Print the fingerprint of the inputs of the recipe given as first argument:
+# the fingerprint of the source tree (including the toolkit, the flavor of the
+# build environment and the build scripts, see source_tree_fingerprint) and
+# the digests of the SDK artifacts among the recipes it depends on (given by
+# RECIPE_DEPENDENCIES), either reused from the buildmaster or produced by this
+# build. Fail if the SDK of a dependency is bootstrapped without being
+# archived as its contents cannot be identified then.
+recipe_fingerprint() {
+    local recipe="${1:?}" dependency name entry digest inputs
+    inputs="recipe ${recipe}"$'\n'"source-tree $(source_tree_fingerprint)" \
+        || return 1
+    for dependency in ${RECIPE_DEPENDENCIES:-}; do
+        name="sdk:${dependency%/*}.${dependency#*/}.tar"
+        digest=""
+        if [[ "${reuse_sdks_artifacts:-0}" -ne 0 ]]; then
+            entry="$(artifacts_remote_manifest "${SDKS_ARTIFACTS_PATH_ON_FTP}" \
+                     | artifacts_manifest_lookup /dev/stdin "${name}")" || return 1
+            digest="${entry#* }"
+        elif [[ "${produce_sdks_artifacts:-0}" -ne 0 ]]; then
+            # The archive has just been (re)created by phase_archive_sdk:
+            digest="$(artifacts_local_digest "artifacts/sdks/${name}")"
+        fi
+        if [[ -z "${digest}" ]]; then
+            echo >&2 "Could not identify the SDK of ${dependency}."
+            return 1
+        fi
+        inputs+=$'\n'"dependency ${dependency} ${digest}"
+    done
+    echo "${inputs}" | sha256sum | cut -d' ' -f1
+}
+
+# The file recording the fingerprint of the inputs of the recipe given as
+# first argument and whether its results have been restored from the cache:
+recipe_results_marker() {
+    echo "out/.recipe-results/${1//\//:}"
+}
+
+# Restore the results of the recipe given as first argument from the cache if
+# they have already been produced for the same inputs (and return
+# successfully in that case).
+restore_recipe_results() {
+    local recipe="${1:?}" fingerprint marker
+    local artifact_name="result:${recipe%/*}.${recipe#*/}.tar"
+
+    if [[ "${use_recipe_results_cache:-0}" -eq 0 ]]; then
+        return 1
+    fi
+
+    if ! fingerprint="$(recipe_fingerprint "${recipe}")"; then
+        echo >&2 "Could not fingerprint the inputs of ${recipe}: not using the cache."
+        return 1
+    fi
+    marker="$(recipe_results_marker "${recipe}")"
+    mkdir -p "${marker%/*}"
+    echo "${fingerprint} miss" > "${marker}"
+
+    if ! artifacts_remote_has "${RECIPE_RESULTS_PATH_ON_FTP}/${fingerprint}" \
+            "${artifact_name}"; then
+        echo >&2 "No cached results for ${recipe} (inputs fingerprint ${fingerprint})."
+        return 1
+    fi
+    sudo rm -rf "cache/${recipe%/*}/"*"/${recipe#*/}" \
+        "out/${recipe%/*}/"*"/${recipe#*/}"
+    if ! artifacts_extract "${RECIPE_RESULTS_PATH_ON_FTP}/${fingerprint}" \
+            "${artifact_name}"; then
+        echo >&2 "Could not use cached results for ${recipe}. Proceeding..."
+        sudo rm -rf "cache/${recipe%/*}/"*"/${recipe#*/}" \
+            "out/${recipe%/*}/"*"/${recipe#*/}"
+        return 1
+    fi
+    echo "${fingerprint} hit" > "${marker}"
+}
+
+# Return successfully if the results of the recipe given as first argument
+# have been restored from the cache.
+are_recipe_results_restored() {
+    local fingerprint status
+    read -r fingerprint status 2>/dev/null \
+        < "$(recipe_results_marker "${1:?}")" || return 1
+    [[ "${status}" == "hit" ]]
+}
+
+# Store the results of the recipe given as first argument in the cache (unless
+# they have been restored from it).
+store_recipe_results() {
+    local recipe="${1:?}" fingerprint status marker
+    local artifact_name="result:${recipe%/*}.${recipe#*/}.tar"
+
+    marker="$(recipe_results_marker "${recipe}")"
+    if [[ "${use_recipe_results_cache:-0}" -eq 0 || ! -f "${marker}" ]]; then
+        return 0
+    fi
+    read -r fingerprint status < "${marker}"
+    if [[ "${status}" != "miss" ]]; then
+        return 0
+    fi
+
+    artifacts_archive --sudo "${marker%/*}/${artifact_name}" \
+        "cache/${recipe%/*}/"*"/${recipe#*/}" \
+        "out/${recipe%/*}/"*"/${recipe#*/}"
+    if artifacts_push "${RECIPE_RESULTS_PATH_ON_FTP}/${fingerprint}" \
+            $(artifacts_local_archives "${marker%/*}/${artifact_name}"); then
+        echo "${fingerprint} stored" > "${marker}"
+    else
+        echo >&2 "Could not store the results of ${recipe} in the cache. Proceeding..."
+    fi
+    artifacts_discard "${marker%/*}/${artifact_name}"
+}
+
+
+#
+# Phases of the recipes:
+#
+
+phase_bootstrap() {
     local product_name="${1%/*}"
     local recipe_name="${1#*/}"
     local artifact_name="sdk:${product_name:?}.${recipe_name:?}.tar"
 
     if [[ "${reuse_sdks_artifacts:-0}" -eq 0 ]]; then
         cosmk bootstrap "${product_name:?}/${recipe_name:?}"
-        if [[ "${produce_sdks_artifacts:-0}" -ne 0 ]]; then
-            mkdir -p artifacts/sdks
-            sudo bsdtar -cvpf "artifacts/sdks/${artifact_name}" \
-                "cache/${product_name?}/"*"/${recipe_name?}"
-            sudo chown "$UID:${GROUPS[0]}" "artifacts/sdks/${artifact_name}"
-        fi
     else
         sudo rm -rf "cache/${product_name?}/"*"/${recipe_name?}"
-        bsdtar -xvf "${artifact_name}"
+        artifacts_extract "${SDKS_ARTIFACTS_PATH_ON_FTP}" "${artifact_name}"
     fi
 }
 
-build-image-configure_recipe() {
+phase_archive_sdk() {
+    local product_name="${1%/*}"
+    local recipe_name="${1#*/}"
+    local artifact_name="sdk:${product_name:?}.${recipe_name:?}.tar"
+
+    if [[ "${reuse_sdks_artifacts:-0}" -eq 0 &&
+          "${produce_sdks_artifacts:-0}" -ne 0 ]]; then
+        mkdir -p artifacts/sdks
+        artifacts_archive --sudo "artifacts/sdks/${artifact_name}" \
+            "cache/${product_name?}/"*"/${recipe_name?}"
+    fi
+}
+
+phase_build() {
     local product_name="${1%/*}"
     local recipe_name="${1#*/}"
     local artifact_name="cache:${product_name:?}.${recipe_name:?}.tar"
 
+    if restore_recipe_results "${1:?}"; then
+        echo >&2 "Results of ${1} restored from the cache: skipping build."
+        return 0
+    fi
+
     if [[ "${reuse_cache_artifacts:-0}" -ne 0 ]]; then
         sudo rm -rf "cache/${product_name?}/"*"/${recipe_name?}"
-        if [[ -f "${artifact_name}" ]]; then
-            bsdtar -xvf "${artifact_name}"
-        else
-            echo >&2 "Could not use cache artifact because could not find \"${artifact_name}\" file. Proceeding..."
+        if ! artifacts_extract "${CACHE_ARTIFACTS_PATH_ON_FTP}" "${artifact_name}"; then
+            echo >&2 "Could not use cache artifact \"${artifact_name}\". Proceeding..."
         fi
     fi
 
     cosmk build "${product_name:?}/${recipe_name:?}"
+}
+
+phase_archive_cache() {
+    local product_name="${1%/*}"
+    local recipe_name="${1#*/}"
+    local artifact_name="cache:${product_name:?}.${recipe_name:?}.tar"
 
     if [[ "${produce_cache_artifacts:-0}" -ne 0 ]]; then
         mkdir -p artifacts/cache
-        sudo bsdtar -cvpf "artifacts/cache/${artifact_name}" \
+        artifacts_archive --sudo "artifacts/cache/${artifact_name}" \
             "cache/${product_name?}/"*"/${recipe_name?}"
-        sudo chown "$UID:${GROUPS[0]}" "artifacts/cache/${artifact_name}"
     fi
+}
+
+phase_image() {
+    if are_recipe_results_restored "${1:?}"; then
+        echo >&2 "Results of ${1} restored from the cache: skipping image."
+        return 0
+    fi
+    cosmk image "${1:?}"
+}
 
-    cosmk image "${product_name:?}/${recipe_name:?}"
-    cosmk configure "${product_name:?}/${recipe_name:?}"
+phase_configure() {
+    if are_recipe_results_restored "${1:?}"; then
+        echo >&2 "Results of ${1} restored from the cache: skipping configure."
+        return 0
+    fi
+    cosmk configure "${1:?}"
+    store_recipe_results "${1:?}"
 }
 
-bundle_recipe() {
+phase_bundle() {
+    cosmk bundle "${1:?}"
+}
+
+phase_archive_bundle() {
     local product_name="${1%/*}"
     local recipe_name="${1#*/}"
     local artifact_name="build:${product_name:?}.${recipe_name:?}.tar"
 
-    cosmk bundle "${product_name:?}/${recipe_name:?}"
-
     if [[ "${produce_build_artifacts:-0}" -ne 0 ]]; then
         mkdir -p artifacts/build
-        sudo bsdtar -cvpf "artifacts/build/${artifact_name}" \
+        artifacts_archive --sudo "artifacts/build/${artifact_name}" \
             "out/${product_name?}/"*"/${recipe_name?}/bundle"
-        sudo chown "$UID:${GROUPS[0]}" "artifacts/build/${artifact_name}"
     fi
 }
 
+
+#
+# Recipes (i.e. the sequences of phases to run for the recipes):
+#
+
+reuse-or-bootstrap_sdk() {
+    phase_bootstrap "${1:?}"
+    phase_archive_sdk "${1:?}"
+}
+
+build-image-configure_recipe() {
+    phase_build "${1:?}"
+    phase_archive_cache "${1:?}"
+    phase_image "${1:?}"
+    phase_configure "${1:?}"
+}
+
+bundle_recipe() {
+    phase_bundle "${1:?}"
+    phase_archive_bundle "${1:?}"
+}
+
 build-image-configure-bundle_recipe() {
     build-image-configure_recipe "${1:?}"
     bundle_recipe "${1:?}"
 }
 
-# Avoid leaving build results of previous run in out/:
-rm -rf out
+# Run the recipes of the dependency graph given on the standard input (one
+# recipe per line: the function to call for this recipe, the recipe and then
+# the recipes it depends on) concurrently as soon as their dependencies are
+# done, with at most RECIPES_MAX_PARALLEL_JOBS recipes at once (0 means one
+# recipe per 8 CPUs). The output of each recipe is prefixed by its name.
+run_recipes_graph() {
+    local -A actions=() dependencies=() running=()
+    local -a pending=()
+    local action recipe deps
+    while read -r action recipe deps; do
+        [[ -n "${recipe}" ]] || continue
+        actions["${recipe}"]="${action}"
+        dependencies["${recipe}"]="${deps}"
+        pending+=("${recipe}")
+    done
+
+    local max_jobs="${RECIPES_MAX_PARALLEL_JOBS}"
+    if [[ "${max_jobs}" -le 0 ]]; then
+        max_jobs="$(( $(nproc) / 8 > 1 ? $(nproc) / 8 : 1 ))"
+    fi
+
+    local -A finished=()
+    local failed=0 pid status dep ready still_pending
+    while [[ "${#pending[@]}" -gt 0 || "${#running[@]}" -gt 0 ]]; do
+        # Start the recipes whose dependencies are all done:
+        still_pending=()
+        for recipe in "${pending[@]}"; do
+            ready=1
+            for dep in ${dependencies["${recipe}"]}; do
+                [[ -n "${finished["${dep}"]:-}" ]] || ready=0
+            done
+            if [[ "${failed}" -eq 0 && "${ready}" -eq 1 &&
+                  "${#running[@]}" -lt "${max_jobs}" ]]; then
+                echo >&2 ">>> Starting ${actions["${recipe}"]} ${recipe}"
+                RECIPE_DEPENDENCIES="${dependencies["${recipe}"]}" \
+                    "${actions["${recipe}"]}" "${recipe}" \
+                    > >(sed -u "s|^|[${recipe}] |") 2>&1 &
+                running["$!"]="${recipe}"
+            else
+                still_pending+=("${recipe}")
+            fi
+        done
+        pending=("${still_pending[@]+"${still_pending[@]}"}")
+
+        if [[ "${#running[@]}" -eq 0 ]]; then
+            if [[ "${failed}" -eq 0 ]]; then
+                echo >&2 "Unsatisfiable dependencies for: ${pending[*]}"
+                failed=1
+            fi
+            break
+        fi
+
+        # Wait for any recipe to finish:
+        status=0
+        wait -n -p pid "${!running[@]}" || status=$?
+        recipe="${running["${pid}"]}"
+        unset "running[${pid}]"
+        if [[ "${status}" -eq 0 ]]; then
+            echo >&2 ">>> Done with ${recipe}"
+            finished["${recipe}"]=1
+        else
+            # Let the running recipes finish but do not start any other:
+            echo >&2 ">>> Failed ${recipe} (exit status ${status})"
+            failed=1
+        fi
+    done
+    return "${failed}"
+}
+
+if [[ -n "${BUILD_PHASE:-}" && -n "${BUILD_RECIPE:-}" ]]; then
+    "phase_${BUILD_PHASE}" "${BUILD_RECIPE}"
+
+    # Mark this phase as completed (for the builds to resume):
+    mkdir -p "${BUILD_PHASES_MARKERS_DIR:?}"
+    touch "${BUILD_PHASES_MARKERS_DIR}/${BUILD_RECIPE//\//:}:${BUILD_PHASE}"
+else
+    : "${RECIPES_GRAPH:?}"
+    : "${RECIPES_MAX_PARALLEL_JOBS:?}"
+
+    # Avoid leaving build results of previous run in out/:
+    rm -rf out
 
-reuse-or-bootstrap_sdk clipos/sdk
-reuse-or-bootstrap_sdk clipos/sdk_debian
-build-image-configure-bundle_recipe clipos/core
-build-image-configure-bundle_recipe clipos/efiboot
-bundle_recipe clipos/qemu
+    run_recipes_graph <<< "${RECIPES_GRAPH}"
+fi
 
 # vim: set ts=4 sts=4 sw=4 et ft=sh:
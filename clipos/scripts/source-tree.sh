@@ -0,0 +1,117 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+# Copyright © 2019 ANSSI. All rights reserved.
+
+# Helper functions to fingerprint the CLIP OS source tree. This file is not
+# meant to be executed but to be sourced by the build steps commands (see the
+# skipBuildIfSourceTreeUnchanged method of the factories and the
+# "complete-build.sh" file).
+#
+# The source tree is described by the revisions of its projects, either as
+# checked out in the synchronized source tree or as resolved on the remote
+# repositories from the manifest before any synchronization. Both give the
+# same fingerprint for the same revisions: a build can thus be skipped before
+# synchronizing its source tree if this one is unchanged since a previous
+# build.
+
+# The script printing the path, the fetch URL and the revision of each project
+# of the manifest read from the standard input (the URL of the manifest
+# repository being given as first argument). The fetch URLs are resolved as
+# repo does.
+_SOURCE_TREE_MANIFEST_PROJECTS_SCRIPT='
+import re
+import sys
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+manifest_url = sys.argv[1].rstrip("/")
+root = ET.parse(sys.stdin).getroot()
+default = root.find("default")
+default = default.attrib if default is not None else {}
+remotes = {remote.get("name"): remote.attrib
+           for remote in root.findall("remote")}
+
+def fetch_url(fetch):
+    fetch = fetch.rstrip("/")
+    # Handle the manifest URLs without scheme (e.g. "host:path") as repo:
+    if manifest_url.find(":") != manifest_url.find("/") - 1:
+        return re.sub(r"^gopher://", "", urllib.parse.urljoin(
+            "gopher://" + manifest_url, fetch))
+    return urllib.parse.urljoin(manifest_url, fetch)
+
+for project in root.findall("project"):
+    remote = remotes[project.get("remote", default.get("remote"))]
+    revision = (project.get("revision") or remote.get("revision") or
+                default.get("revision"))
+    print(project.get("path", project.get("name")),
+          "{}/{}".format(fetch_url(remote["fetch"]).rstrip("/"),
+                         project.get("name")),
+          revision)
+'
+
+# Print the digest of the manifest of the source tree (as a "manifest <digest>"
+# line) followed by the revisions of its projects (as "project <path>
+# <revision>" lines sorted by path).
+#
+# By default, these are the revisions checked out in the synchronized source
+# tree of the current directory. With the "--remote" option, these are
+# resolved on the remote repositories from the manifest given by the
+# REPO_MANIFEST_URL and REPO_MANIFEST_BRANCH environment variables (along with
+# the local manifest given by the LOCAL_MANIFEST_XML environment variable if
+# set) without synchronizing any project.
+source_tree_revisions() {
+    if [[ "${1:-}" != "--remote" ]]; then
+        echo "manifest $(repo manifest -o - | sha256sum | cut -d' ' -f1)"
+        repo forall -c 'echo "project ${REPO_PATH} $(git rev-parse HEAD)"' \
+            | LC_ALL=C sort
+        return
+    fi
+
+    local scratch status=0
+    scratch="$(mktemp -d)"
+    (
+        set -e -u -o pipefail
+        cd "${scratch}"
+        repo init --manifest-url="${REPO_MANIFEST_URL:?}" \
+            --manifest-branch="${REPO_MANIFEST_BRANCH:?}" >&2
+        if [[ -n "${LOCAL_MANIFEST_XML:-}" ]]; then
+            mkdir -p .repo/local_manifests
+            echo "${LOCAL_MANIFEST_XML}" \
+                > .repo/local_manifests/local_manifest.xml
+        fi
+        repo manifest -o - > manifest.xml
+        echo "manifest $(sha256sum < manifest.xml | cut -d' ' -f1)"
+        python3 -c "${_SOURCE_TREE_MANIFEST_PROJECTS_SCRIPT}" \
+                "${REPO_MANIFEST_URL}" < manifest.xml \
+            | xargs -L 1 -P "$(nproc)" bash -c '
+                set -e -u -o pipefail
+                path="$0" url="$1" revision="$2"
+                if [[ ! "${revision}" =~ ^[0-9a-f]{40}$ ]]; then
+                    if [[ "${revision}" != refs/* ]]; then
+                        revision="refs/heads/${revision}"
+                    fi
+                    revision="$(git ls-remote "${url}" "${revision}" \
+                                | awk "NR == 1 { print \$1 }")" || revision=""
+                    if [[ -z "${revision}" ]]; then
+                        echo >&2 "Could not resolve the revision of ${path} on ${url}."
+                        exit 255  # stop xargs
+                    fi
+                fi
+                echo "project ${path} ${revision}"'
+    ) | LC_ALL=C sort || status=$?
+    rm -rf "${scratch}"
+    return "${status}"
+}
+
+# Print the fingerprint of the source tree (see source_tree_revisions for the
+# "--remote" option) along with the flavor of the build environment and the
+# digest of the build scripts (given by the BUILD_ENVIRONMENT_FLAVOR and
+# BUILD_SCRIPTS_DIGEST environment variables).
+source_tree_fingerprint() {
+    local revisions
+    revisions="$(source_tree_revisions "$@")" || return 1
+    printf '%s\n' "environment ${BUILD_ENVIRONMENT_FLAVOR:-}" \
+        "scripts ${BUILD_SCRIPTS_DIGEST:-}" "${revisions}" \
+        | sha256sum | cut -d' ' -f1
+}
+
+# vim: set ts=4 sts=4 sw=4 et ft=sh:
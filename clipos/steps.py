@@ -5,16 +5,23 @@
 derivatives) buildbot instances"""
 
 import os
+import re
 import shlex
 import textwrap
+import time
 
 from typing import Optional, List, Dict, Union, Any, Sequence
 
 # Convenience shorter names:
+from buildbot.data import resultspec
 from buildbot.plugins import steps, util
+from buildbot.process import buildstep, logobserver
 from buildbot.process.properties import Property
+from buildbot.process.results import SKIPPED, SUCCESS
+from buildbot.reporters.utils import getURLForBuild
+from twisted.internet import defer
 
-from .commons import line  # utility functions and stuff
+from .commons import line, read_text_file  # utility functions and stuff
 
 
 class ToolkitEnvironmentShellCommand(steps.ShellCommand):
@@ -51,4 +58,202 @@ class ToolkitEnvironmentShellCommand(steps.ShellCommand):
             raise TypeError("command is not of expected type")
 
 
+class ArtifactsShellCommand(steps.ShellCommand):
+    """Shell command step with the buildmaster artifacts helper functions
+    available (see the ``scripts/artifacts.sh`` file for details)"""
+
+    # The path to the file defining the artifacts helper functions:
+    LIBRARY_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                "scripts/artifacts.sh")
+
+    @classmethod
+    def library(cls) -> str:
+        """Returns the contents of the artifacts helper functions file"""
+
+        return read_text_file(cls.LIBRARY_FILE)
+
+    @classmethod
+    def wrap(cls, command: str) -> List[str]:
+        """Returns the command line running the given shell command with the
+        artifacts helper functions defined (this is handy for the steps that
+        cannot derive from this class such as `SetPropertyFromCommand`)"""
+
+        if not isinstance(command, str):
+            raise TypeError("command is not of expected type")
+        return ["/usr/bin/env", "bash", "-c",
+                "{library}\n\nset -e -u -o pipefail\n\n{command}".format(
+                    library=cls.library(),
+                    command=command,
+                )]
+
+    # The lines reporting the bytes transferred by the artifacts helper
+    # functions (see ``_artifacts_account`` in "scripts/artifacts.sh"):
+    TRANSFER_REPORT_RE = re.compile(
+        r"^artifacts-transfer: (upload|download) ([\w.-]+) (\d+)$")
+
+    # The build property accounting the bytes transferred by the build for
+    # each direction and artifact type (e.g. "download:sdks"):
+    TRANSFERRED_BYTES_PROPERTY = "artifacts_transferred_bytes"
+
+    def __init__(self, command: str, *args: Any, **kwargs: Any) -> None:
+        super().__init__(command=self.wrap(command), *args, **kwargs)
+        self.transferred_bytes = {}  # type: Dict[str, int]
+        self.addLogObserver("stdio", logobserver.LineConsumerLogObserver(
+            self._consumeTransferReports))
+
+    def _consumeTransferReports(self):
+        while True:
+            _, line = yield
+            match = self.TRANSFER_REPORT_RE.match(line.strip())
+            if match:
+                direction, artifact_type, count = match.groups()
+                key = "{}:{}".format(direction, artifact_type)
+                self.transferred_bytes[key] = (
+                    self.transferred_bytes.get(key, 0) + int(count))
+
+    def commandComplete(self, cmd: Any) -> None:
+        super().commandComplete(cmd)
+        if self.transferred_bytes:
+            accounted = dict(self.getProperty(
+                self.TRANSFERRED_BYTES_PROPERTY) or {})
+            for key, count in self.transferred_bytes.items():
+                accounted[key] = accounted.get(key, 0) + count
+            self.setProperty(self.TRANSFERRED_BYTES_PROPERTY, accounted,
+                             "ArtifactsShellCommand")
+
+
+class RepoSync(steps.Repo):
+    """Repo step (initializing, synchronizing and clobbering-and-retrying
+    once on failure as the Buildbot one does) running the synchronization in
+    two phases with a parallelism of their own: the network fetch of the
+    projects (``jobs``) and then their local checkout (``checkoutJobs``).
+    The durations of both phases are recorded in build properties (see
+    `NETWORK_SECONDS_PROPERTY` and `CHECKOUT_SECONDS_PROPERTY`).
+
+    :param checkoutJobs: the number of jobs of the local checkout phase
+        (defaults to the number of jobs of the network fetch phase)
+
+    """
+
+    renderables = ["checkoutJobs"]
+
+    # The build properties recording the durations (in seconds) of the
+    # network fetch and local checkout phases of the synchronization:
+    NETWORK_SECONDS_PROPERTY = "repo_sync_network_seconds"
+    CHECKOUT_SECONDS_PROPERTY = "repo_sync_checkout_seconds"
+
+    def __init__(self, checkoutJobs: Union[int, Property, None] = None,
+                 **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.checkoutJobs = checkoutJobs
+
+    @defer.inlineCallbacks
+    def _repoCmd(self, command: List[str], abandonOnFailure: bool = True,
+                 **kwargs: Any) -> Any:
+        if command[:1] != ["sync"]:
+            rc = yield super()._repoCmd(command, abandonOnFailure, **kwargs)
+            return rc
+
+        start = time.monotonic()
+        rc = yield super()._repoCmd(command + ["--network-only"],
+                                    abandonOnFailure, **kwargs)
+        self.setProperty(self.NETWORK_SECONDS_PROPERTY,
+                         round(time.monotonic() - start), "RepoSync")
+
+        if self.checkoutJobs:
+            command = ([arg for arg in command if not arg.startswith("-j")] +
+                       ["-j{}".format(self.checkoutJobs)])
+        start = time.monotonic()
+        rc = yield super()._repoCmd(command + ["--local-only"],
+                                    abandonOnFailure, **kwargs)
+        self.setProperty(self.CHECKOUT_SECONDS_PROPERTY,
+                         round(time.monotonic() - start), "RepoSync")
+        return rc
+
+
+class SkipBuildIfUnchanged(buildstep.BuildStep):
+    """Step ending the build (successfully) if a previous successful build of
+    the same builder has already been done with the same fingerprint of its
+    inputs and the same values of the given build properties: the remaining
+    steps are then skipped (except the ones to always run) and the build
+    links to this previous build.
+
+    This step is itself skipped unless the ``skip_build_if_unchanged`` build
+    property is set.
+
+    :param fingerprint_property: the build property holding the fingerprint
+        of the inputs of the build (to be computed by a previous step)
+    :param key_properties: the names of the build properties that must also
+        match (e.g. the ones selecting the artifacts to produce)
+    :param lookback: the number of the latest successful builds to look the
+        previous build up in
+
+    """
+
+    name = "skip build if unchanged"
+    description = "look for a previous build of the same inputs"
+    descriptionDone = "inputs changed"
+
+    # The build property recording the previous build that has already been
+    # done with the same inputs (if this build has been skipped):
+    UNCHANGED_SINCE_PROPERTY = "unchanged_since_build"
+
+    def __init__(self, fingerprint_property: str,
+                 key_properties: Sequence[str] = (), lookback: int = 50,
+                 **kwargs: Any) -> None:
+        kwargs.setdefault("doStepIf", lambda step: bool(
+            step.getProperty("skip_build_if_unchanged")))
+        kwargs.setdefault("hideStepIf",
+                          lambda results, step: results == SKIPPED)
+        super().__init__(**kwargs)
+        self.fingerprint_property = fingerprint_property
+        self.key_properties = list(key_properties)
+        self.lookback = lookback
+
+    def _key(self, properties: Dict[str, Any]) -> List[Any]:
+        return [properties.get(name) for name in
+                [self.fingerprint_property, *self.key_properties]]
+
+    @defer.inlineCallbacks
+    def run(self) -> Any:
+        current = {name: self.getProperty(name) for name in
+                   [self.fingerprint_property, *self.key_properties]}
+        if not current[self.fingerprint_property]:
+            self.descriptionDone = "no fingerprint of the inputs"
+            return SUCCESS
+
+        builderid = yield self.build.getBuilderId()
+        builds = yield self.master.data.get(
+            ("builders", builderid, "builds"),
+            filters=[resultspec.Filter("results", "eq", [SUCCESS])],
+            order=["-number"], limit=self.lookback)
+        for build in builds:
+            if build["number"] == self.build.number:
+                continue
+            properties = yield self.master.data.get(
+                ("builds", build["buildid"], "properties"))
+            properties = {name: value for name, (value, _) in
+                          (properties or {}).items()}
+            if self._key(properties) != self._key(current):
+                continue
+
+            # Link to the build that actually did the job (the matching
+            # build may have been skipped itself):
+            url = properties.get(self.UNCHANGED_SINCE_PROPERTY)
+            if not url:
+                url = getURLForBuild(self.master, builderid,
+                                     build["number"])
+            self.setProperty(self.UNCHANGED_SINCE_PROPERTY, url,
+                             "SkipBuildIfUnchanged")
+            yield self.addURL("previous build of the same inputs", url)
+            self.descriptionDone = "no changes since build #{}".format(
+                build["number"])
+            # End the build as a halting step would do (the steps to always
+            # run are still run):
+            self.build.terminate = True
+            return SUCCESS
+
+        return SUCCESS
+
+
 # vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
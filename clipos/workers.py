@@ -1,18 +1,33 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 # Copyright © 2019 ANSSI. All rights reserved.
 
+import functools
+import os
 import re
+import socket
 import string
 
 from typing import Any, Optional, List, Dict
 
 import buildbot
 import buildbot.worker.docker
+from buildbot.process.properties import Properties
+from twisted.internet import defer, reactor, threads
+from twisted.python import log
 
 # Convenience shorter names:
 from buildbot.plugins import steps, util
 
 
+@functools.lru_cache(maxsize=None)
+def buildmaster_fqdn() -> str:
+    """Returns the fully qualified domain name of the buildmaster host. This is
+    resolved once and only when needed, as this may block on DNS (hence out of
+    the reactor thread, see `DockerLatentWorker.startService`)."""
+
+    return socket.getfqdn()
+
+
 class DockerLatentWorker(buildbot.worker.docker.DockerLatentWorker):
     """Docker latent worker for CLIP OS project builds
 
@@ -54,14 +69,39 @@ class DockerLatentWorker(buildbot.worker.docker.DockerLatentWorker):
     # buildbot.tac of the worker for more details):
     WORKSPACES_DIR = "/var/buildbot/worker/workspaces"
 
+    # The directory (on the same volume as the workspaces so that the cached
+    # artifacts can be hard-linked into them) holding the artifacts blobs kept
+    # by the worker across builds:
+    ARTIFACTS_CACHE_DIR = os.path.join(WORKSPACES_DIR, ".artifacts-cache")
+
+    # The directory (on the same volume as the workspaces so that moving files
+    # there is a mere rename) where the workspaces contents to delete are put
+    # aside before being removed in the background:
+    WORKSPACES_TRASH_DIR = os.path.join(WORKSPACES_DIR, ".trash")
+
+    # The directory (on the same volume as the workspaces) holding the
+    # snapshots of the source trees synchronized by the worker (one per
+    # manifest revision) and the writable layers mounted on top of them:
+    WORKSPACES_SNAPSHOTS_DIR = os.path.join(WORKSPACES_DIR, ".snapshots")
+
     # The name to use for the Docker images tags of the CLIP OS build
     # environment/buildbot Dockerized workers:
     DOCKER_IMAGE_TAG_PREFIX = "clipos_buildbot-worker"
 
+    # The location in the Docker container where the host-side repo mirror
+    # (if any) is bind-mounted:
+    REPO_MIRROR_DIR = "/var/buildbot/repo-mirror"
+
     # The name to use for the Docker images tags of the CLIP OS build
     # environment/buildbot Dockerized workers:
     DOCKER_VOLUME_NAME_FOR_WORKSPACES_PREFIX = "clipos_buildbot-worker-workspaces"
 
+    # The delay (in seconds) before starting again a warm pool worker once its
+    # container has been stopped (doubled after each failed start of the
+    # container in advance, up to the maximum delay):
+    WARM_POOL_REFILL_DELAY = 5
+    WARM_POOL_REFILL_MAX_DELAY = 30 * 60
+
     @classmethod
     def docker_image_tag(cls, flavor: str):
         return "{}:{}".format(cls.DOCKER_IMAGE_TAG_PREFIX, flavor)
@@ -69,18 +109,32 @@ class DockerLatentWorker(buildbot.worker.docker.DockerLatentWorker):
     def __init__(self,
                  flavor: str,
                  docker_host: str,
-                 buildmaster_host_for_dockerized_workers: str,
+                 buildmaster_host_for_dockerized_workers: Optional[str],
                  privileged: bool = False,
                  container_network_mode: Optional[str] = None,
+                 repo_mirror_host_dir: Optional[str] = None,
+                 repo_mirror_writable: bool = False,
+                 pool_index: int = 0,
+                 pool_size: int = 1,
+                 warm: bool = False,
                  **kwargs: Any) -> None:
         # Custom properties:
         self.flavor = flavor
         self.privileged = privileged
+        self.docker_host_uri = docker_host
+        self.repo_mirror_host_dir = repo_mirror_host_dir
+
+        self.warm = warm
+        self._stopping = False
+        self._warm_up_failures = 0  # consecutive failed starts in advance
 
         # Forge the name to use for this worker:
         name = self.flavor
         if self.privileged:
             name += "_privileged"
+        self.pool_name = name
+        if pool_index:
+            name += "_{}".format(pool_index)
 
         docker_image = self.docker_image_tag(self.flavor)
 
@@ -105,9 +159,19 @@ class DockerLatentWorker(buildbot.worker.docker.DockerLatentWorker):
             pass
         properties.update({
             "clipos_docker_image_flavor": self.flavor,
+            # Whether the builds can mount filesystems (see the workspace
+            # snapshots of the build factories):
+            "clipos_docker_worker_privileged": self.privileged,
+            # The number of workers sharing the disk budgets of this kind of
+            # worker (see the artifacts cache and the workspace snapshots of
+            # the build factories):
+            "clipos_docker_worker_pool_size": max(pool_size, 1),
         })
 
-        # The volume name to host the worker workspaces
+        # The volume name to host the worker workspaces (each worker of a warm
+        # pool gets its own volume as the workers of a pool may run builds of
+        # the same builder concurrently: the disk space taken by the
+        # workspaces is therefore multiplied by the size of the pool):
         self.docker_volume_name_for_workspaces = "{}_{}".format(
             self.DOCKER_VOLUME_NAME_FOR_WORKSPACES_PREFIX,
             re.sub('[^A-Za-z0-9]+', '_', name))
@@ -121,6 +185,14 @@ class DockerLatentWorker(buildbot.worker.docker.DockerLatentWorker):
         volumes.append('{volume_name}:{workspaces_dir}'.format(
             volume_name=self.docker_volume_name_for_workspaces,
             workspaces_dir=self.WORKSPACES_DIR))
+        if repo_mirror_host_dir:
+            # Only the worker maintaining the repo mirror is allowed to alter
+            # it, all the others share it read-only (and so share its Git
+            # objects in the host page cache):
+            volumes.append('{host_dir}:{mirror_dir}:{mode}'.format(
+                host_dir=repo_mirror_host_dir,
+                mirror_dir=self.REPO_MIRROR_DIR,
+                mode="rw" if repo_mirror_writable else "ro"))
 
         # and then call parent init that will do the rest of the work:
         super().__init__(
@@ -132,8 +204,10 @@ class DockerLatentWorker(buildbot.worker.docker.DockerLatentWorker):
             password=None,
 
             # Tell to the Docker worker to be created to join the Buildmaster
-            # to the proper IP address:
-            masterFQDN=buildmaster_host_for_dockerized_workers,
+            # to the proper IP address (an empty value prevents the parent
+            # class from resolving the buildmaster FQDN upon configuration
+            # loading, see createEnvironment):
+            masterFQDN=buildmaster_host_for_dockerized_workers or "",
 
             # Our Docker settings:
             image=docker_image,
@@ -149,4 +223,75 @@ class DockerLatentWorker(buildbot.worker.docker.DockerLatentWorker):
             **kwargs,  # the rest of the parameters
         )
 
+    @defer.inlineCallbacks
+    def startService(self):
+        yield super().startService()
+        self._stopping = False
+        if not self.masterFQDN:
+            # Resolve the buildmaster FQDN for the containers to be started
+            # (see createEnvironment) without blocking the reactor:
+            yield threads.deferToThread(buildmaster_fqdn)
+        if self.warm:
+            reactor.callLater(0, self._warmUp)
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        self._stopping = True
+        yield super().stopService()
+
+    @defer.inlineCallbacks
+    def insubstantiate(self, *args: Any, **kwargs: Any):
+        yield super().insubstantiate(*args, **kwargs)
+        # Refill the warm pool with a fresh container (backing off while the
+        # containers fail to start):
+        if self.warm and self.running and not self._stopping:
+            reactor.callLater(
+                min(self.WARM_POOL_REFILL_DELAY * 2 ** self._warm_up_failures,
+                    self.WARM_POOL_REFILL_MAX_DELAY),
+                self._warmUp)
+
+    def createEnvironment(self, *args: Any, **kwargs: Any) -> Dict[str, str]:
+        environment = super().createEnvironment(*args, **kwargs)
+        if not self.masterFQDN:
+            # Already resolved (and cached) upon the service start:
+            environment["BUILDMASTER"] = buildmaster_fqdn()
+        return environment
+
+    def renderWorkerProps(self, build):
+        if build is None:
+            # The worker is started in advance for the warm pool (i.e. without
+            # any build to render the container settings for), none of those
+            # settings being a renderable anyway:
+            build = Properties()
+        return super().renderWorkerProps(build)
+
+    def _warmUp(self) -> None:
+        """Start the container of this worker (if not already started) without
+        waiting for a build to require it."""
+
+        if not self.running or self._stopping:
+            return
+        def succeeded(result):
+            self._warm_up_failures = 0
+
+        def failed(failure):
+            self._warm_up_failures += 1
+            log.err(failure, "while warming up worker {} ({} failure(s) in "
+                    "a row)".format(self.name, self._warm_up_failures))
+
+        d = self.substantiate(None, None)
+        d.addCallbacks(succeeded, failed)
+
+    def running_builds_on_docker_host(self) -> int:
+        """Returns the number of builds currently running on all the Dockerized
+        workers (this one included) sharing the Docker host of this worker."""
+
+        return sum(
+            len([wfb for wfb in worker.workerforbuilders.values()
+                 if wfb.isBusy()])
+            for worker in self.master.workers.workers.values()
+            if (isinstance(worker, DockerLatentWorker) and
+                worker.docker_host_uri == self.docker_host_uri)
+        )
+
 # vim: set ft=python ts=4 sts=4 sw=4 et tw=79:
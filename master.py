@@ -80,23 +80,45 @@ all_clipos_docker_latent_workers = []
 for flavor in clipos.workers.DockerLatentWorker.FLAVORS:
     # Generate both privileged and unprivileged versions of container workers:
     for privileged in [False, True]:
-        worker = clipos.workers.DockerLatentWorker(
-            flavor=flavor,
-            privileged=privileged,
-            container_network_mode=setup.docker_worker_containers_network_mode,
-            docker_host=setup.docker_host_uri,
-            buildmaster_host_for_dockerized_workers=setup.buildmaster_host_for_dockerized_workers,
-
-            # By default, max_builds is unlimited, reduce this:
-            max_builds=5,  # TODO: any better heuristic?
-        )
-        all_clipos_docker_latent_workers.append(worker)
-
-        if flavor == reference_worker_flavor:
-            if privileged:
-                privileged_reference_workers.append(worker)
-            else:
-                unprivileged_reference_workers.append(worker)
+        # The workers kept started in advance (if any) for this flavor and
+        # privilege level:
+        warm_pool_size = setup.docker_worker_warm_pool_sizes.get(
+            flavor + ("_privileged" if privileged else ""), 0)
+        extra_kwargs = {}
+        if warm_pool_size:
+            extra_kwargs["build_wait_timeout"] = (
+                setup.docker_worker_warm_pool_idle_timeout or -1)
+
+        for pool_index in range(max(warm_pool_size, 1)):
+            worker = clipos.workers.DockerLatentWorker(
+                flavor=flavor,
+                privileged=privileged,
+                container_network_mode=setup.docker_worker_containers_network_mode,
+                docker_host=setup.docker_host_uri,
+                buildmaster_host_for_dockerized_workers=setup.buildmaster_host_for_dockerized_workers,
+
+                # The repo mirror is maintained by the repo-sync builder (which
+                # runs on the unprivileged reference worker):
+                repo_mirror_host_dir=setup.repo_mirror_host_dir,
+                repo_mirror_writable=(flavor == reference_worker_flavor and
+                                      not privileged),
+
+                pool_index=pool_index,
+                pool_size=warm_pool_size,
+                warm=bool(warm_pool_size),
+
+                # The number of builds is not limited per worker but by the
+                # capacity of the Docker host (see docker_host_capacity below).
+
+                **extra_kwargs,
+            )
+            all_clipos_docker_latent_workers.append(worker)
+
+            if flavor == reference_worker_flavor:
+                if privileged:
+                    privileged_reference_workers.append(worker)
+                else:
+                    unprivileged_reference_workers.append(worker)
 
 c['workers'] = [
     # The worker for the Docker operations (create Docker images to be used as
@@ -116,6 +138,15 @@ c['workers'] = [
 # particular build will only take place on one worker.
 #
 
+# All the builds run on the Docker host: each builder declares the estimated
+# resources its builds require and a build is only started when the Docker host
+# has room for it.
+docker_host_capacity = clipos.capacity.DockerHostCapacity(
+    cpus=setup.docker_host_cpus,
+    memory_gib=setup.docker_host_memory_gib,
+    disk_gib=setup.docker_host_disk_gib,
+)
+
 # Builders that build the CLIP OS Dockerized build environment images to be
 # then used by the clipos.workers.DockerLatentWorker:
 docker_buildenv_image_builders = []
@@ -137,6 +168,10 @@ for flavor, props in clipos.workers.DockerLatentWorker.FLAVORS.items():
 
             factory=clipos.build_factories.BuildDockerImage(
                 flavor=flavor, buildmaster_setup=setup),
+
+            canStartBuild=docker_host_capacity.admission(
+                'docker-worker-image env:{}'.format(flavor),
+                clipos.capacity.BuildCost(cpus=2, memory_gib=2, disk_gib=10)),
         )
     )
 
@@ -163,6 +198,21 @@ repo_sync_builder = util.BuilderConfig(
         # Pass on the buildmaster setup settings
         buildmaster_setup=setup,
     ),
+
+    canStartBuild=docker_host_capacity.admission(
+        'repo-sync',
+        clipos.capacity.BuildCost(cpus=2, memory_gib=2, disk_gib=100)),
+)
+
+# The CLIP OS builds are by far the heaviest ones:
+CLIPOS_BUILD_COST = clipos.capacity.BuildCost(cpus=16, memory_gib=16,
+                                              disk_gib=150)
+
+# The CLIP OS builders all share the same build factory (this spares
+# generating its many steps for each of them upon each configuration load):
+clipos_product_build_factory = clipos.build_factories.ClipOsProductBuildBuildFactory(
+    # Pass on the buildmaster setup settings
+    buildmaster_setup=setup,
 )
 
 # CLIP OS complete build on all the Docker latent worker flavors:
@@ -178,10 +228,14 @@ for flavor in clipos.workers.DockerLatentWorker.FLAVORS:
             worker.name for worker in all_clipos_docker_latent_workers
             if worker.flavor == flavor and worker.privileged
         ],
-        factory=clipos.build_factories.ClipOsProductBuildBuildFactory(
-            # Pass on the buildmaster setup settings
-            buildmaster_setup=setup,
-        ),
+        factory=clipos_product_build_factory,
+
+        canStartBuild=docker_host_capacity.admission(
+            builder_name, CLIPOS_BUILD_COST),
+
+        # Do not queue several identical builds while a build is running
+        # (e.g. when changes keep coming in):
+        collapseRequests=clipos.schedulers.collapse_identical_requests,
     )
     # Keep a reference on the reference builder environment for the nightly
     # scheduler:
@@ -194,10 +248,10 @@ clipos_ondemand_builder = util.BuilderConfig(
     tags=['clipos', 'on-demand',
           'docker-env:{}'.format(reference_worker_flavor)],
     workernames=[w.name for w in privileged_reference_workers],
-    factory=clipos.build_factories.ClipOsProductBuildBuildFactory(
-        # Pass on the buildmaster setup settings
-        buildmaster_setup=setup,
-    ),
+    factory=clipos_product_build_factory,
+
+    canStartBuild=docker_host_capacity.admission(
+        'clipos ondemand', CLIPOS_BUILD_COST),
 )
 
 
@@ -239,14 +293,64 @@ repo_sync_nightly_sched = schedulers.Nightly(
     },
 )
 
+# Whether the changes of the CLIP OS sources are notified to the buildmaster
+# (see the CHANGESOURCES section below):
+clipos_sources_changes_notified = bool(setup.webhook_changes_enabled or
+                                       setup.gerrit_stream_events)
+
+# The changes of the CLIP OS sources (i.e. of the manifest or of any of its
+# projects) that matter to the CLIP OS builds:
+clipos_master_changes_filter = clipos.schedulers.clipos_sources_change_filter(
+    branch="master",
+    # The changes of this buildbot configuration do not affect the builds:
+    excluded_repositories=[setup.config_git_clone_url],
+)
+
 # CLIP OS builds schedulers:
-clipos_incremental_build_intraday_sched = schedulers.Nightly(
+clipos_incremental_build_on_changes_sched = clipos.schedulers.ManifestChangesScheduler(
+    name='clipos-master-on-changes-incremental-build',
+    builderNames=[
+        reference_clipos_builder.name,
+    ],
+    change_filter=clipos_master_changes_filter,
+    # Coalesce the bursts of changes into a single build:
+    treeStableTimer=setup.changes_tree_stable_timer,
+    codebases={"": {
+        "repository": setup.clipos_manifest_git_url,
+        "branch": "master",
+    }},
+    properties={
+        "cleanup_workspace": True,
+        "force_repo_quicksync_artifacts_download": False,
+        "buildername_providing_repo_quicksync_artifacts": repo_sync_builder.name,
+
+        "produce_sdks_artifacts": False,
+        "reuse_sdks_artifacts": True,
+        "buildername_providing_sdks_artifacts": reference_clipos_builder.name,
+
+        "produce_cache_artifacts": False,
+        "reuse_cache_artifacts": True,
+        "buildername_providing_cache_artifacts": reference_clipos_builder.name,
+
+        "produce_build_artifacts": True,
+
+        "use_recipe_results_cache": True,
+
+        "skip_build_if_unchanged": True,
+    },
+)
+
+clipos_incremental_build_intraday_sched = clipos.schedulers.ManifestChangesNightly(
     name='clipos-master-intraday-incremental-build',
     builderNames=[
         reference_clipos_builder.name,
     ],
     dayOfWeek='1,2,3,4,5',  # only work days: from Monday (1) to Friday (5)
     hour=12, minute=30,  # at 12:30 (i.e. during lunch)
+    # Skip this build if nothing changed since the previous one (this can
+    # only be known if the changes are notified):
+    change_filter=clipos_master_changes_filter,
+    onlyIfChanged=clipos_sources_changes_notified,
     codebases={"": {
         "repository": setup.clipos_manifest_git_url,
         "branch": "master",
@@ -265,6 +369,10 @@ clipos_incremental_build_intraday_sched = schedulers.Nightly(
         "buildername_providing_cache_artifacts": reference_clipos_builder.name,
 
         "produce_build_artifacts": True,
+
+        "use_recipe_results_cache": True,
+
+        "skip_build_if_unchanged": True,
     },
 )
 
@@ -291,6 +399,10 @@ clipos_build_nightly_sched = schedulers.Nightly(
         "reuse_cache_artifacts": False,
 
         "produce_build_artifacts": True,
+
+        "use_recipe_results_cache": True,
+
+        "skip_build_if_unchanged": True,
     },
 )
 
@@ -317,6 +429,8 @@ clipos_build_weekly_sched = schedulers.Nightly(
         "reuse_cache_artifacts": False,
 
         "produce_build_artifacts": True,
+
+        "use_recipe_results_cache": True,
     },
 )
 
@@ -344,6 +458,13 @@ docker_buildenv_image_rebuild_force_sched = schedulers.ForceScheduler(
     builderNames=[
         *(builder.name for builder in docker_buildenv_image_builders),
     ],
+    properties=[
+        util.BooleanParameter(
+            name="refresh_docker_image",
+            label="Rebuild the image from scratch (i.e. without reusing any cached layer)",
+            default=False,
+        ),
+    ],
     codebases=oneCodebase(
         project=None,
         repository=setup.config_git_clone_url,
@@ -372,6 +493,11 @@ repo_sync_force_sched = schedulers.ForceScheduler(
         util.FixedParameter(
             "cleanup_workspace", default=True,
         ),
+        util.BooleanParameter(
+            name="produce_repo_quicksync_baseline",
+            label="Archive the complete \".repo\" directory rather than a delta against the latest baseline",
+            default=False,
+        ),
     ],
 )
 
@@ -466,6 +592,29 @@ clipos_custom_build_force_sched = schedulers.ForceScheduler(
                         label="Force the fetch of the source tree quick-sync artifacts",
                         default=False,
                     ),
+                    util.ChoiceStringParameter(
+                        name="product_build_mode",
+                        label="Product build mode (stepwise: one step per recipe phase)",
+                        choices=["concurrent", "stepwise"],
+                        default="concurrent",
+                    ),
+                    util.BooleanParameter(
+                        name="resume_product_build",
+                        label="Resume the stepwise product build from the phases completed in the workspace (overrides the workspace cleanup)",
+                        default=False,
+                    ),
+                    util.ChoiceStringParameter(
+                        name="artifacts_transfer_mode",
+                        label="Artifacts transfer mode (streamed artifacts never land on the worker volume)",
+                        choices=["file", "stream"],
+                        default=setup.artifacts_transfer_mode,
+                    ),
+                    util.ChoiceStringParameter(
+                        name="artifacts_compression",
+                        label="Compression of the produced artifacts",
+                        choices=["none", "zstd:1", "zstd:3", "zstd:9", "zstd:19"],
+                        default=setup.artifacts_compression,
+                    ),
                 ],
             ),
 
@@ -517,6 +666,18 @@ clipos_custom_build_force_sched = schedulers.ForceScheduler(
                         label="Produce build result artifacts and upload them on the buildmaster",
                         default=False,
                     ),
+
+                    util.BooleanParameter(
+                        name="use_recipe_results_cache",
+                        label="Skip the build of the recipes whose inputs are unchanged by restoring their cached results",
+                        default=True,
+                    ),
+
+                    util.BooleanParameter(
+                        name="skip_build_if_unchanged",
+                        label="Skip the build if a previous successful build has already been done from the same source tree revisions",
+                        default=False,
+                    ),
                 ],
             ),
 
@@ -525,6 +686,9 @@ clipos_custom_build_force_sched = schedulers.ForceScheduler(
 )
 
 c['schedulers'] = [
+    # Change-based schedulers:
+    clipos_incremental_build_on_changes_sched,
+
     # Intra-day schedulers:
     clipos_incremental_build_intraday_sched,
 
@@ -553,16 +717,24 @@ c['schedulers'] = [
 
 c['change_source'] = []
 
-# TODO, FIXME: Declare a proper change_source poller:
-#if setup.config_git_clone_url:
-#    c['change_source'].append(
-#        changes.GitPoller(
-#            repourl=setup.config_git_clone_url,
-#            workdir='gitpoller-workdir',
-#            branch=setup.config_git_revision,
-#            pollInterval=600,     # every 10 minutes
-#        )
-#    )
+# The changes of the CLIP OS sources are pushed to the buildmaster (rather
+# than polled) either by the Gerrit server hosting them (via its stream-events)
+# or through the buildmaster web hook (see
+# clipos.buildmaster.SetupSettings.webhook_changes_enabled), e.g. from a
+# replication hook or by hand with:
+#   curl -F repository=<URL> -F project=<name> -F branch=master \
+#       -F revision=<sha1> <buildbot URL>/change_hook/base
+if setup.gerrit_stream_events:
+    c['change_source'].append(
+        changes.GerritChangeSource(
+            gerritserver=setup.gerrit_stream_events["server"],
+            gerritport=setup.gerrit_stream_events["port"],
+            username=setup.gerrit_stream_events["username"],
+            identity_file=setup.gerrit_stream_events["identity_file"],
+            # Only the merges matter (not the patchsets under review):
+            handled_events=("ref-updated",),
+        )
+    )
 
 
 
@@ -578,6 +750,13 @@ c['configurators'] = [
         dayOfWeek=0,  # on Sundays
         hour=12, minute=0,  # at noon
     ),
+
+    # Collect the garbage of the artifacts directory (outdated builds, stale
+    # uploads, unreferenced blobs, etc.) every 3 hours:
+    clipos.janitor.ArtifactsJanitorConfigurator(
+        setup,
+        hour=list(range(0, 24, 3)), minute=30,
+    ),
 ]
 
 
@@ -592,5 +771,22 @@ c['configurators'] = [
 
 c['services'] = []
 
+# Expose the artifacts directory to the workers over HTTP (with resumable and
+# range transfers) if requested:
+if setup.artifacts_http_port:
+    c['services'].append(clipos.artifacts.ArtifactsService(
+        artifacts_dir=setup.artifacts_dir,
+        port=setup.artifacts_http_port,
+        interface=setup.artifacts_http_interface,
+    ))
+
+# Expose the build metrics (step durations, artifacts transfers, build queues,
+# etc.) to be scraped locally by Prometheus if requested:
+if setup.metrics_port:
+    c['services'].append(clipos.metrics.MetricsService(
+        port=setup.metrics_port,
+        interface=setup.metrics_interface,
+    ))
+
 
 # vim: set ft=python ts=4 sts=4 sw=4 tw=79 et: